@@ -33,12 +33,19 @@ GOOGLE_CLIENT_ID = config('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = config('GOOGLE_CLIENT_SECRET')
 if not GOOGLE_CLIENT_ID:
     raise Exception("GOOGLE_CLIENT_ID no está configurado en las variables de entorno.")
+# Claves públicas con las que se verifican los ID tokens (veluxapp/google_auth.py)
+GOOGLE_JWKS_URL = config('GOOGLE_JWKS_URL', default='https://www.googleapis.com/oauth2/v3/certs')
 
 # === JWT CONFIG ===
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    # Comprueba la lista negra con un filtro de Bloom en memoria (veluxapp/autenticacion.py)
+    'TOKEN_REFRESH_SERIALIZER': 'veluxapp.serializers.CustomTokenRefreshSerializer',
 }
+# Segundos que cada proceso reutiliza el filtro de tokens revocados (veluxapp/autenticacion.py) si
+# la caché del catálogo no es compartida: retraso máximo con el que un logout surte efecto en otro proceso
+JWT_REVOCADOS_TTL = config('JWT_REVOCADOS_TTL', default=30, cast=int)
 
 # === APPLICATIONS ===
 INSTALLED_APPS = [
@@ -67,7 +74,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'backend.middleware.WhiteNoiseAsyncMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -76,9 +83,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-# === URLS & WSGI ===
+# === URLS, WSGI & ASGI ===
 ROOT_URLCONF = 'backend.urls'
 WSGI_APPLICATION = 'backend.wsgi.application'
+# El proceso web usa ASGI por defecto (gunicorn.conf.py, SERVIDOR=asgi|wsgi)
+ASGI_APPLICATION = 'backend.asgi.application'
+# Hilos por proceso para las llamadas bloqueantes a Google y Spaces de las vistas async (veluxapp/asincrono.py)
+HILOS_IO_EXTERNA = config('HILOS_IO_EXTERNA', default=64, cast=int)
 APPEND_SLASH = True
 
 # === TEMPLATES ===
@@ -119,10 +130,49 @@ else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': BASE_DIR / 'db.sqlite3',
+            'NAME': config('SQLITE_PATH', default=BASE_DIR / 'db.sqlite3'),
         }
     }
 
+# === CACHE ===
+# La caché 'catalogo' guarda las respuestas públicas del catálogo (veluxapp/cache.py).
+# CATALOGO_CACHE: 'locmem' (LRU en memoria, por proceso), 'file' o 'redis'.
+CATALOGO_CACHE = config('CATALOGO_CACHE', default='locmem')
+CATALOGO_CACHE_TIMEOUT = config('CATALOGO_CACHE_TIMEOUT', default=3600, cast=int)
+
+if CATALOGO_CACHE == 'redis':
+    _catalogo_cache = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('CATALOGO_CACHE_LOCATION', default='redis://127.0.0.1:6379/1'),
+    }
+elif CATALOGO_CACHE == 'file':
+    _catalogo_cache = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': config('CATALOGO_CACHE_LOCATION', default=os.path.join(BASE_DIR, 'cache', 'catalogo')),
+        'OPTIONS': {'MAX_ENTRIES': config('CATALOGO_CACHE_MAX_ENTRIES', default=5000, cast=int)},
+    }
+else:
+    _catalogo_cache = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalogo',
+        'OPTIONS': {'MAX_ENTRIES': config('CATALOGO_CACHE_MAX_ENTRIES', default=1000, cast=int)},
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalogo': {**_catalogo_cache, 'TIMEOUT': CATALOGO_CACHE_TIMEOUT},
+}
+
+# === IMÁGENES ===
+# Hilos que generan las variantes redimensionadas de las imágenes de producto (0 = en el propio proceso, tras el commit)
+IMAGENES_VARIANTES_WORKERS = config('IMAGENES_VARIANTES_WORKERS', default=2, cast=int)
+
+# === CARRITO ===
+# Días sin actividad tras los que `manage.py limpiar_carritos` borra un carrito de invitado
+CARRITO_INVITADO_TTL_DIAS = config('CARRITO_INVITADO_TTL_DIAS', default=30, cast=int)
+
 # === PASSWORD VALIDATION ===
 AUTH_PASSWORD_VALIDATORS = [
     { 'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator' },
@@ -186,9 +236,9 @@ CORS_ALLOWED_ORIGINS = [
     "https://www.chibifeelgood.com",
 ]
 CORS_ALLOW_CREDENTIALS = True
-CORS_EXPOSE_HEADERS = ['X-Session-Key']
+CORS_EXPOSE_HEADERS = ['X-Session-Key', 'ETag']  # ETag: partes de subidas multipart en desarrollo
 CORS_ALLOW_HEADERS = [
-    'x-session-key', 'content-type', 'authorization', 'accept', 'accept-encoding',
+    'x-session-key', 'x-paginacion', 'idempotency-key', 'content-type', 'authorization', 'accept', 'accept-encoding',
     'dnt', 'origin', 'user-agent', 'x-csrftoken', 'x-requested-with',
 ]
 CORS_ALLOW_METHODS = ['DELETE', 'GET', 'OPTIONS', 'POST', 'PUT', 'PATCH']
@@ -203,11 +253,13 @@ if USE_SPACES:
     DO_SPACES_SECRET = config('DO_SPACES_SECRET')
     DO_SPACES_NAME = config('DO_SPACES_NAME')
     DO_SPACES_REGION = config('DO_SPACES_REGION')
+    # Se puede apuntar a otro servicio compatible con S3 (p. ej. benchmarks/bench_asgi.py)
+    DO_SPACES_ENDPOINT = config('DO_SPACES_ENDPOINT', default=f'https://{DO_SPACES_REGION}.digitaloceanspaces.com')
 
     AWS_ACCESS_KEY_ID = DO_SPACES_KEY
     AWS_SECRET_ACCESS_KEY = DO_SPACES_SECRET
     AWS_STORAGE_BUCKET_NAME = DO_SPACES_NAME
-    AWS_S3_ENDPOINT_URL = f'https://{DO_SPACES_REGION}.digitaloceanspaces.com'
+    AWS_S3_ENDPOINT_URL = DO_SPACES_ENDPOINT
     AWS_S3_REGION_NAME = DO_SPACES_REGION
     AWS_LOCATION = 'static'
     AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.{AWS_S3_REGION_NAME}.cdn.digitaloceanspaces.com'
@@ -222,9 +274,9 @@ if USE_SPACES:
     MEDIA_URL = f'https://{AWS_STORAGE_BUCKET_NAME}.{AWS_S3_REGION_NAME}.cdn.digitaloceanspaces.com/media/'
 
 
-
-    FILE_UPLOAD_MAX_MEMORY_SIZE = 52428800
-    DATA_UPLOAD_MAX_MEMORY_SIZE = 52428800
+    # Los archivos grandes del panel van directos a Spaces (subidas multipart, ver
+    # veluxapp/subidas.py); lo que aún pase por Django usa los límites por defecto
+    # (2,5 MB en memoria; por encima se vuelca a un archivo temporal).
 else:
     DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
     MEDIA_URL = '/media/'
@@ -1,5 +1,13 @@
 # backend/storages_backends.py
 
+import hashlib
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
 from storages.backends.s3boto3 import S3Boto3Storage
 from decouple import config
 
@@ -10,7 +18,129 @@ from decouple import config
 #     file_overwrite = True
 
 
+# Conexiones HTTP que el cliente compartido mantiene abiertas (una por hilo concurrente)
+MAX_CONEXIONES_S3 = config('S3_MAX_CONEXIONES', default=25, cast=int)
+
+_cliente_s3 = None
+_clase_recurso_s3 = None
+_cliente_s3_lock = threading.Lock()
+_recursos_s3 = threading.local()
+
+
+def get_s3_client():
+    """
+    Cliente S3 de Spaces compartido por todo el proceso. Crear una sesión y un
+    cliente cuesta decenas de ms (carga del modelo de botocore y resolución del
+    endpoint); los clientes de boto3 son thread-safe, así que basta con uno.
+    """
+    global _cliente_s3, _clase_recurso_s3
+    if _cliente_s3 is None:
+        with _cliente_s3_lock:
+            if _cliente_s3 is None:
+                region = config('DO_SPACES_REGION', default=None)
+                session = boto3.session.Session(
+                    aws_access_key_id=config('DO_SPACES_KEY', default=None),
+                    aws_secret_access_key=config('DO_SPACES_SECRET', default=None),
+                )
+                opciones = {
+                    'region_name': region,
+                    'endpoint_url': config(
+                        'DO_SPACES_ENDPOINT', default=f'https://{region}.digitaloceanspaces.com' if region else None,
+                    ),
+                    'config': Config(max_pool_connections=MAX_CONEXIONES_S3),
+                }
+                # La clase del recurso se genera una vez; después se instancia sobre el cliente compartido
+                _clase_recurso_s3 = type(session.resource('s3', **opciones))
+                _cliente_s3 = session.client('s3', **opciones)
+    return _cliente_s3
+
+
+def get_s3_resource():
+    """
+    Recurso S3 (el que usa django-storages) sobre el cliente compartido. Los
+    recursos de boto3 no son thread-safe, así que hay uno por hilo, pero crearlo
+    no cuesta nada: no carga modelos ni abre conexiones.
+    """
+    cliente = get_s3_client()
+    recurso = getattr(_recursos_s3, 'recurso', None)
+    if recurso is None or recurso.meta.client is not cliente:
+        recurso = _recursos_s3.recurso = _clase_recurso_s3(client=cliente)
+    return recurso
+
+
 class MediaStorage(S3Boto3Storage):
     location = ""
     default_acl = "public-read"
     file_overwrite = False
+
+    @property
+    def connection(self):
+        # Mismas credenciales que AWS_* en settings (ambas salen de DO_SPACES_*)
+        return get_s3_resource()
+
+
+def clave_media(nombre):
+    """
+    Clave en el bucket del archivo `nombre` de MediaStorage (el valor que se
+    guarda en imagen1/2/3). Las subidas directas firman esta clave para que el
+    objeto quede justo donde el storage lo lee.
+    """
+    storage = MediaStorage()
+    return storage._normalize_name(storage._clean_name(nombre))
+
+
+class ContenidoDireccionadoMixin:
+    """
+    Nombra cada archivo por el SHA-256 de su contenido, conservando la carpeta
+    (upload_to) y la extensión: productos/foto.jpg -> productos/<sha256>.jpg.
+    Si ya existe un archivo con ese nombre no se vuelve a subir, así que la misma
+    foto subida varias veces ocupa un solo objeto. Como varios registros pueden
+    apuntar al mismo archivo, quien borra debe comprobar antes que nadie más lo
+    usa (ver veluxapp/imagenes.py).
+    """
+    tamano_bloque = 64 * 1024
+
+    def nombre_por_contenido(self, name, content):
+        sha = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for bloque in content.chunks(self.tamano_bloque):
+            sha.update(bloque)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        carpeta = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(carpeta, f'{sha.hexdigest()}{extension}').replace('\\', '/')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        return self.guardar_derivado(self.nombre_por_contenido(name, content), content, max_length)
+
+    def guardar_derivado(self, name, content, max_length=None):
+        """
+        Guarda `content` con un nombre ya determinado por el contenido (p. ej. una
+        variante de una imagen direccionada) sin recalcular el hash. No sube nada
+        si el archivo ya existe.
+        """
+        if self.exists(name):
+            # El último producto que lo usaba pudo dejar su borrado en la cola: se cancela
+            # para que el worker no lo borre antes de que se vea el registro nuevo. Si el
+            # worker ya lo tenía entre manos, cancelar espera a que termine y entonces
+            # el archivo ya no existe y se vuelve a subir.
+            from veluxapp.borrados import cancelar_borrado  # veluxapp.models importa este módulo
+
+            cancelar_borrado(name)
+            if self.exists(name):
+                return name
+        return super().save(name, content, max_length)
+
+
+class MediaStorageDireccionado(ContenidoDireccionadoMixin, MediaStorage):
+    pass
+
+
+class FileSystemStorageDireccionado(ContenidoDireccionadoMixin, FileSystemStorage):
+    pass
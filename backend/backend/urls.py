@@ -13,7 +13,7 @@ from rest_framework_simplejwt.views import TokenObtainPairView as OriginalTokenO
 from veluxapp.serializers import CustomTokenObtainPairSerializer
 
 # Importamos nuestras vistas de autenticación personalizadas
-from veluxapp.views_auth import RegisterView, UserProfileView, LogoutView, GoogleAuthView
+from veluxapp.views_auth import RegisterView, UserProfileView, LogoutView, google_auth
 
 
 class CustomTokenObtainPairView(OriginalTokenObtainPairView):
@@ -33,7 +33,7 @@ urlpatterns = [
     path('api/register/', RegisterView.as_view(), name='auth_register'),
     path('api/me/', UserProfileView.as_view(), name='user_profile'),
     path('api/logout/', LogoutView.as_view(), name='auth_logout'),
-    path('api/auth/google/', GoogleAuthView.as_view(), name='google_auth'),
+    path('api/auth/google/', google_auth, name='google_auth'),
 
     path('api/', include('veluxapp.urls')),
     # 3. VELUXAPP (tus APIs): Se accede via /api/categorias/, /api/productos/, /api/cart/, etc.
@@ -0,0 +1,71 @@
+# benchmarks/_entorno.py
+"""
+Utilidades comunes para los benchmarks: configura Django, crea una base de datos
+de prueba desechable (nunca toca la real) y mide latencias.
+
+Uso: desde backend/, `python benchmarks/<script>.py` con las mismas variables de
+entorno que manage.py (DEBUG=True usa SQLite; DEBUG=False usa PostgreSQL).
+"""
+import os
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+
+@contextmanager
+def base_de_datos_de_prueba():
+    import django
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    nombre_original = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(nombre_original, verbosity=0)
+        teardown_test_environment()
+
+
+def medir(funcion, repeticiones=20, calentamiento=2):
+    """
+    Ejecuta `funcion` varias veces y devuelve (p50, p95) en milisegundos.
+    """
+    for _ in range(calentamiento):
+        funcion()
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    p95 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]
+    return statistics.median(tiempos), p95
+
+
+def contar_consultas(funcion):
+    """
+    Ejecuta `funcion` y devuelve el número de consultas SQL que lanzó.
+    """
+    from django.db import connection
+
+    # execute_wrapper en lugar de CaptureQueriesContext: el log de consultas se
+    # queda en las últimas 9000
+    total = 0
+
+    def contar(execute, sql, params, many, context):
+        nonlocal total
+        total += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(contar):
+        funcion()
+    return total
@@ -0,0 +1,328 @@
+# benchmarks/bench_asgi.py
+"""
+Prueba de carga del proceso web con gunicorn.conf.py en modo WSGI (workers
+síncronos) y en modo ASGI (workers de uvicorn): peticiones/s, p50 y p99 con 50,
+200 y 1000 clientes concurrentes. Google y Spaces se sustituyen por un servidor
+local que responde con una latencia fija (--latencia), así que la prueba no sale
+de la máquina.
+
+Escenarios:
+- catalogo: GET anónimo de /api/productos/?page=1..5 (caché de respuestas)
+- google:   POST /api/auth/google/ con ID tokens firmados por una clave local
+            (JWKS servido por el sustituto)
+- subidas:  POST /api/subidas/ de un admin (CreateMultipartUpload contra el S3 local)
+
+    python benchmarks/bench_asgi.py [--clientes 50 200 1000] [--duracion 10]
+        [--workers 2] [--latencia 0.05] [--escenarios catalogo google subidas]
+
+No usa _entorno.py: el servidor corre en otros procesos y necesita una base de
+datos SQLite en disco (desechable, en un directorio temporal). Con SQLite las
+escrituras concurrentes de `google` (un INSERT en token_blacklist por login) se
+serializan; en producción (PostgreSQL) no hay ese cuello de botella.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+CLIENT_ID = 'bench-cliente'
+USUARIOS_GOOGLE = 200
+TIMEOUT = 60
+
+SEMILLA = '''
+import json
+import sys
+import django
+django.setup()
+from django.contrib.auth import get_user_model
+from veluxapp.models import Categoria_Productos, Productos
+from veluxapp.serializers import CustomTokenObtainPairSerializer
+
+User = get_user_model()
+categorias = [Categoria_Productos.objects.create(nombre=f'Categoria {i}') for i in range(8)]
+productos = Productos.objects.bulk_create([
+    Productos(nombre=f'Producto {i}', lista_caracteristicas='marca: Chibi', precio=1000 + i,
+              imagen1=f'productos/foto_{i % 10}.jpg')
+    for i in range(200)
+])
+for i, producto in enumerate(productos):
+    producto.categoria.set(categorias[i % 8:i % 8 + 2])
+# Usuarios de Google ya completos: el login no hace UPDATE
+User.objects.bulk_create([
+    User(username=f'google{i}', email=f'google{i}@example.com', password='!', first_name='G',
+         last_name='B', profile_picture='https://example.com/g.jpg', google_id=str(i))
+    for i in range(int(sys.argv[1]))
+])
+admin = User.objects.create_user(username='admin', password='!', is_staff=True)
+print(json.dumps({'admin': str(CustomTokenObtainPairSerializer.get_token(admin).access_token)}))
+'''
+
+
+# ------------------- Sustituto de Google y Spaces --------------------------
+class Sustituto(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latencia = 0
+    jwks = b''
+
+    def log_message(self, *args):
+        pass
+
+    def responder(self, codigo, cuerpo=b'', tipo='application/xml', **cabeceras):
+        time.sleep(self.latencia)
+        self.send_response(codigo)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        for nombre, valor in cabeceras.items():
+            self.send_header(nombre.replace('_', '-'), valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_GET(self):
+        # JWKS de Google (GOOGLE_JWKS_URL)
+        self.responder(200, self.jwks, 'application/json', Cache_Control='public, max-age=3600')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        # S3: CreateMultipartUpload (?uploads) o CompleteMultipartUpload (?uploadId=)
+        if 'uploads' in urlsplit(self.path).query:
+            cuerpo = (
+                '<?xml version="1.0" encoding="UTF-8"?><InitiateMultipartUploadResult>'
+                f'<Bucket>bench</Bucket><Key>x</Key><UploadId>{uuid.uuid4().hex}</UploadId>'
+                '</InitiateMultipartUploadResult>'
+            )
+        else:
+            cuerpo = '<?xml version="1.0" encoding="UTF-8"?><CompleteMultipartUploadResult/>'
+        self.responder(200, cuerpo.encode())
+
+    def do_DELETE(self):
+        self.responder(204)
+
+
+class ServidorSustituto(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def servir_sustituto(puerto, jwks, latencia):
+    Sustituto.jwks = jwks
+    Sustituto.latencia = latencia
+    ServidorSustituto(('127.0.0.1', puerto), Sustituto).serve_forever()
+
+
+# ------------------- Cliente de carga --------------------------
+async def leer_respuesta(reader):
+    cabecera = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+    lineas = cabecera.split('\r\n')
+    estado = int(lineas[0].split()[1])
+    cabeceras = {}
+    for linea in lineas[1:]:
+        if ':' in linea:
+            nombre, valor = linea.split(':', 1)
+            cabeceras[nombre.strip().lower()] = valor.strip()
+    if cabeceras.get('transfer-encoding') == 'chunked':
+        while True:
+            tamano = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(tamano + 2)
+            if tamano == 0:
+                break
+    else:
+        await reader.readexactly(int(cabeceras.get('content-length', 0)))
+    cerrar = cabeceras.get('connection', '').lower() == 'close' or lineas[0].startswith('HTTP/1.0')
+    return estado, cerrar
+
+
+def peticion_http(puerto, metodo, ruta, cuerpo=None, cabeceras=None):
+    datos = json.dumps(cuerpo).encode() if cuerpo is not None else b''
+    lineas = [f'{metodo} {ruta} HTTP/1.1', f'Host: 127.0.0.1:{puerto}', f'Content-Length: {len(datos)}']
+    if cuerpo is not None:
+        lineas.append('Content-Type: application/json')
+    lineas += [f'{nombre}: {valor}' for nombre, valor in (cabeceras or {}).items()]
+    return ('\r\n'.join(lineas) + '\r\n\r\n').encode() + datos
+
+
+async def cliente(puerto, generar, fin, latencias, errores):
+    reader = writer = None
+    while time.perf_counter() < fin:
+        inicio = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', puerto)
+            writer.write(generar())
+            estado, cerrar = await asyncio.wait_for(leer_respuesta(reader), TIMEOUT)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            errores.append(time.perf_counter() - inicio)
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.05)
+            continue
+        if estado >= 400:
+            errores.append(time.perf_counter() - inicio)
+        else:
+            latencias.append(time.perf_counter() - inicio)
+        if cerrar:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def carga(puerto, generar, clientes, duracion):
+    latencias, errores = [], []
+    inicio = time.perf_counter()
+    fin = inicio + duracion
+    await asyncio.gather(*(cliente(puerto, generar, fin, latencias, errores) for _ in range(clientes)))
+    return latencias, errores, time.perf_counter() - inicio
+
+
+def percentil(valores, p):
+    if not valores:
+        return float('nan')
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p))] * 1000
+
+
+# ------------------- Escenarios --------------------------
+def escenarios(puerto, clave_google, admin):
+    def catalogo():
+        return peticion_http(puerto, 'GET', f'/api/productos/?page={random.randint(1, 5)}')
+
+    ahora = int(time.time())
+    tokens = [
+        jwt.encode({
+            'iss': 'https://accounts.google.com', 'aud': CLIENT_ID, 'sub': str(i), 'iat': ahora,
+            'exp': ahora + 3600, 'email': f'google{i}@example.com', 'email_verified': True, 'given_name': 'G',
+        }, clave_google, algorithm='RS256', headers={'kid': 'bench'})
+        for i in range(USUARIOS_GOOGLE)
+    ]
+
+    def google():
+        return peticion_http(puerto, 'POST', '/api/auth/google/', {'id_token': random.choice(tokens)})
+
+    def subidas():
+        return peticion_http(puerto, 'POST', '/api/subidas/', {
+            'nombre': 'video.mp4', 'sha256': uuid.uuid4().hex * 2, 'tamano': 1000,
+        }, {'Authorization': f'Bearer {admin}'})
+
+    return {'catalogo': catalogo, 'google': google, 'subidas': subidas}
+
+
+# ------------------- Servidor --------------------------
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def arrancar(modo, env, workers, log):
+    puerto = puerto_libre()
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{puerto}',
+         '--workers', str(workers), '--backlog', '2048', '--timeout', '120', '--log-level', 'warning'],
+        cwd=BASE_DIR, env={**env, 'SERVIDOR': modo}, stdout=log, stderr=log,
+    )
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{puerto}/api/categorias/', timeout=5) as r:
+                if r.status == 200:
+                    return proceso, puerto
+        except OSError:
+            time.sleep(0.5)
+    proceso.terminate()
+    log.flush()
+    with open(log.name) as f:
+        raise RuntimeError(f'gunicorn ({modo}) no arrancó:\n{f.read()[-2000:]}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clientes', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--duracion', type=float, default=10, help='Segundos de carga por medición.')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--latencia', type=float, default=0.05, help='Latencia del sustituto de Google/S3 (s).')
+    parser.add_argument('--escenarios', nargs='+', default=['catalogo', 'google', 'subidas'])
+    parser.add_argument('--modos', nargs='+', default=['wsgi', 'asgi'])
+    args = parser.parse_args()
+
+    # Un descriptor por cliente
+    _, maximo = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (maximo, maximo))
+
+    clave_google = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(clave_google.public_key()))
+    jwks = json.dumps({'keys': [{**jwk, 'kid': 'bench', 'alg': 'RS256', 'use': 'sig'}]}).encode()
+    puerto_sustituto = puerto_libre()
+    sustituto = multiprocessing.Process(
+        target=servir_sustituto, args=(puerto_sustituto, jwks, args.latencia), daemon=True,
+    )
+    sustituto.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            'DJANGO_SECRET_KEY': os.environ.get('DJANGO_SECRET_KEY', 'bench'),
+            'DEBUG': 'True',  # SQLite
+            'SQLITE_PATH': os.path.join(tmp, 'bench.sqlite3'),
+            'ALLOWED_HOSTS': '127.0.0.1',
+            'GOOGLE_CLIENT_ID': CLIENT_ID,
+            'GOOGLE_CLIENT_SECRET': 'bench',
+            'GOOGLE_JWKS_URL': f'http://127.0.0.1:{puerto_sustituto}/certs',
+            'USE_SPACES': 'True',
+            'DO_SPACES_KEY': 'bench',
+            'DO_SPACES_SECRET': 'bench',
+            'DO_SPACES_NAME': 'bench',
+            'DO_SPACES_REGION': 'nyc3',
+            'DO_SPACES_ENDPOINT': f'http://127.0.0.1:{puerto_sustituto}',
+            'DJANGO_SETTINGS_MODULE': 'backend.settings',
+        }
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '-v', '0'], cwd=BASE_DIR, env=env, check=True)
+        semilla = subprocess.run(
+            [sys.executable, '-c', SEMILLA, str(USUARIOS_GOOGLE)],
+            cwd=BASE_DIR, env=env, check=True, capture_output=True, text=True,
+        )
+        admin = json.loads(semilla.stdout.strip().splitlines()[-1])['admin']
+
+        print(f'{os.cpu_count()} CPU, {args.workers} workers, latencia de Google/S3 {args.latencia * 1000:.0f} ms, '
+              f'{args.duracion:.0f} s por medición')
+        print(f'{"escenario":<10}{"clientes":>9}{"modo":>6}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errores":>9}')
+        with open(os.path.join(tmp, 'gunicorn.log'), 'w') as log:
+            for modo in args.modos:
+                proceso, puerto = arrancar(modo, env, args.workers, log)
+                try:
+                    generadores = escenarios(puerto, clave_google, admin)
+                    for escenario in args.escenarios:
+                        generar = generadores[escenario]
+                        asyncio.run(carga(puerto, generar, 10, 1))  # calentamiento (JWKS, cliente S3, caché)
+                        for clientes in args.clientes:
+                            latencias, errores, segundos = asyncio.run(
+                                carga(puerto, generar, clientes, args.duracion)
+                            )
+                            print(f'{escenario:<10}{clientes:>9}{modo:>6}{len(latencias) / segundos:>10.1f}'
+                                  f'{percentil(latencias, 0.5):>10.1f}{percentil(latencias, 0.99):>10.1f}'
+                                  f'{len(errores):>9}', flush=True)
+                finally:
+                    proceso.terminate()
+                    proceso.wait()
+    sustituto.terminate()
+
+
+if __name__ == '__main__':
+    main()
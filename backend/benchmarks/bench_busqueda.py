@@ -0,0 +1,98 @@
+# benchmarks/bench_busqueda.py
+"""
+Compara la latencia de búsqueda del catálogo: SearchFilter de DRF (icontains
+encadenados) frente al backend de veluxapp/search.py, con 10k y 100k productos
+sintéticos. Cada medición incluye el COUNT y la primera página (16 filas), igual
+que un listado paginado.
+
+    python benchmarks/bench_busqueda.py [--tamanos 10000 100000]
+"""
+import argparse
+import random
+
+from _entorno import base_de_datos_de_prueba, medir
+
+VOCABULARIO = (
+    'crema hidratante serum facial cúrcuma moringa té verde infusión proteína '
+    'chocolate vainilla colágeno ácido hialurónico vitamina tónico limpiador piel '
+    'seca grasa mixta coreano aceite argán perfume árabe jabón mascarilla noche '
+    'día protector solar batido detox jengibre canela miel aloe vera rosa mosqueta'
+).split()
+
+CONSULTAS = ('crema', 'curcuma', 'acido hialuronico', 'proteina chocolate', 'zzz')
+
+
+def texto(rnd, palabras):
+    return ' '.join(rnd.choice(VOCABULARIO) for _ in range(palabras))
+
+
+def poblar(cantidad):
+    from django.db import connection
+    from veluxapp.models import Productos
+    from veluxapp.search import vector_busqueda
+
+    rnd = random.Random(42)
+    Productos.objects.all().delete()
+    lote = []
+    for i in range(cantidad):
+        lote.append(Productos(
+            nombre=texto(rnd, 3).capitalize(),
+            descripcion=texto(rnd, 30),
+            lista_caracteristicas=texto(rnd, 6),
+            precio=rnd.randint(1000, 50000),
+        ))
+        if len(lote) == 5000:
+            Productos.objects.bulk_create(lote)
+            lote = []
+    Productos.objects.bulk_create(lote)
+    if connection.vendor == 'postgresql':
+        Productos.objects.update(search_vector=vector_busqueda())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--repeticiones', type=int, default=10)
+    args = parser.parse_args()
+
+    with base_de_datos_de_prueba() as connection:
+        import time
+        from rest_framework import filters
+        from rest_framework.request import Request
+        from rest_framework.test import APIRequestFactory
+        from veluxapp.models import Productos
+        from veluxapp.search import ProductoSearchFilter, get_search_backend
+        from veluxapp.views import ProductosViewSet
+
+        factory = APIRequestFactory()
+        vista = ProductosViewSet()
+
+        def pagina(backend, consulta):
+            request = Request(factory.get('/api/productos/', {'search': consulta}))
+            qs = Productos.objects.order_by(*ProductosViewSet.ordering)
+            qs = backend.filter_queryset(request, qs, vista)
+            qs.count()
+            list(qs.values_list('id', flat=True)[:16])
+
+        print(f'Base de datos: {connection.vendor}')
+        for cantidad in args.tamanos:
+            poblar(cantidad)
+            indice = get_search_backend()
+            if hasattr(indice, 'invalidar'):
+                indice.invalidar()
+                inicio = time.perf_counter()
+                indice.buscar('crema')
+                print(f'\n{cantidad} productos (índice en memoria construido en '
+                      f'{(time.perf_counter() - inicio) * 1000:.0f} ms)')
+            else:
+                print(f'\n{cantidad} productos')
+            print(f'{"consulta":<22}{"icontains p50/p95":>22}{"índice p50/p95":>22}{"mejora":>10}')
+            for consulta in CONSULTAS:
+                antes = medir(lambda: pagina(filters.SearchFilter(), consulta), args.repeticiones)
+                despues = medir(lambda: pagina(ProductoSearchFilter(), consulta), args.repeticiones)
+                print(f'{consulta:<22}{antes[0]:>10.1f}/{antes[1]:<8.1f} ms'
+                      f'{despues[0]:>10.1f}/{despues[1]:<8.1f} ms{antes[0] / despues[0]:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# benchmarks/bench_pedidos.py
+"""
+Compara la creación de un pedido de N líneas (por defecto 50), incluida su
+serialización, entre la implementación anterior (un SELECT y un INSERT por línea
+y un UPDATE final del total) y pedidos.crear_pedido (consultas constantes).
+
+    python benchmarks/bench_pedidos.py [--lineas 1 10 50] [--repeticiones 20]
+"""
+import argparse
+
+from _entorno import base_de_datos_de_prueba, contar_consultas, medir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lineas', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--repeticiones', type=int, default=20)
+    args = parser.parse_args()
+
+    with base_de_datos_de_prueba() as connection:
+        from django.contrib.auth import get_user_model
+        from django.db import transaction
+        from django.db.models import Prefetch, prefetch_related_objects
+        from veluxapp.models import ElementoPedido, Pedido, Productos
+        from veluxapp.pedidos import crear_pedido, precio_unitario
+        from veluxapp.serializers import PedidoSerializer
+
+        comprador = get_user_model().objects.create_user(username='bench', password='x')
+        productos = Productos.objects.bulk_create([
+            Productos(nombre=f'Producto {i}', precio=1000 + i) for i in range(max(args.lineas))
+        ])
+
+        def anterior(lineas):
+            with transaction.atomic():
+                pedido = Pedido.objects.create(comprador=comprador)
+                total = 0
+                for linea in lineas:
+                    producto = Productos.objects.get(id=linea['producto_id'])
+                    elemento = ElementoPedido.objects.create(
+                        pedido=pedido, producto=producto, cantidad=linea['cantidad'],
+                        precio_unitario=precio_unitario(producto),
+                    )
+                    total += elemento.subtotal()
+                pedido.precio_total = total
+                pedido.save()
+                return PedidoSerializer(pedido).data
+
+        def nuevo(lineas):
+            pedido = crear_pedido(comprador, lineas)
+            prefetch_related_objects(
+                [pedido], Prefetch('elementos', queryset=ElementoPedido.objects.select_related('producto')),
+            )
+            return PedidoSerializer(pedido).data
+
+        print(f'Base de datos: {connection.vendor}')
+        print(f'{"líneas":<8}{"consultas antes/después":>26}{"antes p50/p95":>22}{"después p50/p95":>22}')
+        for n in args.lineas:
+            lineas = [{'producto_id': p.id, 'cantidad': 2} for p in productos[:n]]
+            consultas = (contar_consultas(lambda: anterior(lineas)), contar_consultas(lambda: nuevo(lineas)))
+            antes = medir(lambda: anterior(lineas), args.repeticiones)
+            despues = medir(lambda: nuevo(lineas), args.repeticiones)
+            print(f'{n:<8}{consultas[0]:>18}/{consultas[1]:<7}'
+                  f'{antes[0]:>10.1f}/{antes[1]:<8.1f} ms{despues[0]:>10.1f}/{despues[1]:<8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# benchmarks/bench_presigned.py
+"""
+Latencia de generar una URL pre-firmada de subida: sesión y cliente boto3 nuevos
+en cada llamada (como hacía get_presigned_url) frente al cliente compartido de
+backend/storages_backends.py. Firmar no hace peticiones de red, así que basta
+un endpoint local tipo MinIO con credenciales falsas; no hace falta que exista.
+
+    python benchmarks/bench_presigned.py [--endpoint http://localhost:9000]
+"""
+import argparse
+import os
+
+from _entorno import medir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--endpoint', default='http://localhost:9000')
+    parser.add_argument('--repeticiones', type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DO_SPACES_KEY', 'minio')
+    os.environ.setdefault('DO_SPACES_SECRET', 'minio123')
+    os.environ.setdefault('DO_SPACES_REGION', 'local')
+
+    import boto3
+    from backend import storages_backends
+
+    params = {'Bucket': 'velux', 'Key': 'media/productos/foto.jpg', 'ACL': 'public-read'}
+
+    def cliente_nuevo():
+        client = boto3.session.Session().client(
+            's3',
+            region_name='local',
+            endpoint_url=args.endpoint,
+            aws_access_key_id='minio',
+            aws_secret_access_key='minio123',
+        )
+        client.generate_presigned_url(ClientMethod='put_object', Params=params, ExpiresIn=3600)
+
+    # El cliente compartido apunta a Spaces (región falsa); firmar cuesta lo mismo
+    def cliente_compartido():
+        client = storages_backends.get_s3_client()
+        client.generate_presigned_url(ClientMethod='put_object', Params=params, ExpiresIn=3600)
+
+    antes = medir(cliente_nuevo, args.repeticiones)
+    despues = medir(cliente_compartido, args.repeticiones)
+    print(f'{"":<22}{"p50":>10}{"p95":>10}')
+    print(f'{"cliente por llamada":<22}{antes[0]:>7.2f} ms{antes[1]:>7.2f} ms')
+    print(f'{"cliente compartido":<22}{despues[0]:>7.2f} ms{despues[1]:>7.2f} ms')
+    print(f'Mejora p50: {antes[0] / despues[0]:.0f}x (producto con 3 imágenes: '
+          f'{3 * antes[0]:.1f} ms -> {3 * despues[0]:.2f} ms)')
+
+
+if __name__ == '__main__':
+    main()
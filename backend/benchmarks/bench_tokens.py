@@ -0,0 +1,82 @@
+# benchmarks/bench_tokens.py
+"""
+Tablas de token_blacklist con muchos tokens caducados: tamaño de las tablas y
+latencia del refresco (TokenRefreshSerializer.validate) con la comprobación de
+lista negra de simplejwt (EXISTS por refresco) frente a RefreshTokenFiltrado
+(filtro de Bloom en memoria), antes y después de mantenimiento.podar_tokens.
+El filtro solo se usa al refrescar con la caché compartida (redis); aquí se simula.
+
+    python benchmarks/bench_tokens.py [--tokens 100000] [--revocados 0.3]
+"""
+import argparse
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from _entorno import base_de_datos_de_prueba, contar_consultas, medir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=int, default=100_000)
+    parser.add_argument('--caducados', type=float, default=0.9, help='Fracción de tokens ya caducados.')
+    parser.add_argument('--revocados', type=float, default=0.3, help='Fracción de tokens en la lista negra.')
+    parser.add_argument('--repeticiones', type=int, default=200)
+    args = parser.parse_args()
+
+    with base_de_datos_de_prueba() as connection, mock.patch('veluxapp.autenticacion.cache_compartida', return_value=True):
+        from django.contrib.auth import get_user_model
+        from django.utils import timezone
+        from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+        from veluxapp.mantenimiento import podar_tokens, tamano_tablas_tokens
+        from veluxapp.serializers import CustomTokenObtainPairSerializer, CustomTokenRefreshSerializer
+
+        class RefrescoOriginal(TokenRefreshSerializer):
+            pass
+
+        user = get_user_model().objects.create_user(username='bench', password='!')
+        ahora = timezone.now()
+        caducados = int(args.tokens * args.caducados)
+        tokens = OutstandingToken.objects.bulk_create([
+            OutstandingToken(
+                user=user,
+                jti=uuid.uuid4().hex,
+                token='x',
+                created_at=ahora - timedelta(days=30),
+                expires_at=ahora - timedelta(days=10) if i < caducados else ahora + timedelta(days=1),
+            )
+            for i in range(args.tokens)
+        ], batch_size=5000)
+        paso = max(1, round(1 / args.revocados)) if args.revocados else 0
+        if paso:
+            BlacklistedToken.objects.bulk_create(
+                [BlacklistedToken(token=t) for t in tokens[::paso]], batch_size=5000,
+            )
+        refresh = str(CustomTokenObtainPairSerializer.get_token(user))
+
+        def refrescar(clase):
+            serializer = clase(data={'refresh': refresh})
+            assert serializer.is_valid(), serializer.errors
+            return serializer.validated_data
+
+        def informe(etiqueta):
+            tamanos = tamano_tablas_tokens()
+            print(f'{etiqueta}: {tamanos["outstanding"]} outstanding, {tamanos["blacklisted"]} en lista negra')
+            print(f'  {"refresco":<14}{"consultas":>10}{"p50/p95":>20}')
+            for nombre, clase in (('simplejwt', RefrescoOriginal), ('filtrado', CustomTokenRefreshSerializer)):
+                refrescar(clase)  # carga el filtro
+                consultas = contar_consultas(lambda: refrescar(clase))
+                p50, p95 = medir(lambda: refrescar(clase), args.repeticiones)
+                print(f'  {nombre:<14}{consultas:>10}{p50:>12.3f}/{p95:<7.3f}ms')
+
+        print(f'Base de datos: {connection.vendor}')
+        informe('Antes de podar')
+        resumen = podar_tokens(lote=5000)
+        print(f'Poda: {resumen["outstanding"]} tokens y {resumen["blacklisted"]} revocados '
+              f'en {resumen["lotes"]} lotes ({resumen["segundos"]:.2f}s)')
+        informe('Después de podar')
+
+
+if __name__ == '__main__':
+    main()
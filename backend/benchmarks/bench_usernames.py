@@ -0,0 +1,52 @@
+# benchmarks/bench_usernames.py
+"""
+Elección del nombre de usuario para una cuenta nueva cuyo nombre base ya tiene N
+colisiones (maria, maria_1 ... maria_N-1): bucle anterior con un EXISTS por sufijo
+frente a usuarios.siguiente_username (una consulta).
+
+    python benchmarks/bench_usernames.py [--colisiones 100 1000 10000]
+"""
+import argparse
+
+from _entorno import base_de_datos_de_prueba, contar_consultas, medir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--colisiones', type=int, nargs='+', default=[100, 1000, 10_000])
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    with base_de_datos_de_prueba() as connection:
+        from django.contrib.auth import get_user_model
+        from veluxapp.usuarios import siguiente_username
+
+        User = get_user_model()
+
+        def anterior(base):
+            username = base
+            i = 1
+            while User.objects.filter(username=username).exists():
+                username = f'{base}_{i}'
+                i += 1
+            return username
+
+        print(f'Base de datos: {connection.vendor}')
+        print(f'{"colisiones":<12}{"consultas antes/después":>26}{"antes p50/p95":>22}{"después p50/p95":>22}')
+        existentes = 0
+        for n in sorted(args.colisiones):
+            User.objects.bulk_create([
+                User(username='maria' if i == 0 else f'maria_{i}', password='!')
+                for i in range(existentes, n)
+            ], batch_size=2000)
+            existentes = n
+            assert anterior('maria') == siguiente_username('maria') == f'maria_{n}'
+            consultas = (contar_consultas(lambda: anterior('maria')), contar_consultas(lambda: siguiente_username('maria')))
+            antes = medir(lambda: anterior('maria'), args.repeticiones, calentamiento=1)
+            despues = medir(lambda: siguiente_username('maria'), args.repeticiones, calentamiento=1)
+            print(f'{n:<12}{consultas[0]:>20}/{consultas[1]:<5}'
+                  f'{antes[0]:>12.1f}/{antes[1]:<8.1f}ms{despues[0]:>12.2f}/{despues[1]:<8.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+# gunicorn.conf.py
+"""
+Configuración de gunicorn para el proceso web (Procfile).
+
+SERVIDOR=asgi (por defecto): workers de uvicorn sobre backend.asgi. Las vistas
+async (veluxapp/asincrono.py) no ocupan el worker mientras esperan a Google, a
+Spaces o a la base de datos, así que cada worker atiende muchas peticiones a la vez.
+SERVIDOR=wsgi: workers síncronos sobre backend.wsgi, una petición por worker,
+como antes del cambio. Sirve de vuelta atrás sin tocar el Procfile.
+
+El número de workers sigue saliendo de WEB_CONCURRENCY (lo fija App Platform).
+"""
+import os
+
+# Sin decouple: gunicorn trataría `config` como su ajuste del mismo nombre
+SERVIDOR = os.environ.get('SERVIDOR', 'asgi')
+
+if SERVIDOR == 'asgi':
+    wsgi_app = 'backend.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+elif SERVIDOR == 'wsgi':
+    wsgi_app = 'backend.wsgi:application'
+    worker_class = 'sync'
+else:
+    raise ValueError(f"SERVIDOR debe ser 'asgi' o 'wsgi', no {SERVIDOR!r}")
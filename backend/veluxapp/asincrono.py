@@ -0,0 +1,204 @@
+# veluxapp/asincrono.py
+"""
+Piezas comunes de las vistas async de la API.
+
+DRF no tiene vistas async, así que estas son vistas de Django que reutilizan los
+parsers, la autenticación, los permisos y los serializers de DRF:
+
+- vista_async: el equivalente de @api_view + @permission_classes para una vista
+  `async def`, con las mismas respuestas de error que DRF.
+- ejecutar_io: las llamadas bloqueantes a servicios externos (Google, Spaces con
+  boto3) van a un pool de hilos propio y el worker sigue atendiendo otras
+  peticiones mientras esperan.
+- listado_async: listados públicos del catálogo servidos desde la caché de
+  respuestas o con el ORM async.
+
+Con el despliegue ASGI (gunicorn.conf.py) un worker de uvicorn atiende así muchas
+peticiones a la vez. Con WSGI Django ejecuta estas vistas en un bucle de eventos
+por petición y responden igual que antes.
+"""
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .cache import clave_respuesta, entrada_cache, get_cache, respuesta_desde_cache
+
+_pool_io = None
+_pool_io_lock = threading.Lock()
+
+
+def get_pool_io():
+    global _pool_io
+    if _pool_io is None:
+        with _pool_io_lock:
+            if _pool_io is None:
+                _pool_io = ThreadPoolExecutor(settings.HILOS_IO_EXTERNA, thread_name_prefix='io-externa')
+    return _pool_io
+
+
+async def ejecutar_io(funcion, *args, **kwargs):
+    """
+    Ejecuta `funcion` en el pool de E/S externa sin bloquear el bucle de eventos.
+    Solo para llamadas a servicios externos: los hilos del pool no cierran
+    conexiones a la base de datos, así que `funcion` no debe usarla.
+    """
+    return await sync_to_async(funcion, thread_sensitive=False, executor=get_pool_io())(*args, **kwargs)
+
+
+def respuesta_json(datos, status=200):
+    return HttpResponse(JSONRenderer().render(datos), status=status, content_type='application/json')
+
+
+# ------------------- Vistas de la API --------------------------
+def _comprobar_acceso(peticion, permisos):
+    # Como APIView.initial; autenticar puede consultar la base de datos
+    peticion.user
+    for permiso in permisos:
+        if not permiso().has_permission(peticion, None):
+            if peticion.authenticators and not peticion.successful_authenticator:
+                raise exceptions.NotAuthenticated()
+            raise exceptions.PermissionDenied()
+
+
+def _respuesta_error(peticion, exc):
+    """Misma respuesta que rest_framework.views.exception_handler."""
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        cabecera = peticion.authenticators[0].authenticate_header(peticion) if peticion.authenticators else None
+        if cabecera:
+            exc.auth_header = cabecera
+        else:
+            exc.status_code = 403
+    datos = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = respuesta_json(datos, status=exc.status_code)
+    if getattr(exc, 'auth_header', None):
+        response['WWW-Authenticate'] = exc.auth_header
+    return response
+
+
+def vista_async(metodos, autenticacion=None, permisos=None):
+    """
+    Decorador para vistas `async def vista(request, ...)`, que reciben la Request
+    de DRF. Equivale a @api_view(metodos) con @permission_classes(permisos); por
+    defecto usa las clases de autenticación y permisos de REST_FRAMEWORK.
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        async def envoltorio(request, *args, **kwargs):
+            clases = api_settings.DEFAULT_AUTHENTICATION_CLASSES if autenticacion is None else autenticacion
+            peticion = Request(
+                request,
+                parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+                authenticators=[clase() for clase in clases],
+            )
+            try:
+                if request.method not in metodos:
+                    raise exceptions.MethodNotAllowed(request.method)
+                await sync_to_async(_comprobar_acceso)(
+                    peticion, api_settings.DEFAULT_PERMISSION_CLASSES if permisos is None else permisos,
+                )
+                return await vista(peticion, *args, **kwargs)
+            except exceptions.APIException as exc:
+                return _respuesta_error(peticion, exc)
+
+        # Como en DRF, el CSRF solo lo exige SessionAuthentication
+        return csrf_exempt(envoltorio)
+    return decorador
+
+
+# ------------------- Listados del catálogo --------------------------
+def _buscar_en_cache(peticion, vista):
+    """
+    Clave y entrada de la caché para un visitante anónimo, o (None, None) si la
+    petición trae credenciales. Autenticar puede consultar la base de datos.
+    """
+    try:
+        if peticion.user.is_authenticated:
+            return None, None
+        vista.check_permissions(peticion)
+    except exceptions.APIException:
+        return None, None
+    clave = clave_respuesta(peticion, vista)
+    return clave, get_cache().get(clave)
+
+
+async def _listar(viewset, request):
+    """
+    Respuesta del listado para un GET anónimo que solo pagina por número de
+    página, o None si la petición tiene que atenderla el ViewSet.
+    """
+    paginacion = viewset.pagination_class
+    if not (
+        request.method == 'GET'
+        and set(request.GET) <= {paginacion.page_query_param, paginacion.page_size_query_param}
+        # Las respuestas de usuarios autenticados no se cachean (ver cache.py)
+        and 'HTTP_AUTHORIZATION' not in request.META
+        # El navegador pide text/html: API navegable de DRF
+        and 'text/html' not in request.headers.get('Accept', '')
+    ):
+        return None
+
+    peticion = Request(request, authenticators=[clase() for clase in viewset.authentication_classes])
+    vista = viewset(request=peticion, args=(), kwargs={}, format_kwarg=None, action='list')
+    paginador = vista.paginator
+    if hasattr(paginador, 'modo_cursor') and paginador.modo_cursor(peticion):
+        return None
+    try:
+        numero = int(peticion.query_params.get(paginador.page_query_param, 1))
+    except ValueError:
+        return None
+    tamano = paginador.get_page_size(peticion)
+    if numero < 1 or not tamano:
+        return None
+
+    clave, entrada = await sync_to_async(_buscar_en_cache)(peticion, vista)
+    if clave is None:
+        return None
+    if entrada is None:
+        queryset = vista.filter_queryset(vista.get_queryset())
+        paginas = Paginator(queryset, tamano)
+        paginas.count = await queryset.acount()
+        if numero > paginas.num_pages:
+            return None  # el 404 de DRF
+        inicio = (numero - 1) * tamano
+        filas = [fila async for fila in queryset[inicio:inicio + tamano]]
+        paginador.request = peticion
+        paginador.page = Page(filas, numero, paginas)
+        datos = paginador.get_paginated_response(vista.get_serializer(filas, many=True).data).data
+        # Mismo contenido que genera el ViewSet: las entradas de la caché sirven a los dos caminos
+        entrada = entrada_cache(JSONRenderer().render(datos), 'application/json')
+        await get_cache().aset(clave, entrada)
+
+    response = respuesta_desde_cache(request, entrada)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def listado_async(viewset, acciones=None):
+    """
+    Vista para la ruta de listado de un ViewSet del catálogo (con CatalogoCacheMixin).
+    Los GET anónimos que solo paginan por número de página, casi todo el tráfico de
+    estos endpoints, se sirven sin pasar por un hilo: desde la caché de respuestas
+    o con el ORM async. Lo demás (filtros, búsqueda, modo cursor, usuarios
+    autenticados, POST...) lo sigue atendiendo el ViewSet de DRF.
+    """
+    delegada = sync_to_async(viewset.as_view(acciones or {'get': 'list', 'post': 'create'}))
+
+    @csrf_exempt
+    async def vista(request, *args, **kwargs):
+        response = await _listar(viewset, request)
+        if response is None:
+            response = await delegada(request, *args, **kwargs)
+        return response
+
+    return vista
@@ -0,0 +1,184 @@
+# veluxapp/autenticacion.py
+"""
+Autenticación JWT sin consulta del usuario, para endpoints de lectura frecuente
+(carrito, favoritos, catálogo, pedidos).
+
+JWTAuthentication carga la fila de CustomUser en cada petición. Los tokens que
+emite CustomTokenObtainPairSerializer ya llevan id, username, email, nombre,
+foto, google_id e is_staff/is_superuser, así que aquí request.user se construye a
+partir de esos claims con Model.from_db: es una instancia normal de CustomUser
+(sirve en filtros del ORM y en claves foráneas) cuyos campos ausentes del token
+quedan diferidos. Si una vista lee uno de ellos (password, last_login...), Django
+lo carga de la base de datos en ese momento.
+
+Solo las lecturas se fían de los claims; las escrituras (crear productos, pedidos,
+checkout...) cargan el usuario y comprueban is_active e is_staff al momento.
+
+La revocación (LogoutView pone el refresh token en token_blacklist) se comprueba
+contra un filtro de Bloom de los jti revocados, en memoria de cada proceso; solo
+si el filtro da positivo se consulta la tabla. Cada revocación incrementa un
+contador en la caché del catálogo y los procesos reconstruyen el filtro al verlo
+cambiar; si esa caché no es compartida entre procesos (LocMem), un logout tarda
+como mucho JWT_REVOCADOS_TTL segundos en surtir efecto en los demás sobre los
+access tokens. Los refresh tokens (RefreshTokenFiltrado) solo se fían del filtro
+con la caché compartida: un refresco emite tokens nuevos y no puede esperar.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import router
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .cache import cache_compartida, generacion_modelo
+
+# Claim con el jti del refresh token del que sale cada access token (ver
+# CustomTokenObtainPairSerializer.get_token)
+CLAIM_REFRESH_JTI = 'refresh_jti'
+# Campos de CustomUser que pueden venir en el token (claim = nombre del campo)
+CAMPOS_TOKEN = (
+    'username', 'email', 'first_name', 'last_name', 'profile_picture', 'google_id', 'is_staff', 'is_superuser',
+)
+
+class FiltroBloom:
+    """
+    Conjunto aproximado de cadenas: nunca da falsos negativos y da falsos
+    positivos con probabilidad ~`tasa_fp`. Con 1 % ocupa unos 1,2 bytes por
+    elemento, frente a los ~100 de un set de jti.
+    """
+
+    def __init__(self, elementos, tasa_fp=0.01):
+        elementos = list(elementos)
+        n = max(len(elementos), 1)
+        self.m = max(64, math.ceil(-n * math.log(tasa_fp) / math.log(2) ** 2))
+        self.k = max(1, round(self.m / n * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8)
+        for elemento in elementos:
+            self.agregar(elemento)
+
+    def _posiciones(self, elemento):
+        # Doble hashing (Kirsch-Mitzenmacher) a partir de un único digest
+        digest = hashlib.blake2b(elemento.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    def agregar(self, elemento):
+        for posicion in self._posiciones(elemento):
+            self.bits[posicion >> 3] |= 1 << (posicion & 7)
+
+    def __contains__(self, elemento):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._posiciones(elemento))
+
+
+_filtro = FiltroBloom(())
+_filtro_hasta = 0
+_filtro_generacion = None
+_filtro_lock = threading.Lock()
+
+
+def filtro_revocados():
+    """
+    Filtro de Bloom con los jti de los refresh tokens revocados que aún pueden
+    tener access tokens vivos. Se reconstruye cuando otro proceso revoca un token
+    (contador de generación en la caché compartida, ver cache.py) y, como mucho,
+    cada JWT_REVOCADOS_TTL segundos si la caché no es compartida.
+    """
+    global _filtro, _filtro_hasta, _filtro_generacion
+    generacion = generacion_modelo(BlacklistedToken)
+    if time.monotonic() >= _filtro_hasta or generacion != _filtro_generacion:
+        with _filtro_lock:
+            if time.monotonic() >= _filtro_hasta or generacion != _filtro_generacion:
+                # Un access token emitido justo antes de caducar su refresh vive ACCESS_TOKEN_LIFETIME más
+                limite = timezone.now() - api_settings.ACCESS_TOKEN_LIFETIME
+                _filtro = FiltroBloom(
+                    BlacklistedToken.objects.filter(token__expires_at__gt=limite)
+                    .values_list('token__jti', flat=True)
+                    .iterator(chunk_size=5000)
+                )
+                _filtro_hasta = time.monotonic() + settings.JWT_REVOCADOS_TTL
+                _filtro_generacion = generacion
+    return _filtro
+
+
+def invalidar_revocados():
+    """Fuerza la reconstrucción del filtro en la próxima petición."""
+    global _filtro_hasta
+    _filtro_hasta = 0
+
+
+def jti_revocado(jti):
+    """
+    Indica si `jti` está en token_blacklist. Solo se consulta la base de datos
+    cuando el filtro dice "quizá" (revocado o falso positivo).
+    """
+    return jti in filtro_revocados() and BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+class RefreshTokenFiltrado(RefreshToken):
+    """
+    RefreshToken cuya comprobación de lista negra (en cada refresco y en el logout)
+    pasa antes por el filtro de Bloom: el caso normal, un token no revocado, no
+    hace ninguna consulta. Solo con la caché compartida; si no, el filtro puede
+    no conocer aún un logout de otro proceso y se consulta la tabla como siempre.
+    """
+
+    def check_blacklist(self):
+        if not cache_compartida():
+            return super().check_blacklist()
+        if jti_revocado(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_('Token is blacklisted'))
+
+
+def usuario_desde_token(validated_token):
+    """
+    CustomUser con los campos que trae el token; el resto quedan diferidos.
+    """
+    User = get_user_model()
+    claims = {
+        api_settings.USER_ID_FIELD: validated_token[api_settings.USER_ID_CLAIM],
+        **{campo: validated_token[campo] for campo in CAMPOS_TOKEN if campo in validated_token},
+    }
+    # from_db espera los valores en el orden de los campos del modelo
+    campos = [f.attname for f in User._meta.concrete_fields if f.attname in claims]
+    return User.from_db(router.db_for_read(User), campos, [claims[c] for c in campos])
+
+
+class JWTSinConsultaAuthentication(JWTAuthentication):
+    """
+    Como JWTAuthentication, pero sin SELECT del usuario en las lecturas (GET, HEAD,
+    OPTIONS): la instancia refleja los datos del momento en que se emitió el
+    token y no se comprueba is_active. Las escrituras cargan el usuario como
+    JWTAuthentication, así que un usuario desactivado o que deja de ser staff
+    pierde esos permisos al momento y no cuando caduca su access token.
+    """
+
+    def authenticate(self, request):
+        self.cargar_usuario = request.method not in SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        jtis = {validated_token.get(api_settings.JTI_CLAIM), validated_token.get(CLAIM_REFRESH_JTI)} - {None}
+        if any(jti_revocado(jti) for jti in jtis):
+            raise InvalidToken(_('Token is blacklisted'))
+        if getattr(self, 'cargar_usuario', True):
+            return super().get_user(validated_token)
+        return usuario_desde_token(validated_token)
+
+
+# Sustituye a DEFAULT_AUTHENTICATION_CLASSES en las vistas de lectura frecuente: el
+# usuario de las lecturas sale de los claims del JWT, sin SELECT por petición
+AUTENTICACION_SIN_CONSULTA = [JWTSinConsultaAuthentication, SessionAuthentication]
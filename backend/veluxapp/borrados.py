@@ -0,0 +1,131 @@
+# veluxapp/borrados.py
+"""
+Cola persistente de borrado de archivos del storage de medios.
+
+Las señales no llaman al storage: insertan los nombres en BorradoPendiente dentro
+de la misma transacción que el cambio (si se deshace, la cola también), así que
+guardar o borrar un producto no espera a Spaces. `manage.py procesar_borrados`
+vacía la cola por lotes: con Spaces/S3, una petición DeleteObjects por cada 1000
+claves; los fallos se reintentan con espera exponencial.
+
+Antes de borrar se comprueba que ningún producto haya vuelto a usar el archivo
+(con el storage direccionado por contenido, una nueva subida de la misma foto
+reutiliza el mismo nombre).
+"""
+import logging
+from datetime import timedelta
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .imagenes import archivos_en_uso
+from .models import BorradoPendiente, media_storage
+
+logger = logging.getLogger(__name__)
+
+MAX_CLAVES_S3 = 1000  # límite de DeleteObjects
+MAX_INTENTOS = 8
+
+
+def encolar_borrado(nombres, origen=''):
+    """
+    Encola el borrado de `nombres`. Si se indica `origen`, solo se borrarán
+    mientras ningún producto use ese archivo; si no, se comprueba cada nombre.
+    """
+    filas = [BorradoPendiente(nombre=nombre, origen=origen) for nombre in nombres if nombre]
+    if filas:
+        BorradoPendiente.objects.bulk_create(filas)
+
+
+def cancelar_borrado(nombre):
+    """
+    Saca de la cola `nombre` y lo que depende de él (sus variantes). Las filas que
+    un worker tiene bloqueadas hacen esperar al DELETE hasta que termina su lote.
+    """
+    BorradoPendiente.objects.filter(Q(nombre=nombre) | Q(origen=nombre)).delete()
+
+
+def _borrar_s3(storage, nombres):
+    client = storage.connection.meta.client
+    errores = {}
+    for i in range(0, len(nombres), MAX_CLAVES_S3):
+        trozo = nombres[i:i + MAX_CLAVES_S3]
+        claves = {storage._normalize_name(storage._clean_name(n)): n for n in trozo}
+        try:
+            respuesta = client.delete_objects(
+                Bucket=storage.bucket_name,
+                Delete={'Objects': [{'Key': clave} for clave in claves], 'Quiet': True},
+            )
+        except (BotoCoreError, ClientError) as e:
+            errores.update((n, str(e)) for n in trozo)
+            continue
+        for error in respuesta.get('Errors', []):
+            nombre = claves.get(error.get('Key'), error.get('Key'))
+            errores[nombre] = f"{error.get('Code')}: {error.get('Message')}"
+    return errores
+
+
+def _borrar_uno_a_uno(storage, nombres):
+    errores = {}
+    for nombre in nombres:
+        try:
+            storage.delete(nombre)
+        except OSError as e:
+            errores[nombre] = str(e)
+    return errores
+
+
+def borrar_archivos(storage, nombres):
+    """
+    Borra `nombres` de `storage` y devuelve {nombre: error} de los que fallaron.
+    """
+    nombres = sorted(set(nombres))
+    if not nombres:
+        return {}
+    if hasattr(storage, 'bucket_name'):
+        return _borrar_s3(storage, nombres)
+    return _borrar_uno_a_uno(storage, nombres)
+
+
+def procesar_borrados(lote=MAX_CLAVES_S3, storage=None):
+    """
+    Procesa un lote de la cola. Devuelve cuántas filas se borraron, cuántas se
+    descartaron porque el archivo vuelve a estar en uso y cuántas fallaron.
+    Las filas se bloquean con SKIP LOCKED, así que pueden ejecutarse varios
+    procesos a la vez (en PostgreSQL).
+    """
+    storage = storage or media_storage
+    ahora = timezone.now()
+    resumen = {'borrados': 0, 'descartados': 0, 'fallidos': 0}
+
+    with transaction.atomic():
+        filas = list(
+            BorradoPendiente.objects.select_for_update(skip_locked=True)
+            .filter(disponible_en__lte=ahora, intentos__lt=MAX_INTENTOS)
+            .order_by('id')[:lote]
+        )
+        if not filas:
+            return resumen
+
+        en_uso = archivos_en_uso({fila.origen or fila.nombre for fila in filas})
+        descartadas = [fila for fila in filas if (fila.origen or fila.nombre) in en_uso]
+        pendientes = [fila for fila in filas if (fila.origen or fila.nombre) not in en_uso]
+
+        errores = borrar_archivos(storage, [fila.nombre for fila in pendientes])
+        fallidas = [fila for fila in pendientes if fila.nombre in errores]
+        hechas = [fila for fila in pendientes if fila.nombre not in errores]
+
+        BorradoPendiente.objects.filter(pk__in=[fila.pk for fila in descartadas + hechas]).delete()
+        for fila in fallidas:
+            fila.intentos += 1
+            fila.ultimo_error = errores[fila.nombre][:1000]
+            fila.disponible_en = ahora + timedelta(minutes=min(2 ** fila.intentos, 60))
+            if fila.intentos >= MAX_INTENTOS:
+                logger.error(f"No se pudo borrar {fila.nombre} tras {fila.intentos} intentos: {fila.ultimo_error}")
+        if fallidas:
+            BorradoPendiente.objects.bulk_update(fallidas, ['intentos', 'ultimo_error', 'disponible_en'])
+
+    resumen.update(borrados=len(hechas), descartados=len(descartadas), fallidos=len(fallidas))
+    return resumen
@@ -0,0 +1,222 @@
+# veluxapp/cache.py
+"""
+Caché de respuestas para los endpoints públicos del catálogo.
+
+Cada respuesta se guarda bajo una clave formada por el host, la ruta, los parámetros
+normalizados (filtros, búsqueda, orden y paginación) y el contador de generación
+de cada modelo del que depende. Las señales incrementan ese contador cuando un
+admin modifica una fila, de modo que las entradas antiguas dejan de usarse sin
+tener que borrarlas una a una (el backend las expulsa por LRU/TTL).
+"""
+import hashlib
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.memcached import PyLibMCCache, PyMemcacheCache
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.settings import api_settings
+
+CACHE_ALIAS = 'catalogo'
+PREFIJO_GENERACION = 'gen'
+PREFIJO_RESPUESTA = 'resp'
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def cache_compartida():
+    """
+    Indica si todos los procesos (workers de gunicorn, máquinas) ven la misma
+    caché y, por tanto, los mismos contadores de generación. LocMem es de cada
+    proceso y la de archivos, de cada máquina.
+    """
+    return isinstance(get_cache(), (RedisCache, PyMemcacheCache, PyLibMCCache, DatabaseCache))
+
+
+# --- Contadores de generación ---
+
+def _clave_generacion(model):
+    return f'{PREFIJO_GENERACION}:{model._meta.label_lower}'
+
+
+def _bump(clave):
+    cache = get_cache()
+    try:
+        cache.incr(clave)
+    except ValueError:
+        # La clave no existe (primer uso o expulsada). Se inicializa con un valor
+        # basado en el reloj para no reutilizar nunca una generación anterior.
+        cache.set(clave, time.time_ns(), timeout=None)
+
+
+def invalidar_modelo(model):
+    """
+    Invalida todas las respuestas cacheadas que dependen de `model`.
+    Se incrementa ahora (lecturas dentro de la misma transacción) y otra vez tras
+    el commit, para que ninguna petición concurrente deje cacheados datos viejos
+    bajo la generación nueva.
+    """
+    clave = _clave_generacion(model)
+    _bump(clave)
+    transaction.on_commit(lambda: _bump(clave))
+
+
+def _generaciones(models):
+    cache = get_cache()
+    claves = [_clave_generacion(m) for m in models]
+    valores = cache.get_many(claves)
+    for clave in claves:
+        if clave not in valores:
+            valor = time.time_ns()
+            # add() no pisa un valor que otro proceso haya creado a la vez
+            if not cache.add(clave, valor, timeout=None):
+                valor = cache.get(clave, valor)
+            valores[clave] = valor
+    return [str(valores[c]) for c in claves]
+
+
+def generacion_modelo(model):
+    """Contador de generación actual de `model`; cambia cada vez que se invalida."""
+    return _generaciones([model])[0]
+
+
+# --- Normalización de parámetros ---
+
+def _parametros_relevantes(view):
+    """
+    Parámetros de query que cambian el contenido de la respuesta de `view`.
+    El resto se ignora para que no fragmenten la caché.
+    """
+    relevantes = set()
+    filterset_fields = getattr(view, 'filterset_fields', None) or ()
+    relevantes.update(filterset_fields)
+    relevantes.add(api_settings.SEARCH_PARAM)
+    relevantes.add(api_settings.ORDERING_PARAM)
+    paginator = getattr(view, 'paginator', None)
+    if paginator is not None:
+        for attr in dir(paginator):
+            if attr.endswith('_query_param'):
+                valor = getattr(paginator, attr, None)
+                if isinstance(valor, str):
+                    relevantes.add(valor)
+    return relevantes
+
+
+def _normalizar_valor(param, valor):
+    valor = ' '.join(valor.split())
+    if param == api_settings.SEARCH_PARAM:
+        valor = valor.lower()
+    return valor
+
+
+def clave_respuesta(request, view):
+    relevantes = _parametros_relevantes(view)
+    params = []
+    for param in sorted(request.query_params):
+        if param not in relevantes:
+            continue
+        valores = sorted(
+            _normalizar_valor(param, v) for v in request.query_params.getlist(param)
+        )
+        valores = [v for v in valores if v]
+        if valores:
+            params.append(f'{param}={",".join(valores)}')
+
+    generaciones = _generaciones(view.cache_models)
+    base = '|'.join([
+        # Esquema y host: la respuesta lleva URLs absolutas (next/previous, imágenes en disco)
+        request.build_absolute_uri('/'),
+        request.path,
+        '&'.join(params),
+        *view.get_cache_vary(request),
+        *generaciones,
+    ])
+    return f'{PREFIJO_RESPUESTA}:{hashlib.sha256(base.encode()).hexdigest()}'
+
+
+# --- Mixin para ViewSets ---
+
+def _coincide_etag(request, etag):
+    cabecera = request.headers.get('If-None-Match')
+    if not cabecera:
+        return False
+    etags = parse_etags(cabecera)
+    if '*' in etags:
+        return True
+    return etag in (e.removeprefix('W/') for e in etags)
+
+
+def entrada_cache(content, content_type):
+    return {
+        'content': content,
+        'content_type': content_type,
+        'etag': quote_etag(hashlib.sha1(content).hexdigest()),
+    }
+
+
+def respuesta_desde_cache(request, entrada):
+    """Respuesta (o 304 si el cliente ya tiene esa versión) para una entrada de la caché."""
+    if _coincide_etag(request, entrada['etag']):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(entrada['content'], content_type=entrada['content_type'])
+    response['ETag'] = entrada['etag']
+    # Solo se cachean respuestas anónimas: una caché compartida no debe dárselas a quien se autentica
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+class CatalogoCacheMixin:
+    """
+    Cachea las respuestas JSON de list/retrieve para visitantes anónimos.
+    Emite ETag y responde 304 si el cliente ya tiene esa versión.
+
+    Las subclases declaran en `cache_models` los modelos de los que depende su
+    representación (incluidos los anidados).
+    """
+    cache_models = ()
+
+    def get_cache_vary(self, request):
+        """Valores extra (p. ej. cabeceras) que cambian la respuesta además de la query."""
+        return []
+
+    def list(self, request, *args, **kwargs):
+        return self._respuesta_cacheada(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._respuesta_cacheada(super().retrieve, request, *args, **kwargs)
+
+    def _es_cacheable(self, request):
+        return (
+            self.cache_models
+            and request.method == 'GET'
+            and not request.user.is_authenticated
+            and getattr(request.accepted_renderer, 'format', None) == 'json'
+        )
+
+    def _respuesta_cacheada(self, generar, request, *args, **kwargs):
+        if not self._es_cacheable(request):
+            return generar(request, *args, **kwargs)
+
+        cache = get_cache()
+        clave = clave_respuesta(request, self)
+        entrada = cache.get(clave)
+
+        if entrada is None:
+            response = generar(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            response.render()
+            entrada = entrada_cache(response.content, response['Content-Type'])
+            cache.set(clave, entrada)
+
+        return respuesta_desde_cache(request, entrada)
@@ -0,0 +1,141 @@
+# veluxapp/google_auth.py
+"""
+Verificación local de los ID tokens de Google Sign-In.
+
+id_token.verify_oauth2_token descargaba los certificados de Google en cada login.
+Aquí el JWKS se guarda en memoria del proceso durante el max-age de su cabecera
+Cache-Control y las firmas (RS256) se comprueban en local con PyJWT. Solo se vuelve
+a descargar cuando caduca o cuando llega un token firmado con un `kid` que no
+conocemos (Google rota las claves), y siempre con la misma sesión HTTP.
+
+La fuente de claves se puede inyectar: cualquier callable que devuelva
+(jwks, max_age), p. ej. un JWKS fijo en los tests.
+"""
+import logging
+import re
+import threading
+import time
+
+import jwt
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_JWKS_URL = 'https://www.googleapis.com/oauth2/v3/certs'
+EMISORES_GOOGLE = ('accounts.google.com', 'https://accounts.google.com')
+TTL_POR_DEFECTO = 3600  # si la respuesta no trae max-age
+ESPERA_MINIMA_REFRESCO = 60  # kid desconocido o error: como mucho una descarga por minuto
+MARGEN_RELOJ = 60  # segundos de tolerancia en exp/iat
+
+
+def max_age(cache_control):
+    coincidencia = re.search(r'max-age=(\d+)', cache_control or '')
+    return int(coincidencia.group(1)) if coincidencia else TTL_POR_DEFECTO
+
+
+class FuenteJWKSHttp:
+    """
+    Descarga el JWKS de Google reutilizando una sesión de requests (conexiones
+    keep-alive), en lugar de abrir una conexión nueva cada vez.
+    """
+
+    def __init__(self, url=GOOGLE_JWKS_URL, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=4, max_retries=2))
+
+    def __call__(self):
+        respuesta = self.session.get(self.url, timeout=self.timeout)
+        respuesta.raise_for_status()
+        return respuesta.json(), max_age(respuesta.headers.get('Cache-Control'))
+
+
+class AlmacenClaves:
+    """
+    Claves públicas del JWKS indexadas por `kid`, compartidas por todos los hilos.
+    Si una descarga falla se siguen usando las claves anteriores, aunque hayan
+    caducado, hasta que la siguiente descarga funcione.
+    """
+
+    def __init__(self, fuente, reloj=time.monotonic):
+        self.fuente = fuente
+        self.reloj = reloj
+        self._lock = threading.Lock()
+        self._claves = {}
+        self._caduca = 0
+        self._ultimo_intento = None
+
+    def _refrescar(self):
+        self._ultimo_intento = self.reloj()
+        try:
+            jwks, ttl = self.fuente()
+            claves = {}
+            for jwk in jwks.get('keys', []):
+                if jwk.get('kid') and jwk.get('kty') == 'RSA':
+                    claves[jwk['kid']] = jwt.PyJWK(jwk, algorithm='RS256').key
+        except (requests.RequestException, ValueError, KeyError, jwt.PyJWTError) as e:
+            logger.warning(f"No se pudo descargar el JWKS de Google: {e}")
+            return
+        if claves:
+            self._claves = claves
+            self._caduca = self._ultimo_intento + ttl
+
+    def clave(self, kid):
+        with self._lock:
+            ahora = self.reloj()
+            puede_refrescar = (
+                self._ultimo_intento is None or ahora - self._ultimo_intento >= ESPERA_MINIMA_REFRESCO
+            )
+            if (ahora >= self._caduca or kid not in self._claves) and puede_refrescar:
+                self._refrescar()
+            try:
+                return self._claves[kid]
+            except KeyError:
+                raise ValueError(f'Clave de firma desconocida: {kid}.')
+
+
+class VerificadorGoogle:
+    def __init__(self, client_id, fuente=None, reloj=time.monotonic):
+        self.client_id = client_id
+        self.almacen = AlmacenClaves(fuente or FuenteJWKSHttp(), reloj=reloj)
+
+    def verificar(self, token):
+        """
+        Devuelve los claims del ID token o lanza ValueError si la firma, la
+        audiencia, el emisor o las fechas no son válidos.
+        """
+        try:
+            cabecera = jwt.get_unverified_header(token)
+            if cabecera.get('alg') != 'RS256':
+                raise ValueError('Algoritmo de firma no admitido.')
+            claims = jwt.decode(
+                token,
+                self.almacen.clave(cabecera.get('kid')),
+                algorithms=['RS256'],
+                audience=self.client_id,
+                leeway=MARGEN_RELOJ,
+                options={'require': ['exp', 'iat', 'iss', 'sub', 'aud']},
+            )
+        except jwt.PyJWTError as e:
+            raise ValueError(f'ID token de Google no válido: {e}')
+        if claims['iss'] not in EMISORES_GOOGLE:
+            raise ValueError('Token incorrecto (issuer).')
+        return claims
+
+
+_verificador = None
+_verificador_lock = threading.Lock()
+
+
+def get_verificador():
+    global _verificador
+    if _verificador is None:
+        with _verificador_lock:
+            if _verificador is None:
+                _verificador = VerificadorGoogle(
+                    settings.GOOGLE_CLIENT_ID, fuente=FuenteJWKSHttp(settings.GOOGLE_JWKS_URL),
+                )
+    return _verificador
@@ -0,0 +1,243 @@
+# veluxapp/imagenes.py
+"""
+Variantes redimensionadas de las imágenes de producto (para srcset).
+
+Al subir una imagen se generan, fuera del hilo de la petición, versiones de
+ANCHOS píxeles en WebP y en JPEG (fallback), guardadas junto al original en el
+mismo storage: productos/foto.jpg -> productos/foto_w320.webp, ...
+Los nombres generados se guardan en Productos.imagenes_variantes:
+
+    {"imagen1": {"origen": "productos/foto.jpg",
+                 "webp": {"320": "productos/foto_w320.webp", ...},
+                 "jpg": {"320": "productos/foto_w320.jpg", ...}}}
+
+`origen` permite saber si las variantes corresponden a la imagen actual.
+
+Con el storage direccionado por contenido varios productos pueden compartir el
+mismo original y, por tanto, las mismas variantes (sus nombres se derivan del
+nombre del original). Original y variantes solo se borran cuando ningún producto
+apunta ya al original (liberar_imagen).
+"""
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .cache import invalidar_modelo
+from .models import Productos
+
+logger = logging.getLogger(__name__)
+
+CAMPOS_IMAGEN = Productos.CAMPOS_IMAGEN
+ORIENTACION_EXIF = 0x0112
+ANCHOS = (320, 640, 1280)
+# (clave en el mapa / extensión, formato de Pillow, opciones de guardado)
+FORMATOS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+
+def _anchos_para(ancho_original):
+    # No se amplía nunca: si la imagen es más estrecha que el menor ancho se usa el suyo
+    return [a for a in ANCHOS if a <= ancho_original] or [ancho_original]
+
+
+def _a_rgb(imagen):
+    if imagen.mode in ('RGBA', 'LA') or (imagen.mode == 'P' and 'transparency' in imagen.info):
+        imagen = imagen.convert('RGBA')
+        fondo = Image.new('RGB', imagen.size, (255, 255, 255))
+        fondo.paste(imagen, mask=imagen.getchannel('A'))
+        return fondo
+    return imagen.convert('RGB')
+
+
+def _guardar(storage, nombre, contenido):
+    # En el storage direccionado el nombre de la variante ya depende del contenido del original
+    guardar = getattr(storage, 'guardar_derivado', storage.save)
+    return guardar(nombre, ContentFile(contenido))
+
+
+def generar_variantes(storage, nombre):
+    """
+    Genera las variantes de la imagen `nombre` y devuelve {formato: {ancho: nombre}}.
+    """
+    raiz, _ = os.path.splitext(nombre)
+    with storage.open(nombre, 'rb') as archivo:
+        imagen = Image.open(archivo)
+        if hasattr(storage, 'guardar_derivado'):
+            # Si otro producto con la misma imagen ya generó las variantes no hay nada que hacer
+            ancho = imagen.height if imagen.getexif().get(ORIENTACION_EXIF) in (5, 6, 7, 8) else imagen.width
+            existentes = {
+                clave: {str(a): f'{raiz}_w{a}.{clave}' for a in _anchos_para(ancho)} for clave, _, _ in FORMATOS
+            }
+            if all(storage.exists(n) for por_ancho in existentes.values() for n in por_ancho.values()):
+                return existentes
+        if imagen.format == 'JPEG':
+            # Decodifica ya reducido (escalado DCT) si el original es mucho mayor
+            imagen.draft('RGB', (max(ANCHOS), max(ANCHOS)))
+        imagen = ImageOps.exif_transpose(imagen)
+        imagen.load()
+
+    if imagen.mode not in ('RGB', 'RGBA'):
+        imagen = imagen.convert('RGBA' if 'A' in imagen.getbands() or 'transparency' in imagen.info else 'RGB')
+
+    variantes = {clave: {} for clave, _, _ in FORMATOS}
+    # De mayor a menor, reduciendo cada vez desde la anterior
+    actual = imagen
+    for ancho in sorted(_anchos_para(imagen.width), reverse=True):
+        alto = max(1, round(imagen.height * ancho / imagen.width))
+        actual = actual.resize((ancho, alto), Image.LANCZOS) if actual.width != ancho else actual
+        for clave, formato, opciones in FORMATOS:
+            salida = actual if formato == 'WEBP' else _a_rgb(actual)
+            buffer = io.BytesIO()
+            salida.save(buffer, formato, **opciones)
+            guardado = _guardar(storage, f'{raiz}_w{ancho}.{clave}', buffer.getvalue())
+            variantes[clave][str(ancho)] = guardado
+    return variantes
+
+
+def nombres_variantes(entrada):
+    """Todos los nombres de archivo de una entrada de imagenes_variantes."""
+    for clave, _, _ in FORMATOS:
+        yield from (entrada or {}).get(clave, {}).values()
+
+
+def posibles_variantes(nombre, entrada=None):
+    """
+    Nombres de las variantes de `nombre`: las registradas en `entrada` más las de
+    ANCHOS, por si imagenes_variantes no estaba al día.
+    """
+    raiz, _ = os.path.splitext(nombre)
+    nombres = set(nombres_variantes(entrada))
+    nombres.update(f'{raiz}_w{ancho}.{clave}' for ancho in ANCHOS for clave, _, _ in FORMATOS)
+    return sorted(nombres)
+
+
+def borrar_variantes(storage, entrada):
+    for nombre in nombres_variantes(entrada):
+        try:
+            storage.delete(nombre)
+        except Exception as e:
+            logger.warning(f"No se pudo eliminar la variante {nombre}: {e}")
+
+
+def archivos_en_uso(nombres):
+    """De `nombres`, los que algún producto usa como imagen (una consulta)."""
+    nombres = list(nombres)
+    referencias = Q()
+    for campo in CAMPOS_IMAGEN:
+        referencias |= Q(**{f'{campo}__in': nombres})
+    en_uso = set()
+    for fila in Productos.objects.filter(referencias).values_list(*CAMPOS_IMAGEN):
+        en_uso.update(fila)
+    return en_uso & set(nombres)
+
+
+def imagen_en_uso(nombre, excluir_pk=None):
+    """
+    Indica si algún producto (salvo `excluir_pk`) apunta al archivo `nombre`.
+    Es el recuento de referencias del storage direccionado por contenido: un
+    archivo solo se borra cuando esto devuelve False.
+    """
+    referencias = Q()
+    for campo in CAMPOS_IMAGEN:
+        referencias |= Q(**{campo: nombre})
+    productos = Productos.objects.filter(referencias)
+    if excluir_pk is not None:
+        productos = productos.exclude(pk=excluir_pk)
+    return productos.exists()
+
+
+def procesar_producto(producto_id, forzar=False):
+    """
+    Genera las variantes que falten (o todas con forzar=True) para las imágenes
+    del producto. Devuelve el número de imágenes procesadas.
+    """
+    try:
+        producto = Productos.objects.only(*CAMPOS_IMAGEN, 'imagenes_variantes').get(pk=producto_id)
+    except Productos.DoesNotExist:
+        return 0
+
+    mapa = dict(producto.imagenes_variantes or {})
+    generadas = {}
+    for campo in CAMPOS_IMAGEN:
+        imagen = getattr(producto, campo)
+        if not imagen:
+            mapa.pop(campo, None)
+            continue
+        if not forzar and mapa.get(campo, {}).get('origen') == imagen.name:
+            continue
+        if forzar and campo in mapa:
+            # Los nombres de las variantes no cambian: hay que borrarlas para regenerarlas
+            borrar_variantes(imagen.storage, mapa.pop(campo))
+        try:
+            variantes = generar_variantes(imagen.storage, imagen.name)
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+            logger.warning(f"No se pudieron generar variantes de {imagen.name}: {e}")
+            continue
+        mapa[campo] = generadas[campo] = {'origen': imagen.name, **variantes}
+
+    if not generadas and mapa == (producto.imagenes_variantes or {}):
+        return 0
+
+    # Solo se guarda si las imágenes no han cambiado mientras tanto; si cambiaron,
+    # el guardado que las cambió ya ha programado su propio procesado.
+    mismas_imagenes = Q(pk=producto_id)
+    for campo in CAMPOS_IMAGEN:
+        nombre = getattr(producto, campo).name
+        mismas_imagenes &= Q(**{campo: nombre}) if nombre else Q(**{f'{campo}__isnull': True}) | Q(**{campo: ''})
+    actualizados = Productos.objects.filter(mismas_imagenes).update(imagenes_variantes=mapa)
+    if not actualizados:
+        for campo, entrada in generadas.items():
+            if not imagen_en_uso(entrada['origen']):
+                borrar_variantes(getattr(producto, campo).storage, entrada)
+        return 0
+    invalidar_modelo(Productos)  # update() no emite señales
+    return len(generadas)
+
+
+# --- Ejecución en segundo plano ---
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGENES_VARIANTES_WORKERS,
+                    thread_name_prefix='variantes',
+                )
+    return _executor
+
+
+def _tarea(producto_id):
+    close_old_connections()
+    try:
+        procesar_producto(producto_id)
+    except Exception:
+        logger.exception(f"Error generando variantes del producto {producto_id}")
+    finally:
+        close_old_connections()
+
+
+def programar_variantes(producto_id):
+    """
+    Programa la generación de variantes tras el commit de la transacción actual.
+    Con IMAGENES_VARIANTES_WORKERS = 0 se hace en el mismo hilo (tests, depuración).
+    """
+    if settings.IMAGENES_VARIANTES_WORKERS <= 0:
+        transaction.on_commit(lambda: procesar_producto(producto_id))
+    else:
+        transaction.on_commit(lambda: _get_executor().submit(_tarea, producto_id))
@@ -0,0 +1,88 @@
+# veluxapp/management/commands/deduplicar_imagenes.py
+import os
+import re
+
+from django.core.management.base import BaseCommand
+
+from veluxapp.borrados import encolar_borrado
+from veluxapp.cache import invalidar_modelo
+from veluxapp.imagenes import CAMPOS_IMAGEN, posibles_variantes
+from veluxapp.models import Productos
+
+NOMBRE_DIRECCIONADO = re.compile(r'^[0-9a-f]{64}$')
+URL = re.compile(r'^[a-z][a-z0-9+.-]*://', re.IGNORECASE)
+
+
+class Command(BaseCommand):
+    help = (
+        'Renombra las imágenes de producto subidas antes del storage direccionado por contenido '
+        '(productos/<sha256>.ext), de modo que las copias idénticas pasan a ser un solo archivo, '
+        'y encola el borrado de los archivos antiguos (ver procesar_borrados). '
+        'Después conviene ejecutar generar_variantes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Solo muestra qué se renombraría.')
+
+    def omitir(self, nombre, storage):
+        """
+        Motivo para no tocar `nombre`, o None. Los productos antiguos pueden guardar
+        una URL en vez de un nombre del storage, o apuntar a un archivo que ya no está.
+        """
+        if URL.match(nombre):
+            return 'es una URL, no un archivo del storage'
+        if not storage.exists(nombre):
+            return 'el archivo no existe'
+        return None
+
+    def handle(self, *args, **options):
+        renombrados = {}  # nombre antiguo -> nombre nuevo
+        antiguos = {}  # nombre antiguo -> variantes
+        omitidos = {}  # nombre -> motivo
+        for producto in Productos.objects.only(*CAMPOS_IMAGEN, 'imagenes_variantes').iterator():
+            cambios = {}
+            variantes = dict(producto.imagenes_variantes or {})
+            for campo in CAMPOS_IMAGEN:
+                imagen = getattr(producto, campo)
+                if not imagen or NOMBRE_DIRECCIONADO.match(os.path.splitext(os.path.basename(imagen.name))[0]):
+                    continue
+                if imagen.name not in renombrados and imagen.name not in omitidos:
+                    motivo = self.omitir(imagen.name, imagen.storage)
+                    if motivo:
+                        omitidos[imagen.name] = motivo
+                        self.stderr.write(self.style.WARNING(
+                            f'Producto {producto.pk}, {campo}: se omite {imagen.name} ({motivo}).'
+                        ))
+                    elif options['dry_run']:
+                        renombrados[imagen.name] = imagen.storage.nombre_por_contenido(imagen.name, imagen)
+                    else:
+                        with imagen.open('rb'):
+                            renombrados[imagen.name] = imagen.storage.save(imagen.name, imagen)
+                if imagen.name in omitidos:
+                    continue
+                cambios[campo] = renombrados[imagen.name]
+                antiguos.setdefault(imagen.name, variantes.pop(campo, None))
+            if cambios and not options['dry_run']:
+                Productos.objects.filter(pk=producto.pk).update(imagenes_variantes=variantes, **cambios)
+
+        if options['dry_run']:
+            for antiguo, nuevo in sorted(renombrados.items()):
+                self.stdout.write(f'{antiguo} -> {nuevo}')
+            self.stdout.write(
+                f'{len(renombrados)} archivos, {len(set(renombrados.values()))} distintos; '
+                f'{len(omitidos)} omitidos.'
+            )
+            return
+
+        # El worker de borrados comprueba antes que ningún producto use el archivo y reintenta los fallos
+        encolados = 0
+        for nombre, variantes in antiguos.items():
+            if renombrados[nombre] != nombre:
+                encolar_borrado([nombre, *posibles_variantes(nombre, variantes)], origen=nombre)
+                encolados += 1
+        if renombrados:
+            invalidar_modelo(Productos)  # update() no emite señales
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(renombrados)} archivos renombrados a {len(set(renombrados.values()))} distintos; '
+            f'{encolados} archivos antiguos encolados para borrar; {len(omitidos)} omitidos.'
+        ))
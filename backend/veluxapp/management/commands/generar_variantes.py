@@ -0,0 +1,54 @@
+# veluxapp/management/commands/generar_variantes.py
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Q
+
+from veluxapp.imagenes import CAMPOS_IMAGEN, procesar_producto
+from veluxapp.models import Productos
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = (
+        'Genera las variantes redimensionadas (WebP y JPEG) de las imágenes de todos los productos. '
+        'Por defecto solo procesa las imágenes que aún no las tienen.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                            help='Hilos en paralelo (Pillow libera el GIL al decodificar y codificar).')
+        parser.add_argument('--forzar', action='store_true', help='Regenera también las variantes existentes.')
+
+    def handle(self, *args, **options):
+        con_imagen = Q()
+        for campo in CAMPOS_IMAGEN:
+            con_imagen |= ~Q(**{campo: ''}) & Q(**{f'{campo}__isnull': False})
+        ids = list(Productos.objects.filter(con_imagen).values_list('pk', flat=True))
+        forzar = options['forzar']
+
+        def procesar(producto_id):
+            # Un producto roto (archivo que falta en Spaces, URL en vez de nombre...) no para el resto
+            try:
+                return procesar_producto(producto_id, forzar=forzar)
+            except Exception:
+                logger.exception(f"Error generando variantes del producto {producto_id}")
+                return None
+            finally:
+                close_old_connections()
+
+        inicio = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            resultados = list(pool.map(procesar, ids))
+        fallidos = resultados.count(None)
+        imagenes = sum(resultado for resultado in resultados if resultado is not None)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{imagenes} imágenes procesadas en {len(ids)} productos ({time.monotonic() - inicio:.2f}s).'
+        ))
+        if fallidos:
+            self.stderr.write(self.style.ERROR(f'{fallidos} productos con errores (ver el log).'))
@@ -0,0 +1,36 @@
+# veluxapp/management/commands/limpiar_carritos.py
+from django.core.management.base import BaseCommand
+
+from veluxapp.mantenimiento import limpiar_carritos_invitados
+
+
+class Command(BaseCommand):
+    help = (
+        'Borra por lotes los carritos de invitado sin actividad desde hace más de N días. '
+        'Pensado para ejecutarse periódicamente (cron / job programado).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=None,
+                            help='Días de inactividad (por defecto settings.CARRITO_INVITADO_TTL_DIAS).')
+        parser.add_argument('--lote', type=int, default=1000, help='Carritos borrados por transacción.')
+        parser.add_argument('--pausa', type=float, default=0,
+                            help='Segundos de espera entre lotes para repartir la carga.')
+        parser.add_argument('--dry-run', action='store_true', help='Solo cuenta los carritos caducados.')
+
+    def handle(self, *args, **options):
+        resumen = limpiar_carritos_invitados(
+            dias=options['dias'],
+            lote=options['lote'],
+            pausa=options['pausa'],
+            dry_run=options['dry_run'],
+        )
+        if options['dry_run']:
+            self.stdout.write(
+                f"{resumen['carritos']} carritos de invitado sin actividad desde {resumen['limite']:%Y-%m-%d %H:%M}."
+            )
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Borrados {resumen['carritos']} carritos y {resumen['items']} ítems "
+            f"en {resumen['lotes']} lotes ({resumen['segundos']:.2f}s)."
+        ))
@@ -0,0 +1,34 @@
+# veluxapp/management/commands/podar_tokens.py
+from django.core.management.base import BaseCommand
+
+from veluxapp.mantenimiento import podar_tokens, tamano_tablas_tokens
+
+
+class Command(BaseCommand):
+    help = (
+        'Borra por lotes los tokens caducados de token_blacklist (outstanding y lista negra). '
+        'Pensado para ejecutarse periódicamente (cron / job programado).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Tokens borrados por transacción.')
+        parser.add_argument('--pausa', type=float, default=0,
+                            help='Segundos de espera entre lotes para repartir la carga.')
+        parser.add_argument('--dry-run', action='store_true', help='Solo cuenta los tokens caducados.')
+
+    def handle(self, *args, **options):
+        antes = tamano_tablas_tokens()
+        resumen = podar_tokens(lote=options['lote'], pausa=options['pausa'], dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(
+                f"{resumen['outstanding']} de {antes['outstanding']} tokens y {resumen['blacklisted']} de "
+                f"{antes['blacklisted']} revocados caducaron antes de {resumen['limite']:%Y-%m-%d %H:%M}."
+            )
+            return
+        despues = tamano_tablas_tokens()
+        self.stdout.write(self.style.SUCCESS(
+            f"Borrados {resumen['outstanding']} tokens y {resumen['blacklisted']} revocados "
+            f"en {resumen['lotes']} lotes ({resumen['segundos']:.2f}s). "
+            f"Outstanding: {antes['outstanding']} -> {despues['outstanding']}; "
+            f"lista negra: {antes['blacklisted']} -> {despues['blacklisted']}."
+        ))
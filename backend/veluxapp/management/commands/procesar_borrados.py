@@ -0,0 +1,40 @@
+# veluxapp/management/commands/procesar_borrados.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from veluxapp.borrados import MAX_CLAVES_S3, procesar_borrados
+
+
+class Command(BaseCommand):
+    help = (
+        'Vacía la cola de borrado de archivos (BorradoPendiente) por lotes. '
+        'Con --continuo se queda esperando trabajo nuevo (proceso worker del Procfile).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=MAX_CLAVES_S3, help='Archivos por lote.')
+        parser.add_argument('--continuo', action='store_true', help='No terminar cuando la cola esté vacía.')
+        parser.add_argument('--pausa', type=float, default=5,
+                            help='Segundos de espera con la cola vacía (solo con --continuo).')
+
+    def handle(self, *args, **options):
+        total = {'borrados': 0, 'descartados': 0, 'fallidos': 0}
+        while True:
+            close_old_connections()
+            resumen = procesar_borrados(lote=options['lote'])
+            for clave, valor in resumen.items():
+                total[clave] += valor
+            if resumen['borrados'] or resumen['descartados'] or resumen['fallidos']:
+                if options['continuo']:
+                    self.stdout.write(str(resumen))
+                if resumen['borrados'] + resumen['descartados'] == options['lote']:
+                    continue  # lote lleno: probablemente queda más
+            if not options['continuo']:
+                break
+            time.sleep(options['pausa'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Borrados {total['borrados']} archivos, {total['descartados']} descartados "
+            f"(vuelven a estar en uso), {total['fallidos']} fallidos."
+        ))
@@ -0,0 +1,17 @@
+# veluxapp/management/commands/recalcular_valoraciones.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from veluxapp.valoraciones import recalcular_valoraciones
+
+
+class Command(BaseCommand):
+    help = 'Recalcula desde cero la valoración media y el número de reviews de todos los productos.'
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        actualizados = recalcular_valoraciones()
+        self.stdout.write(self.style.SUCCESS(
+            f'Valoraciones recalculadas para {actualizados} productos ({time.monotonic() - inicio:.2f}s).'
+        ))
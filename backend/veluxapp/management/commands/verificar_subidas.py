@@ -0,0 +1,40 @@
+# veluxapp/management/commands/verificar_subidas.py
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from veluxapp.subidas import LOTE_VERIFICACION, procesar_verificaciones
+
+
+class Command(BaseCommand):
+    help = (
+        'Comprueba el SHA-256 de los archivos subidos directamente a Spaces (VerificacionPendiente) '
+        'y borra los que no coinciden con su nombre. '
+        'Con --continuo se queda esperando trabajo nuevo (proceso del Procfile).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=LOTE_VERIFICACION, help='Archivos por lote.')
+        parser.add_argument('--continuo', action='store_true', help='No terminar cuando la cola esté vacía.')
+        parser.add_argument('--pausa', type=float, default=30,
+                            help='Segundos de espera con la cola vacía (solo con --continuo).')
+
+    def handle(self, *args, **options):
+        total = {'verificados': 0, 'pendientes': 0}
+        while True:
+            close_old_connections()
+            resumen = procesar_verificaciones(lote=options['lote'])
+            for clave, valor in resumen.items():
+                total[clave] += valor
+            if resumen['verificados'] or resumen['pendientes']:
+                if options['continuo']:
+                    self.stdout.write(str(resumen))
+                if resumen['verificados'] + resumen['pendientes'] == options['lote']:
+                    continue  # lote lleno: probablemente queda más
+            if not options['continuo']:
+                break
+            time.sleep(options['pausa'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Verificados {total['verificados']} archivos, {total['pendientes']} aplazados."
+        ))
@@ -0,0 +1,116 @@
+# veluxapp/mantenimiento.py
+"""
+Tareas de mantenimiento de la base de datos. Se ejecutan desde comandos de
+gestión (python manage.py ...) pensados para lanzarse periódicamente (cron o
+job programado de App Platform), pero también pueden llamarse directamente.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from .models import Cart
+
+logger = logging.getLogger(__name__)
+
+
+def limpiar_carritos_invitados(dias=None, lote=1000, pausa=0, dry_run=False):
+    """
+    Borra los carritos de invitado (user IS NULL) sin actividad desde hace `dias`
+    días, según `updated_at`. Se borra por lotes de `lote` carritos, cada uno en
+    su propia transacción corta, para no mantener bloqueos largos.
+    Devuelve un resumen con los carritos e ítems borrados y el tiempo empleado.
+    """
+    if dias is None:
+        dias = settings.CARRITO_INVITADO_TTL_DIAS
+    limite = timezone.now() - timedelta(days=dias)
+    caducados = Cart.objects.filter(user__isnull=True, updated_at__lt=limite)
+
+    resumen = {'carritos': 0, 'items': 0, 'lotes': 0, 'segundos': 0.0, 'limite': limite}
+    inicio = time.monotonic()
+
+    if dry_run:
+        resumen['carritos'] = caducados.count()
+        resumen['segundos'] = time.monotonic() - inicio
+        return resumen
+
+    while True:
+        ids = list(caducados.order_by('updated_at').values_list('pk', flat=True)[:lote])
+        if not ids:
+            break
+        with transaction.atomic():
+            # Se vuelve a comprobar la condición por si algún carrito se usó entre medias
+            _, borrados = caducados.filter(pk__in=ids).delete()
+        resumen['carritos'] += borrados.get('veluxapp.Cart', 0)
+        resumen['items'] += borrados.get('veluxapp.CartItem', 0)
+        resumen['lotes'] += 1
+        if len(ids) < lote:
+            break
+        if pausa:
+            time.sleep(pausa)
+
+    resumen['segundos'] = time.monotonic() - inicio
+    logger.info(
+        "Carritos de invitado caducados borrados: %(carritos)s carritos, %(items)s ítems "
+        "en %(lotes)s lotes (%(segundos).2fs)", resumen,
+    )
+    return resumen
+
+
+def tamano_tablas_tokens():
+    return {
+        'outstanding': OutstandingToken.objects.count(),
+        'blacklisted': BlacklistedToken.objects.count(),
+    }
+
+
+def podar_tokens(lote=1000, pausa=0, dry_run=False):
+    """
+    Borra por lotes los tokens de token_blacklist (OutstandingToken y, en cascada,
+    BlacklistedToken) caducados hace más de ACCESS_TOKEN_LIFETIME: hasta entonces
+    puede seguir vivo un access token emitido con ellos, y la revocación de ese
+    access token depende de la fila (ver autenticacion.py).
+
+    expires_at no tiene índice (la tabla es de simplejwt), así que se avanza por
+    id: los tokens se crean con la misma duración, de modo que los más antiguos
+    caducan antes y cada lote recorre solo el principio de la clave primaria.
+    """
+    limite = timezone.now() - api_settings.ACCESS_TOKEN_LIFETIME
+    caducados = OutstandingToken.objects.filter(expires_at__lt=limite)
+
+    resumen = {'outstanding': 0, 'blacklisted': 0, 'lotes': 0, 'segundos': 0.0, 'limite': limite}
+    inicio = time.monotonic()
+
+    if dry_run:
+        resumen['outstanding'] = caducados.count()
+        resumen['blacklisted'] = BlacklistedToken.objects.filter(token__expires_at__lt=limite).count()
+        resumen['segundos'] = time.monotonic() - inicio
+        return resumen
+
+    ultimo = 0
+    while True:
+        ids = list(caducados.filter(pk__gt=ultimo).order_by('pk').values_list('pk', flat=True)[:lote])
+        if not ids:
+            break
+        ultimo = ids[-1]
+        with transaction.atomic():
+            _, borrados = OutstandingToken.objects.filter(pk__in=ids).delete()
+        resumen['outstanding'] += borrados.get('token_blacklist.OutstandingToken', 0)
+        resumen['blacklisted'] += borrados.get('token_blacklist.BlacklistedToken', 0)
+        resumen['lotes'] += 1
+        if len(ids) < lote:
+            break
+        if pausa:
+            time.sleep(pausa)
+
+    resumen['segundos'] = time.monotonic() - inicio
+    logger.info(
+        "Tokens caducados borrados: %(outstanding)s outstanding, %(blacklisted)s en lista negra "
+        "en %(lotes)s lotes (%(segundos).2fs)", resumen,
+    )
+    return resumen
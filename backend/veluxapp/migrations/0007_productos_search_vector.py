@@ -0,0 +1,55 @@
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Configuración de búsqueda en español que ignora tildes, índice GIN y relleno
+# inicial de la columna. Solo aplica en PostgreSQL; en SQLite la búsqueda usa el
+# índice en memoria de veluxapp/search.py.
+SQL_POSTGRES = """
+CREATE EXTENSION IF NOT EXISTS unaccent;
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'spanish_unaccent') THEN
+        CREATE TEXT SEARCH CONFIGURATION spanish_unaccent (COPY = spanish);
+        ALTER TEXT SEARCH CONFIGURATION spanish_unaccent
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+    END IF;
+END
+$$;
+CREATE INDEX IF NOT EXISTS veluxapp_productos_search_gin
+    ON veluxapp_productos USING gin (search_vector);
+UPDATE veluxapp_productos SET search_vector =
+    setweight(to_tsvector('spanish_unaccent', coalesce(nombre, '')), 'A') ||
+    setweight(to_tsvector('spanish_unaccent', coalesce(lista_caracteristicas, '')), 'B') ||
+    setweight(to_tsvector('spanish_unaccent', coalesce(descripcion, '')), 'C');
+"""
+
+SQL_POSTGRES_REVERSE = """
+DROP INDEX IF EXISTS veluxapp_productos_search_gin;
+"""
+
+
+def crear_indice(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(SQL_POSTGRES)
+
+
+def borrar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(SQL_POSTGRES_REVERSE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veluxapp', '0006_productos_es_producto_coreano_alter_productos_linea'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productos',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veluxapp', '0007_productos_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productos',
+            index=models.Index(fields=['fecha_subida', 'id'], name='productos_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productos',
+            index=models.Index(fields=['nombre', 'id'], name='productos_nombre_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productos',
+            index=models.Index(fields=['precio', 'id'], name='productos_precio_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productos',
+            index=models.Index(fields=['stock', 'id'], name='productos_stock_id_idx'),
+        ),
+    ]
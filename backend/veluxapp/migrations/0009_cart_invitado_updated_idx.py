@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veluxapp', '0008_productos_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('user__isnull', True)), fields=['updated_at'], name='cart_invitado_updated_idx'),
+        ),
+    ]
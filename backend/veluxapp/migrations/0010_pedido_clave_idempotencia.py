@@ -0,0 +1,22 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veluxapp', '0009_cart_invitado_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='clave_idempotencia',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='pedido',
+            constraint=models.UniqueConstraint(fields=('comprador', 'clave_idempotencia'), name='pedido_clave_idempotencia_unica'),
+        ),
+    ]
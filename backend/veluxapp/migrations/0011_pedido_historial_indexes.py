@@ -0,0 +1,21 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veluxapp', '0010_pedido_clave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['comprador', 'fecha', 'id'], name='pedido_comprador_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['fecha', 'id'], name='pedido_fecha_id_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:35
+
+from django.db import migrations, models
+from django.db.models import Count, FloatField, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+
+
+def rellenar_valoraciones(apps, schema_editor):
+    # Mismo cálculo que veluxapp.valoraciones.recalcular_valoraciones, con los modelos históricos
+    Productos = apps.get_model('veluxapp', 'Productos')
+    Reviews = apps.get_model('veluxapp', 'Reviews')
+    visibles = Reviews.objects.filter(producto=OuterRef('pk'), disponible=True).order_by().values('producto')
+    suma = Subquery(visibles.annotate(total=Sum('puntaje')).values('total'), output_field=IntegerField())
+    cuenta = Subquery(visibles.annotate(total=Count('*')).values('total'), output_field=IntegerField())
+    Productos.objects.update(
+        rating_suma=Coalesce(suma, 0),
+        rating_count=Coalesce(cuenta, 0),
+        rating_avg=Coalesce(Cast(suma, FloatField()) / Cast(cuenta, FloatField()), Value(0.0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veluxapp', '0011_pedido_historial_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productos',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False, verbose_name='Valoración media'),
+        ),
+        migrations.AddField(
+            model_name='productos',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Número de reviews'),
+        ),
+        migrations.AddField(
+            model_name='productos',
+            name='rating_suma',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='productos',
+            index=models.Index(fields=['rating_avg', 'id'], name='productos_rating_avg_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productos',
+            index=models.Index(fields=['rating_count', 'id'], name='productos_rating_count_id_idx'),
+        ),
+        migrations.RunPython(rellenar_valoraciones, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veluxapp', '0012_productos_valoraciones'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reviews',
+            index=models.Index(fields=['producto', 'fecha', 'id'], name='reviews_producto_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veluxapp', '0013_reviews_producto_fecha_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productos',
+            name='imagenes_variantes',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
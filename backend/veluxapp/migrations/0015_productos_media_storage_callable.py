@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:41
+
+import veluxapp.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veluxapp', '0014_productos_imagenes_variantes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productos',
+            name='imagen1',
+            field=models.ImageField(blank=True, help_text='Esta es la imagen que aparecerá como vista previa en la tienda, debe ser la mejor.', null=True, storage=veluxapp.models.get_media_storage, upload_to='productos/', verbose_name='Foto o imagen'),
+        ),
+        migrations.AlterField(
+            model_name='productos',
+            name='imagen2',
+            field=models.ImageField(blank=True, null=True, storage=veluxapp.models.get_media_storage, upload_to='productos/', verbose_name='Foto o imagen 3'),
+        ),
+        migrations.AlterField(
+            model_name='productos',
+            name='imagen3',
+            field=models.ImageField(blank=True, null=True, storage=veluxapp.models.get_media_storage, upload_to='productos/', verbose_name='Foto o imagen 3'),
+        ),
+    ]
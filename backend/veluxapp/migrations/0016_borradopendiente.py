@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-18 07:45
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('veluxapp', '0015_productos_media_storage_callable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BorradoPendiente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=500)),
+                ('origen', models.CharField(blank=True, max_length=500)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('ultimo_error', models.TextField(blank=True)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('disponible_en', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Borrado pendiente',
+                'verbose_name_plural': 'Borrados pendientes',
+            },
+        ),
+    ]
@@ -7,8 +7,8 @@ from django.utils.text import slugify
 from django.conf import settings # IMPORTA settings para usar settings.AUTH_USER_MODEL
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone # Importa timezone para campos de fecha/hora
-from backend.storages_backends import MediaStorage
-from django.core.files.storage import FileSystemStorage
+from backend.storages_backends import FileSystemStorageDireccionado, MediaStorageDireccionado
+from django.contrib.postgres.search import SearchVectorField
 from django.conf import settings
 import logging # Importa logging para registrar eventos
 logger = logging.getLogger(__name__) # Get a logger for this module
@@ -16,11 +16,16 @@ logger = logging.getLogger(__name__) # Get a logger for this module
 
 
 
+# Archivos nombrados por el hash de su contenido (sin duplicados), ver backend/storages_backends.py
 if settings.USE_SPACES:
-    from backend.storages_backends import MediaStorage
-    media_storage = MediaStorage()
+    media_storage = MediaStorageDireccionado()
 else:
-    media_storage = FileSystemStorage()
+    media_storage = FileSystemStorageDireccionado()
+
+
+def get_media_storage():
+    # Callable para que las migraciones no dependan de USE_SPACES
+    return media_storage
 
 
 
@@ -56,6 +61,8 @@ class Productos(models.Model):
         ('tea', 'Chibi Tea'),
         ('todo', 'Otros'),
     ]
+    CAMPOS_IMAGEN = ('imagen1', 'imagen2', 'imagen3')
+    CAMPOS_VALORACION = ('rating_avg', 'rating_count', 'rating_suma')
     id = models.AutoField('ID',primary_key=True)
     disponible = models.BooleanField('Publicar', default=True, help_text='Marca esta casilla si deseas que este producto aparezca en la tienda.')
     stock = models.BooleanField('En stock', default=True, help_text='El producto está en stock actualmente?') # Se mantiene como BooleanField
@@ -64,22 +71,61 @@ class Productos(models.Model):
     categoria = models.ManyToManyField(Categoria_Productos)
     descripcion = models.TextField('Descripción del producto(Opcional)', blank=True)
     lista_caracteristicas = models.CharField('Lista de detalles', max_length=200, help_text='Deben ir separados por comas. ej: tamaño: 23x21, marca: Nike, fecha de caducidad, tipo, etc...')
-    imagen1 = models.ImageField('Foto o imagen', upload_to='productos/', help_text='Esta es la imagen que aparecerá como vista previa en la tienda, debe ser la mejor.', storage=media_storage, blank=True, null=True)
-    imagen2 = models.ImageField('Foto o imagen 3', upload_to='productos/', storage=media_storage, blank=True, null=True)
-    imagen3 = models.ImageField('Foto o imagen 3', upload_to='productos/', storage=media_storage, blank=True, null=True)
+    imagen1 = models.ImageField('Foto o imagen', upload_to='productos/', help_text='Esta es la imagen que aparecerá como vista previa en la tienda, debe ser la mejor.', storage=get_media_storage, blank=True, null=True)
+    imagen2 = models.ImageField('Foto o imagen 3', upload_to='productos/', storage=get_media_storage, blank=True, null=True)
+    imagen3 = models.ImageField('Foto o imagen 3', upload_to='productos/', storage=get_media_storage, blank=True, null=True)
     precio = models.IntegerField('Precio (XAF)') # Se mantiene como IntegerField
     oferta = models.BooleanField('En oferta', default=False)
     precio_rebaja = models.IntegerField('Precio de oferta (XAF)', default=0) # Se mantiene como IntegerField
     fecha_subida = models.DateField('Fecha publicacion', auto_now_add=True)
     linea = models.CharField('Linea', max_length=10, choices=LINEAS_CHOICES, default='todo', help_text='Selecciona la línea a la que pertenece este producto')
     es_producto_coreano = models.BooleanField('Producto de Corea', default=False, help_text='Marca esta casilla si el producto es de origen coreano')
+    # Índice de búsqueda (solo PostgreSQL). Lo mantienen las señales, ver veluxapp/search.py
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Agregados de las reviews visibles, ver veluxapp/valoraciones.py
+    rating_avg = models.FloatField('Valoración media', default=0, editable=False)
+    rating_count = models.PositiveIntegerField('Número de reviews', default=0, editable=False)
+    rating_suma = models.IntegerField(default=0, editable=False)
+    # Nombres de las versiones redimensionadas de cada imagen, ver veluxapp/imagenes.py
+    imagenes_variantes = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return self.nombre
 
+    def save(self, *args, **kwargs):
+        # Los agregados de valoración los actualizan las señales de Reviews con
+        # UPDATE ... F(). Un save() completo (admin, PUT de la API) escribiría los
+        # valores que tiene en memoria y perdería las reviews llegadas mientras tanto.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            diferidos = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.attname not in diferidos and campo.name not in self.CAMPOS_VALORACION
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Nombres de las imágenes tal como están en la base de datos, para detectar
+        # reemplazos en pre_save sin volver a consultar (ver signals.py)
+        instance._imagenes_guardadas = {
+            campo: valor or '' for campo, valor in zip(field_names, values) if campo in cls.CAMPOS_IMAGEN
+        }
+        return instance
+
     class Meta:
         verbose_name_plural = 'Productos'
         verbose_name = 'Producto'
+        # Índices (campo, id) para la paginación por cursor en cada ordering_field
+        indexes = [
+            models.Index(fields=['fecha_subida', 'id'], name='productos_fecha_id_idx'),
+            models.Index(fields=['nombre', 'id'], name='productos_nombre_id_idx'),
+            models.Index(fields=['precio', 'id'], name='productos_precio_id_idx'),
+            models.Index(fields=['stock', 'id'], name='productos_stock_id_idx'),
+            models.Index(fields=['rating_avg', 'id'], name='productos_rating_avg_id_idx'),
+            models.Index(fields=['rating_count', 'id'], name='productos_rating_count_id_idx'),
+        ]
 
 # ------------------- Packs --------------------------
 class Pack(models.Model):
@@ -124,6 +170,10 @@ class Reviews(models.Model):
 
     class Meta:
         verbose_name_plural = 'Reviews'
+        indexes = [
+            # Reviews de un producto por fecha (paginación por cursor en la ficha de producto)
+            models.Index(fields=['producto', 'fecha', 'id'], name='reviews_producto_fecha_idx'),
+        ]
 
 # ------------------- Colaboradores --------------------------
 class Colaboradores(models.Model):
@@ -205,8 +255,15 @@ class Cart(models.Model):
             return f"Carrito de {self.user.username}"
         return f"Carrito de invitado ({self.session_key or 'Sin sesión'})"
 
+    def _items_precargados(self):
+        # Ítems ya cargados con prefetch_related('items'), o None si no lo están
+        return getattr(self, '_prefetched_objects_cache', {}).get('items')
+
     @property
     def total_items(self):
+        items = self._items_precargados()
+        if items is not None:
+            return sum(item.quantity for item in items)
         return self.items.aggregate(total_quantity=models.Sum('quantity'))['total_quantity'] or 0
 
     @property
@@ -219,6 +276,10 @@ class Cart(models.Model):
     class Meta:
         verbose_name = 'Carrito'
         verbose_name_plural = 'Carritos'
+        indexes = [
+            # Búsqueda de carritos de invitado inactivos (manage.py limpiar_carritos)
+            models.Index(fields=['updated_at'], condition=models.Q(user__isnull=True), name='cart_invitado_updated_idx'),
+        ]
 
 
 class CartItem(models.Model):
@@ -250,6 +311,8 @@ class Pedido(models.Model):
     fecha = models.DateTimeField(auto_now_add=True)
     vendido = models.BooleanField(default=False)
     precio_total = models.IntegerField(default=0) # Se mantiene como IntegerField
+    # Clave enviada por el cliente en el checkout (cabecera Idempotency-Key) para no duplicar pedidos al reintentar
+    clave_idempotencia = models.CharField(max_length=64, null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"Pedido {self.id} por {self.comprador.username}"
@@ -257,6 +320,14 @@ class Pedido(models.Model):
     class Meta:
         verbose_name = 'Pedido'
         verbose_name_plural = 'Pedidos'
+        constraints = [
+            models.UniqueConstraint(fields=['comprador', 'clave_idempotencia'], name='pedido_clave_idempotencia_unica'),
+        ]
+        indexes = [
+            # Historial de un comprador y listado completo para staff, ambos por fecha descendente
+            models.Index(fields=['comprador', 'fecha', 'id'], name='pedido_comprador_fecha_idx'),
+            models.Index(fields=['fecha', 'id'], name='pedido_fecha_id_idx'),
+        ]
 
 class ElementoPedido(models.Model):
     pedido = models.ForeignKey(Pedido, related_name='elementos', on_delete=models.CASCADE)
@@ -273,4 +344,48 @@ class ElementoPedido(models.Model):
 
     class Meta:
         verbose_name = 'Elemento de Pedido'
-        verbose_name_plural = 'Elementos de Pedido'
\ No newline at end of file
+        verbose_name_plural = 'Elementos de Pedido'
+
+# ------------------- Cola de borrado de archivos --------------------------
+class BorradoPendiente(models.Model):
+    """
+    Archivo del storage de medios pendiente de borrar. Las señales lo encolan en la
+    misma transacción que el cambio y `manage.py procesar_borrados` lo borra por
+    lotes, ver veluxapp/borrados.py.
+    """
+    nombre = models.CharField(max_length=500)
+    # Archivo del que depende: si algún producto vuelve a usarlo, no se borra
+    origen = models.CharField(max_length=500, blank=True)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    ultimo_error = models.TextField(blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    disponible_en = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.nombre
+
+    class Meta:
+        verbose_name = 'Borrado pendiente'
+        verbose_name_plural = 'Borrados pendientes'
+
+
+# ------------------- Verificación de subidas directas --------------------------
+class VerificacionPendiente(models.Model):
+    """
+    Archivo subido directamente a Spaces (URL pre-firmada o multipart) cuyo
+    contenido aún no se ha comprobado contra el SHA-256 de su nombre. El worker
+    `manage.py verificar_subidas` lo descarga, calcula el hash y borra el objeto
+    si no coincide, ver veluxapp/subidas.py.
+    """
+    nombre = models.CharField(max_length=500)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    ultimo_error = models.TextField(blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    disponible_en = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.nombre
+
+    class Meta:
+        verbose_name = 'Verificación pendiente'
+        verbose_name_plural = 'Verificaciones pendientes'
@@ -1,7 +1,153 @@
 # veluxapp/pagination.py
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 16 # Número de elementos por página por defecto
     page_size_query_param = 'page_size' # Permite al cliente especificar el tamaño de página (ej. ?page_size=20)
-    max_page_size = 100 # Tamaño máximo de página que un cliente puede solicitar
\ No newline at end of file
+    max_page_size = 100 # Tamaño máximo de página que un cliente puede solicitar
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginación por cursor (keyset) para scroll infinito.
+    En lugar de OFFSET, cada página filtra a partir de la última fila vista:
+    (campo, id) < (valor, id_ultimo) en orden descendente, > en ascendente.
+    El id desempata en la misma dirección que el campo, así que basta un índice
+    compuesto (campo, id) recorrido en un sentido u otro.
+
+    Solo se usa el primer campo de ordenación. El COUNT(*) se omite salvo que
+    el cliente lo pida con ?con_total=1.
+    """
+    page_size = StandardResultsSetPagination.page_size
+    page_size_query_param = StandardResultsSetPagination.page_size_query_param
+    max_page_size = StandardResultsSetPagination.max_page_size
+    cursor_query_param = 'cursor'
+    count_query_param = 'con_total'
+    default_ordering = ('-pk',)
+
+    @classmethod
+    def campo_orden(cls, queryset):
+        """
+        Devuelve (campo, descendente) o None si la ordenación no admite keyset
+        (anotaciones como la relevancia de búsqueda, relaciones, etc.).
+        """
+        orden = list(queryset.query.order_by) or list(queryset.model._meta.ordering) or list(cls.default_ordering)
+        primero = orden[0]
+        if not isinstance(primero, str):
+            return None
+        descendente = primero.startswith('-')
+        nombre = primero.lstrip('-')
+        if nombre == 'pk':
+            return queryset.model._meta.pk, descendente
+        try:
+            campo = queryset.model._meta.get_field(nombre)
+        except FieldDoesNotExist:
+            return None
+        if not campo.concrete or campo.is_relation:
+            return None
+        return campo, descendente
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+            if size > 0:
+                return min(size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def encode_cursor(self, obj):
+        valor = self.campo.value_to_string(obj)
+        data = json.dumps([valor, obj.pk], separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, request):
+        codificado = request.query_params.get(self.cursor_query_param)
+        if not codificado:
+            return None
+        try:
+            valor, pk = json.loads(base64.urlsafe_b64decode(codificado.encode()).decode())
+            return self.campo.to_python(valor), int(pk)
+        except Exception:
+            raise NotFound('Cursor inválido.')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.campo, self.descendente = self.campo_orden(queryset)
+        nombre = self.campo.attname
+        signo = '-' if self.descendente else ''
+        queryset = queryset.order_by(f'{signo}{nombre}', f'{signo}pk')
+
+        self.total = None
+        if request.query_params.get(self.count_query_param) in ('1', 'true', 'True'):
+            self.total = queryset.count()
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            valor, pk = cursor
+            op = 'lt' if self.descendente else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{nombre}__{op}': valor}) | Q(**{nombre: valor, f'pk__{op}': pk})
+            )
+
+        filas = list(queryset[:self.page_size + 1])
+        self.has_next = len(filas) > self.page_size
+        self.page = filas[:self.page_size]
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        respuesta = OrderedDict()
+        if self.total is not None:
+            respuesta['count'] = self.total
+        respuesta['next'] = self.get_next_link()
+        respuesta['results'] = data
+        return Response(respuesta)
+
+
+class CatalogoPagination(StandardResultsSetPagination):
+    """
+    Paginación por número de página (por defecto, la que usan los clientes actuales)
+    con un modo cursor opcional. El modo cursor se activa con ?paginacion=cursor,
+    con la cabecera X-Paginacion: cursor o al seguir un enlace `next` con ?cursor=.
+    Si la ordenación no admite keyset (p. ej. relevancia de búsqueda) se usa la
+    paginación por número de página.
+    """
+    mode_query_param = 'paginacion'
+    mode_header = 'X-Paginacion'
+    cursor_query_param = KeysetPagination.cursor_query_param
+    count_query_param = KeysetPagination.count_query_param
+    keyset_class = KeysetPagination
+    keyset = None
+
+    def modo_cursor(self, request):
+        modo = request.query_params.get(self.mode_query_param) or request.headers.get(self.mode_header)
+        return modo == 'cursor' or self.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.modo_cursor(request) and self.keyset_class.campo_orden(queryset):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
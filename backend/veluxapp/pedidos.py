@@ -0,0 +1,113 @@
+# veluxapp/pedidos.py
+"""
+Creación de pedidos con un número constante de consultas, sea cual sea el número
+de líneas: un SELECT ... FOR UPDATE de todos los productos, un INSERT del pedido
+(ya con su precio_total) y un INSERT masivo de sus elementos.
+
+crear_pedido_desde_carrito hace lo mismo a partir del carrito del usuario.
+"""
+from django.db import transaction
+from rest_framework import serializers
+
+from .models import Cart, CartItem, ElementoPedido, Pedido, Productos
+
+
+def precio_unitario(producto):
+    # Precio normal o de oferta
+    return producto.precio_rebaja if producto.oferta else producto.precio
+
+
+def crear_pedido(comprador, lineas):
+    """
+    Crea un pedido de `comprador` con `lineas`, una lista de dicts con
+    `producto_id` y `cantidad`. Los productos se bloquean hasta el final de la
+    transacción para que el precio no cambie mientras se crea el pedido.
+    Si alguna línea no es válida lanza ValidationError sin escribir nada:
+    {"productos": {índice: mensaje}}.
+    """
+    with transaction.atomic():
+        productos = Productos.objects.select_for_update().in_bulk(
+            {linea['producto_id'] for linea in lineas}
+        )
+
+        errores = {}
+        for i, linea in enumerate(lineas):
+            producto = productos.get(linea['producto_id'])
+            if producto is None:
+                errores[i] = f"Producto con ID {linea['producto_id']} no encontrado."
+            elif not producto.disponible:
+                errores[i] = "Este producto no está disponible para la venta."
+            elif not producto.stock:
+                errores[i] = "Este producto está fuera de stock."
+        if errores:
+            raise serializers.ValidationError({"productos": errores})
+
+        elementos = [
+            ElementoPedido(
+                producto=productos[linea['producto_id']],
+                cantidad=linea['cantidad'],
+                precio_unitario=precio_unitario(productos[linea['producto_id']]),
+            )
+            for linea in lineas
+        ]
+        pedido = Pedido.objects.create(
+            comprador=comprador,
+            precio_total=sum(e.subtotal() for e in elementos),
+        )
+        for elemento in elementos:
+            elemento.pedido = pedido
+        ElementoPedido.objects.bulk_create(elementos)
+
+    return pedido
+
+
+def crear_pedido_desde_carrito(comprador, clave):
+    """
+    Convierte el carrito de `comprador` en un pedido y lo vacía, todo en una
+    transacción. Los precios son los guardados al añadir cada ítem
+    (price_at_addition). `clave` (Idempotency-Key) hace la operación idempotente:
+    si ya hay un pedido de este comprador con esa clave se devuelve ese mismo.
+
+    Devuelve (pedido, creado).
+    """
+    with transaction.atomic():
+        # Bloquear el carrito serializa los checkouts simultáneos del mismo usuario,
+        # así que la comprobación de la clave de abajo no tiene carreras.
+        cart = Cart.objects.select_for_update().filter(user=comprador).only('id').first()
+
+        existente = Pedido.objects.filter(comprador=comprador, clave_idempotencia=clave).first()
+        if existente is not None:
+            return existente, False
+
+        items = list(
+            CartItem.objects.filter(cart=cart).select_related('product').order_by('id')
+        ) if cart is not None else []
+        if not items:
+            raise serializers.ValidationError({"detail": "El carrito está vacío."})
+
+        errores = {}
+        for item in items:
+            if not item.product.disponible:
+                errores[item.product_id] = "Este producto no está disponible para la venta."
+            elif not item.product.stock:
+                errores[item.product_id] = "Este producto está fuera de stock."
+        if errores:
+            raise serializers.ValidationError({"productos": errores})
+
+        pedido = Pedido.objects.create(
+            comprador=comprador,
+            precio_total=sum(item.subtotal() for item in items),
+            clave_idempotencia=clave,
+        )
+        ElementoPedido.objects.bulk_create([
+            ElementoPedido(
+                pedido=pedido,
+                producto=item.product,
+                cantidad=item.quantity,
+                precio_unitario=item.price_at_addition,
+            )
+            for item in items
+        ])
+        CartItem.objects.filter(cart=cart).delete()
+
+    return pedido, True
@@ -0,0 +1,257 @@
+# veluxapp/search.py
+"""
+Búsqueda de texto completo para el catálogo de productos.
+
+Hay dos implementaciones con la misma interfaz (actualizar / eliminar / filtrar):
+
+- BusquedaPostgres: columna persistida `search_vector` (tsvector) con índice GIN y
+  la configuración `spanish_unaccent` (stemming en español e insensible a tildes),
+  ambas creadas en la migración 0007.
+- IndiceInvertido: índice en memoria del proceso para SQLite/desarrollo, construido
+  a partir de los mismos campos.
+
+En ambos casos `nombre` pesa más que `lista_caracteristicas`, y esta más que
+`descripcion`. Las señales mantienen el índice al día al guardar o borrar productos.
+"""
+import bisect
+import json
+import threading
+import unicodedata
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.expressions import RawSQL
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+from .models import Productos
+
+CONFIG_BUSQUEDA = 'spanish_unaccent'
+
+# (campo, peso tsvector, peso índice en memoria)
+CAMPOS_BUSQUEDA = (
+    ('nombre', 'A', 4),
+    ('lista_caracteristicas', 'B', 2),
+    ('descripcion', 'C', 1),
+)
+
+
+def tokenizar(texto):
+    """
+    Pasa a minúsculas, quita tildes y separa en palabras alfanuméricas.
+    """
+    if not texto:
+        return []
+    texto = unicodedata.normalize('NFKD', str(texto).lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    palabra = []
+    tokens = []
+    for c in texto:
+        if c.isalnum():
+            palabra.append(c)
+        elif palabra:
+            tokens.append(''.join(palabra))
+            palabra = []
+    if palabra:
+        tokens.append(''.join(palabra))
+    return tokens
+
+
+def vector_busqueda():
+    """
+    Expresión tsvector ponderada, usada para la columna persistida.
+    """
+    vector = None
+    for campo, peso, _ in CAMPOS_BUSQUEDA:
+        parte = SearchVector(campo, weight=peso, config=CONFIG_BUSQUEDA)
+        vector = parte if vector is None else vector + parte
+    return vector
+
+
+# ------------------- PostgreSQL --------------------------
+class BusquedaPostgres:
+    def actualizar(self, producto):
+        Productos.objects.filter(pk=producto.pk).update(search_vector=vector_busqueda())
+
+    def eliminar(self, pk):
+        # La fila ya no existe; el índice GIN se actualiza solo.
+        pass
+
+    def filtrar(self, queryset, texto):
+        tokens = tokenizar(texto)
+        if not tokens:
+            return queryset
+        # Búsqueda por prefijo de cada término (AND), como hacía icontains con palabras sueltas
+        consulta = SearchQuery(
+            ' & '.join(f'{t}:*' for t in tokens),
+            config=CONFIG_BUSQUEDA,
+            search_type='raw',
+        )
+        return queryset.filter(search_vector=consulta).annotate(
+            search_rank=SearchRank(F('search_vector'), consulta)
+        )
+
+
+# ------------------- Índice invertido en memoria --------------------------
+class IndiceInvertido:
+    """
+    Índice invertido por proceso: token -> {pk: peso}.
+    Se construye perezosamente en la primera búsqueda y después se actualiza
+    de forma incremental desde las señales. Pensado para SQLite/desarrollo
+    (un único proceso); bulk_create()/update() no lo actualizan.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.invalidar()
+
+    def invalidar(self):
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._tokens_doc = {}
+            self._tokens_ordenados = []
+            self._ordenado = True
+            self._construido = False
+
+    def _construir(self):
+        campos = [campo for campo, _, _ in CAMPOS_BUSQUEDA]
+        for fila in Productos.objects.values_list('pk', *campos).iterator(chunk_size=2000):
+            self._indexar(fila[0], dict(zip(campos, fila[1:])))
+        self._construido = True
+
+    def _indexar(self, pk, valores):
+        pesos = defaultdict(int)
+        for campo, _, peso in CAMPOS_BUSQUEDA:
+            for token in set(tokenizar(valores.get(campo))):
+                pesos[token] += peso
+        for token, peso in pesos.items():
+            if token not in self._postings:
+                self._ordenado = False
+            self._postings[token][pk] = peso
+        self._tokens_doc[pk] = set(pesos)
+
+    def _desindexar(self, pk):
+        for token in self._tokens_doc.pop(pk, ()):
+            docs = self._postings.get(token)
+            if docs is not None:
+                docs.pop(pk, None)
+                if not docs:
+                    del self._postings[token]
+                    self._ordenado = False
+
+    def actualizar(self, producto):
+        with self._lock:
+            if not self._construido:
+                return
+            self._desindexar(producto.pk)
+            self._indexar(producto.pk, {
+                campo: getattr(producto, campo, '') for campo, _, _ in CAMPOS_BUSQUEDA
+            })
+
+    def eliminar(self, pk):
+        with self._lock:
+            if self._construido:
+                self._desindexar(pk)
+
+    def _con_prefijo(self, prefijo):
+        if not self._ordenado:
+            self._tokens_ordenados = sorted(self._postings)
+            self._ordenado = True
+        i = bisect.bisect_left(self._tokens_ordenados, prefijo)
+        while i < len(self._tokens_ordenados) and self._tokens_ordenados[i].startswith(prefijo):
+            yield self._tokens_ordenados[i]
+            i += 1
+
+    def buscar(self, texto):
+        """
+        Devuelve {pk: puntuación} de los productos que contienen todos los términos
+        (por prefijo). La puntuación suma, por término, el mejor peso encontrado.
+        """
+        tokens = tokenizar(texto)
+        if not tokens:
+            return {}
+        with self._lock:
+            if not self._construido:
+                self._construir()
+            resultado = None
+            for termino in set(tokens):
+                puntos = {}
+                for token in self._con_prefijo(termino):
+                    for pk, peso in self._postings[token].items():
+                        if peso > puntos.get(pk, 0):
+                            puntos[pk] = peso
+                if resultado is None:
+                    resultado = puntos
+                else:
+                    resultado = {
+                        pk: total + puntos[pk] for pk, total in resultado.items() if pk in puntos
+                    }
+                if not resultado:
+                    return {}
+            return resultado
+
+    def filtrar(self, queryset, texto):
+        if not tokenizar(texto):
+            return queryset
+        resultado = self.buscar(texto)
+        if not resultado:
+            return queryset.none()
+
+        por_puntaje = defaultdict(list)
+        for pk, puntos in resultado.items():
+            por_puntaje[puntos].append(pk)
+
+        return queryset.filter(pk__in=_lista_ids(list(resultado))).annotate(
+            search_rank=Case(
+                *[When(pk__in=_lista_ids(pks), then=Value(float(p))) for p, pks in por_puntaje.items()],
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+        )
+
+
+def _lista_ids(ids):
+    """
+    En SQLite se pasa la lista como un único parámetro JSON para no chocar con
+    el límite de variables por consulta cuando hay muchos resultados.
+    """
+    if connection.vendor == 'sqlite':
+        return RawSQL('SELECT value FROM json_each(%s)', (json.dumps(ids),))
+    return ids
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if connection.vendor == 'postgresql':
+                    _backend = BusquedaPostgres()
+                else:
+                    _backend = IndiceInvertido()
+    return _backend
+
+
+# ------------------- Filtro DRF --------------------------
+class ProductoSearchFilter(filters.SearchFilter):
+    """
+    Sustituye los icontains encadenados de SearchFilter por el backend de búsqueda.
+    Si el cliente no pide un orden explícito, se ordena por relevancia.
+    Debe ir después de OrderingFilter en filter_backends.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terminos = self.get_search_terms(request)
+        if not terminos:
+            return queryset
+        queryset = get_search_backend().filtrar(queryset, ' '.join(terminos))
+        ordenar_por_relevancia = 'search_rank' in queryset.query.annotations
+        if ordenar_por_relevancia and not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by('-search_rank', *(getattr(view, 'ordering', None) or ()))
+        return queryset
@@ -1,12 +1,19 @@
 # veluxapp/serializers.py
 
+import os
+import re
+from functools import lru_cache
 from urllib import request
 from rest_framework import serializers
 from django.conf import settings
+from django.db import models
 from django.contrib.auth import get_user_model
 from django.contrib.auth import authenticate
 from django.utils.text import slugify
 
+from .usuarios import crear_usuario
+from .autenticacion import CLAIM_REFRESH_JTI, RefreshTokenFiltrado
+from .subidas import MAX_PARTES, MAX_TAMANO, NOMBRE_SUBIDA, numero_partes
 from .models import (
     Categoria_Productos,
     Productos,
@@ -22,17 +29,126 @@ from .models import (
     Cart,       # <--- Importa el modelo Cart
     CartItem,   # <--- Importa el modelo CartItem
 )
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as JWTTokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as JWTTokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 from django.utils import timezone
 from datetime import timedelta
 
 User = get_user_model()
 
+
+# --- Resolución de URLs de imágenes ---
+
+@lru_cache(maxsize=4096)
+def _url_almacenamiento(storage, name):
+    """
+    Resuelve (y memoriza por proceso) la URL de un archivo en su storage.
+    Los nombres no se sobrescriben nunca (file_overwrite = False), así que la URL
+    de un nombre dado es estable y basta con calcularla una vez.
+    """
+    try:
+        return str(storage.url(name))
+    except Exception:
+        if str(name).startswith(('http://', 'https://')):
+            return str(name)
+        return None
+
+
+def url_archivo(storage, name, request=None):
+    """
+    Devuelve la URL absoluta del archivo `name` de `storage`.
+    """
+    url = _url_almacenamiento(storage, name)
+    if url and request and not url.startswith(('http://', 'https://')):
+        return request.build_absolute_uri(url)
+    return url
+
+
+def url_media(img_field, request=None):
+    """
+    Devuelve la URL absoluta de un ImageField (o None si no tiene archivo).
+    """
+    if not img_field or not getattr(img_field, 'name', None):
+        return None
+    return url_archivo(img_field.storage, img_field.name, request)
+
+
+class MediaImageField(serializers.ImageField):
+    """
+    ImageField que serializa usando el resolvedor de URLs memorizado.
+    """
+    def to_representation(self, value):
+        return url_media(value, self.context.get('request'))
+
+
 class FavoriteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Favorite
         fields = ('id', 'product')
 
+
+class FavoritosLoteSerializer(serializers.Serializer):
+    """
+    Entrada de FavoriteViewSet.lote: ids de productos a añadir y a quitar.
+    """
+    MAX_IDS = 500
+
+    agregar = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=MAX_IDS)
+    quitar = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=MAX_IDS)
+
+    def validate(self, attrs):
+        if not attrs['agregar'] and not attrs['quitar']:
+            raise serializers.ValidationError("Indica al menos un producto en 'agregar' o 'quitar'.")
+        if set(attrs['agregar']) & set(attrs['quitar']):
+            raise serializers.ValidationError("Un producto no puede estar a la vez en 'agregar' y 'quitar'.")
+        return attrs
+
+class ArchivoSubidaSerializer(serializers.Serializer):
+    """
+    Un archivo que el panel va a subir directamente a Spaces. El cliente calcula
+    el SHA-256 del contenido y con él se forma la clave, igual que hace el storage
+    direccionado por contenido (backend/storages_backends.py).
+    """
+    nombre = serializers.CharField(max_length=255)
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$')
+    content_type = serializers.RegexField(r'^[\w.+-]+/[\w.+-]+$', required=False)
+
+    def validate_nombre(self, value):
+        extension = os.path.splitext(value)[1].lower()
+        if not re.fullmatch(r'\.[a-z0-9]{1,5}', extension):
+            raise serializers.ValidationError('El archivo debe tener una extensión válida.')
+        return value
+
+
+class SubidasLoteSerializer(serializers.Serializer):
+    MAX_ARCHIVOS = 30
+
+    archivos = serializers.ListField(child=ArchivoSubidaSerializer(), min_length=1, max_length=MAX_ARCHIVOS)
+
+
+class IniciarSubidaSerializer(ArchivoSubidaSerializer):
+    tamano = serializers.IntegerField(min_value=1, max_value=MAX_TAMANO)
+
+    def validate_tamano(self, value):
+        if numero_partes(value) > MAX_PARTES:
+            raise serializers.ValidationError(f'El archivo no puede superar {MAX_PARTES} partes.')
+        return value
+
+
+class AbortarSubidaSerializer(serializers.Serializer):
+    nombre = serializers.RegexField(NOMBRE_SUBIDA)
+    upload_id = serializers.CharField(max_length=1024)
+
+
+class ParteSubidaSerializer(serializers.Serializer):
+    numero = serializers.IntegerField(min_value=1, max_value=MAX_PARTES)
+    etag = serializers.CharField(max_length=200)
+
+
+class CompletarSubidaSerializer(AbortarSubidaSerializer):
+    partes = serializers.ListField(child=ParteSubidaSerializer(), min_length=1, max_length=MAX_PARTES)
+
+
 # --- Serializadores Base (sin dependencias de otros serializadores personalizados) ---
 
 class GoogleAuthSerializer(serializers.Serializer):
@@ -87,14 +203,9 @@ class RegisterSerializer(serializers.Serializer):
     def create(self, validated):
         email = validated["email"].lower().strip()
         base_username = validated.get("username") or email.split("@")[0]
-        username = base_username
-        i = 1
-        while User.objects.filter(username=username).exists():
-            username = f"{base_username}_{i}"
-            i += 1
-
-        user = User.objects.create_user(
-            username=username,
+        # Primer nombre libre (base, base_1, base_2...) en una consulta, ver usuarios.py
+        user = crear_usuario(
+            base_username,
             email=email,
             password=validated["password"],
             first_name=validated.get("first_name", ""),
@@ -148,9 +259,8 @@ class ElementoPedidoSerializer(serializers.ModelSerializer):
 
     def get_producto_imagen1(self, obj):
         # Asegurarse de que el producto existe y tiene imagen1
-        if obj.producto and obj.producto.imagen1:
-            request = self.context.get('request')
-            return request.build_absolute_uri(obj.producto.imagen1.url) if request else obj.producto.imagen1.url
+        if obj.producto:
+            return url_media(obj.producto.imagen1, self.context.get('request'))
         return None
 
 # --- Serializadores con dependencias (usan los serializadores base definidos arriba) ---
@@ -162,41 +272,52 @@ class ProductosSerializer(serializers.ModelSerializer):
         queryset=Categoria_Productos.objects.all()
     )
     is_new = serializers.SerializerMethodField()
+    # Anotado con Exists() en ProductosViewSet para usuarios autenticados; False para anónimos
+    is_favorite = serializers.SerializerMethodField()
+    # {"imagen1": {"webp": "<url> 320w, <url> 640w, ...", "jpg": "..."}, ...} para srcset
+    variantes = serializers.SerializerMethodField()
+
+    # Las imágenes se serializan con el resolvedor memorizado (una llamada al storage por nombre)
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.ImageField: MediaImageField,
+    }
 
     class Meta:
         model = Productos
-        fields = '__all__'
+        exclude = ('search_vector', 'rating_suma', 'imagenes_variantes')
 
     def get_is_new(self, obj):
         new_threshold = timezone.now() - timedelta(days=30)
         return obj.fecha_subida >= new_threshold.date()
 
+    def get_is_favorite(self, obj):
+        return getattr(obj, 'is_favorite', False)
+
+    def get_variantes(self, obj):
+        request = self.context.get('request')
+        resultado = {}
+        for campo, entrada in (obj.imagenes_variantes or {}).items():
+            imagen = getattr(obj, campo, None)
+            # Variantes de una imagen que ya se reemplazó (aún procesándose la nueva)
+            if not imagen or entrada.get('origen') != imagen.name:
+                continue
+            resultado[campo] = {
+                formato: ', '.join(
+                    f'{url_archivo(imagen.storage, nombre, request)} {ancho}w'
+                    for ancho, nombre in sorted(por_ancho.items(), key=lambda par: int(par[0]))
+                )
+                for formato, por_ancho in entrada.items() if formato != 'origen'
+            }
+        return resultado
+
     def to_representation(self, instance):
         """
         Enviamos imágenes como URLs absolutas y categorías ANIDADAS (bonito para el front),
         aunque en escritura aceptamos IDs.
+        Las categorías deben venir precargadas (prefetch_related('categoria')) en listados.
         """
         rep = super().to_representation(instance)
-        request = self.context.get('request')
-
-        def safe(img_field):
-            if not img_field:
-                return None
-            try:
-                url = img_field.url
-            except Exception:
-                name = getattr(img_field, 'name', None)
-                if name and str(name).startswith(('http://', 'https://')):
-                    url = name
-                else:
-                    return None
-            if request and not str(url).startswith(('http://', 'https://')):
-                return request.build_absolute_uri(url)
-            return url
-
-        rep['imagen1'] = safe(instance.imagen1)
-        rep['imagen2'] = safe(instance.imagen2)
-        rep['imagen3'] = safe(instance.imagen3)
 
         # ⬇️ Devolver la categoría anidada (no IDs) para no romper el front
         rep['categoria'] = CategoriaProductosSerializer(
@@ -207,9 +328,23 @@ class ProductosSerializer(serializers.ModelSerializer):
 
         return rep
 
+class AutorReviewSerializer(serializers.ModelSerializer):
+    """
+    Autor de una review: solo lo que se muestra junto al comentario.
+    """
+    nombre = serializers.SerializerMethodField()
+
+    class Meta:
+        model = User
+        fields = ('id', 'nombre', 'profile_picture')
+
+    def get_nombre(self, obj):
+        return obj.get_full_name() or obj.username
+
+
 class ReviewsSerializer(serializers.ModelSerializer):
-    # UserSerializer está definido antes
-    usuario = UserSerializer(read_only=True)
+    # El usuario debe venir con select_related('usuario')
+    usuario = AutorReviewSerializer(read_only=True)
     
     class Meta:
         model = Reviews
@@ -223,7 +358,39 @@ class PedidoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Pedido
         fields = '__all__'
-        read_only_fields = ('precio_total',)
+        read_only_fields = ('precio_total', 'clave_idempotencia')
+
+class PedidoListSerializer(serializers.ModelSerializer):
+    """
+    Representación compacta para el historial de pedidos. `num_elementos` viene
+    anotado en el queryset (PedidoViewSet.get_queryset).
+    """
+    num_elementos = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Pedido
+        fields = ('id', 'fecha', 'vendido', 'precio_total', 'num_elementos')
+
+
+class LineaPedidoSerializer(serializers.Serializer):
+    producto_id = serializers.IntegerField()
+    cantidad = serializers.IntegerField(min_value=1)
+
+
+class CrearPedidoSerializer(serializers.Serializer):
+    """
+    Entrada de PedidoViewSet.create_order_with_items. Solo valida la forma de los
+    datos; los productos se comprueban al bloquearlos en pedidos.crear_pedido.
+    """
+    MAX_LINEAS = 200
+
+    productos = LineaPedidoSerializer(many=True, allow_empty=False, max_length=MAX_LINEAS)
+
+
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    # Sin consulta a token_blacklist salvo que el filtro de Bloom dé positivo
+    token_class = RefreshTokenFiltrado
+
 
 class CustomTokenObtainPairSerializer(JWTTokenObtainPairSerializer):
     identifier = serializers.CharField()
@@ -236,6 +403,12 @@ class CustomTokenObtainPairSerializer(JWTTokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
+        # Con estos claims JWTSinConsultaAuthentication no necesita cargar el usuario (ver autenticacion.py)
+        token['username'] = user.username
+        token['is_staff'] = user.is_staff
+        token['is_superuser'] = user.is_superuser
+        # Los access tokens heredan este claim: revocar el refresh token los revoca también
+        token[CLAIM_REFRESH_JTI] = token[api_settings.JTI_CLAIM]
         token['email'] = user.email
         token['first_name'] = user.first_name
         token['last_name'] = user.last_name
@@ -300,10 +473,7 @@ class ProductCartItemSerializer(serializers.ModelSerializer):
     imagen1 = serializers.SerializerMethodField()
 
     def get_imagen1(self, obj):
-        if obj.imagen1:
-            request = self.context.get('request')
-            return request.build_absolute_uri(obj.imagen1.url) if request else obj.imagen1.url
-        return None
+        return url_media(obj.imagen1, self.context.get('request'))
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -397,4 +567,53 @@ class UpdateCartItemSerializer(serializers.Serializer):
                     # Esto se manejará en `validate_product_id` o en la vista,
                     # pero es bueno tener la excepción aquí también.
                     pass
-        return value
\ No newline at end of file
+        return value
+
+class CartOperacionSerializer(serializers.Serializer):
+    """
+    Una operación sobre el carrito dentro de un lote:
+    - add: suma `quantity` a la cantidad actual (crea el ítem si no existe).
+    - set: fija la cantidad (0 elimina el ítem).
+    - remove: elimina el ítem.
+    """
+    OPERACIONES = ('add', 'set', 'remove')
+
+    op = serializers.ChoiceField(choices=OPERACIONES)
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'add' and attrs['quantity'] < 1:
+            raise serializers.ValidationError({"quantity": "Para 'add' la cantidad debe ser al menos 1."})
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    """
+    Serializador para aplicar varias operaciones al carrito en una sola petición.
+    Valida todos los productos con una única consulta id__in.
+    """
+    MAX_OPERACIONES = 200
+
+    operaciones = CartOperacionSerializer(many=True, allow_empty=False, max_length=MAX_OPERACIONES)
+
+    def validate(self, attrs):
+        operaciones = attrs['operaciones']
+        productos = Productos.objects.in_bulk({op['product_id'] for op in operaciones})
+
+        errores = {}
+        for i, op in enumerate(operaciones):
+            product = productos.get(op['product_id'])
+            if product is None:
+                errores[i] = "Producto no encontrado."
+            elif op['op'] != 'remove' and op['quantity'] > 0:
+                # Mismas reglas que AddToCartSerializer / UpdateCartItemSerializer
+                if not product.disponible:
+                    errores[i] = "Este producto no está disponible para la venta."
+                elif not product.stock:
+                    errores[i] = "Este producto está fuera de stock."
+        if errores:
+            raise serializers.ValidationError({"operaciones": errores})
+
+        attrs['productos'] = productos
+        return attrs
@@ -1,55 +1,177 @@
 # veluxapp/signals.py
 
 import logging
-from django.db.models.signals import post_delete, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save, m2m_changed
 from django.dispatch import receiver
-from .models import Productos
-from botocore.exceptions import BotoCoreError, ClientError
+from .models import Productos, Categoria_Productos, Pack, Colaboradores, Informacion, Equipo, Reviews
+from .cache import invalidar_modelo
+from .search import get_search_backend
+from .valoraciones import aplicar_valoracion
+from .imagenes import CAMPOS_IMAGEN, posibles_variantes, programar_variantes
+from .borrados import encolar_borrado
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
 
 logger = logging.getLogger(__name__)
 
 
-def borrar_imagen(imagen):
+def encolar_imagen(nombre, entrada=None):
     """
-    Elimina una imagen del almacenamiento si existe.
-    Maneja errores para evitar que afecte al flujo principal.
+    Encola el borrado de una imagen y de sus variantes. El worker de
+    veluxapp/borrados.py no borra nada mientras algún producto use `nombre`.
     """
-    if not imagen:
-        return
+    if nombre:
+        encolar_borrado([nombre, *posibles_variantes(nombre, entrada)], origen=nombre)
 
-    try:
-        if hasattr(imagen, "name") and imagen.name:
-            imagen.delete(save=False)
-            logger.debug(f"Imagen eliminada: {imagen.name}")
-    except (BotoCoreError, ClientError, OSError) as e:
-        logger.warning(f"No se pudo eliminar la imagen {getattr(imagen, 'name', None)}: {e}")
+
+def _imagenes_guardadas(instance):
+    """
+    Nombres de las imágenes del producto en la base de datos. Si se cargó con
+    todos los campos de imagen (lo normal) salen de from_db, sin consultar.
+    """
+    guardadas = getattr(instance, '_imagenes_guardadas', None) or {}
+    if all(campo in guardadas for campo in CAMPOS_IMAGEN):
+        return guardadas
+    fila = Productos.objects.filter(pk=instance.pk).values(*CAMPOS_IMAGEN).first()
+    return {campo: valor or '' for campo, valor in (fila or {}).items()}
 
 
 @receiver(post_delete, sender=Productos)
 def eliminar_imagenes_producto(sender, instance, **kwargs):
     """
-    Elimina todas las imágenes de Spaces cuando se borra un producto.
+    Encola el borrado de las imágenes (y sus variantes) de un producto borrado.
+    Las que otro producto comparte (mismo contenido, mismo archivo) se conservan.
     """
-    for campo in ("imagen1", "imagen2", "imagen3"):
-        borrar_imagen(getattr(instance, campo, None))
+    variantes = instance.imagenes_variantes or {}
+    for campo in CAMPOS_IMAGEN:
+        imagen = getattr(instance, campo, None)
+        if imagen:
+            encolar_imagen(imagen.name, variantes.get(campo))
 
 
 @receiver(pre_save, sender=Productos)
-def reemplazar_imagenes_producto(sender, instance, **kwargs):
+def reemplazar_imagenes_producto(sender, instance, raw=False, **kwargs):
+    """
+    Encola el borrado de las imágenes antiguas si fueron reemplazadas en una actualización.
+    """
+    if raw or not instance.pk:
+        return
+
+    guardadas = _imagenes_guardadas(instance)
+    variantes = dict(instance.imagenes_variantes or {})
+    # Archivos que este mismo producto sigue usando en otro campo
+    en_uso = {getattr(instance, c).name for c in CAMPOS_IMAGEN if getattr(instance, c, None)}
+    for campo in CAMPOS_IMAGEN:
+        antigua = guardadas.get(campo, '')
+        nueva = getattr(instance, campo).name or ''
+        if antigua == nueva:
+            continue
+        entrada = variantes.pop(campo, None)
+        if antigua and antigua not in en_uso:
+            encolar_imagen(antigua, entrada)
+    instance.imagenes_variantes = variantes
+
+
+@receiver(post_save, sender=Productos)
+def programar_variantes_producto(sender, instance, raw=False, **kwargs):
+    """
+    Genera en segundo plano las variantes de las imágenes que no las tengan.
+    Si el producto se cargó antes de que terminara un procesado anterior, su
+    imagenes_variantes puede estar desfasado; volver a procesar es barato porque
+    las variantes que ya existen no se regeneran.
+    """
+    if raw:
+        return
+    variantes = instance.imagenes_variantes or {}
+    instance._imagenes_guardadas = {c: getattr(instance, c).name or '' for c in CAMPOS_IMAGEN}
+    pendientes = [
+        campo for campo, nombre in instance._imagenes_guardadas.items()
+        if nombre and variantes.get(campo, {}).get('origen') != nombre
+    ]
+    if pendientes:
+        programar_variantes(instance.pk)
+
+
+# ------------------- Invalidación de la caché del catálogo --------------------------
+# Ojo: bulk_create()/update() no emiten señales; quien los use debe llamar a invalidar_modelo().
+MODELOS_CATALOGO = (Productos, Categoria_Productos, Pack, Colaboradores, Informacion, Equipo)
+
+
+def invalidar_catalogo(sender, **kwargs):
+    invalidar_modelo(sender)
+
+
+def invalidar_categorias_producto(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidar_modelo(Productos)
+
+
+for modelo in MODELOS_CATALOGO:
+    post_save.connect(invalidar_catalogo, sender=modelo, dispatch_uid=f'cache_save_{modelo.__name__}')
+    post_delete.connect(invalidar_catalogo, sender=modelo, dispatch_uid=f'cache_delete_{modelo.__name__}')
+
+m2m_changed.connect(invalidar_categorias_producto, sender=Productos.categoria.through, dispatch_uid='cache_m2m_categoria')
+
+
+# ------------------- Tokens revocados --------------------------
+@receiver(post_save, sender=BlacklistedToken)
+def avisar_token_revocado(sender, raw=False, **kwargs):
+    """
+    El contador de generación hace que todos los procesos reconstruyan su filtro
+    de tokens revocados (ver autenticacion.py).
+    """
+    if not raw:
+        invalidar_modelo(BlacklistedToken)
+
+
+# ------------------- Índice de búsqueda de productos --------------------------
+@receiver(post_save, sender=Productos)
+def indexar_producto(sender, instance, raw=False, **kwargs):
+    """
+    Mantiene actualizado el índice de búsqueda al crear o editar un producto.
+    """
+    if raw:
+        return  # loaddata
+    get_search_backend().actualizar(instance)
+
+
+@receiver(post_delete, sender=Productos)
+def desindexar_producto(sender, instance, **kwargs):
+    get_search_backend().eliminar(instance.pk)
+
+
+# ------------------- Valoraciones de productos --------------------------
+def _cuenta_en_valoracion(producto_id, puntaje, disponible):
+    return producto_id is not None and disponible and puntaje is not None
+
+
+@receiver(pre_save, sender=Reviews)
+def guardar_review_anterior(sender, instance, raw=False, **kwargs):
     """
-    Borra las imágenes antiguas solo si fueron reemplazadas en una actualización.
+    Guarda producto, puntaje y visibilidad anteriores para aplicar solo la diferencia.
     """
-    if not instance.pk:
-        return  # Producto nuevo
+    instance._valoracion_anterior = None
+    if raw or not instance.pk:
+        return
+    instance._valoracion_anterior = (
+        Reviews.objects.filter(pk=instance.pk).values_list('producto_id', 'puntaje', 'disponible').first()
+    )
 
-    try:
-        old_instance = Productos.objects.only("imagen1", "imagen2", "imagen3").get(pk=instance.pk)
-    except Productos.DoesNotExist:
+
+@receiver(post_save, sender=Reviews)
+def actualizar_valoracion(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    nueva = (instance.producto_id, instance.puntaje, instance.disponible)
+    anterior = getattr(instance, '_valoracion_anterior', None)
+    if anterior == nueva:
         return
+    if anterior and _cuenta_en_valoracion(*anterior):
+        aplicar_valoracion(anterior[0], anterior[1], -1)
+    if _cuenta_en_valoracion(*nueva):
+        aplicar_valoracion(nueva[0], nueva[1], 1)
 
-    for campo in ("imagen1", "imagen2", "imagen3"):
-        imagen_antigua = getattr(old_instance, campo, None)
-        imagen_nueva = getattr(instance, campo, None)
 
-        if imagen_antigua and imagen_antigua != imagen_nueva:
-            borrar_imagen(imagen_antigua)
+@receiver(post_delete, sender=Reviews)
+def descontar_valoracion(sender, instance, **kwargs):
+    if _cuenta_en_valoracion(instance.producto_id, instance.puntaje, instance.disponible):
+        aplicar_valoracion(instance.producto_id, instance.puntaje, -1)
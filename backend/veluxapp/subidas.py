@@ -0,0 +1,346 @@
+# veluxapp/subidas.py
+"""
+Subidas multipart directas al storage para los archivos grandes del panel.
+
+El navegador parte el archivo en trozos de TAMANO_PARTE bytes y sube cada uno a
+su URL; Django solo inicia, completa o aborta la subida y nunca recibe el archivo:
+
+- SubidaSpaces: multipart upload de S3 con una URL pre-firmada por parte.
+- SubidaLocal (desarrollo, FileSystemStorage): las URLs de las partes apuntan a
+  /api/subidas/<id>/partes/<n>/, que escribe el cuerpo a disco por bloques. Al
+  completar se concatenan en streaming y se comprueba el SHA-256.
+
+En ambos casos el nombre final es productos/<sha256>.<ext>, el mismo que daría el
+storage direccionado por contenido (backend/storages_backends.py), y es el valor
+que se guarda en imagen1/2/3. Si ese archivo ya existe no se sube nada.
+
+Lo que se sube directamente a Spaces (multipart o URL pre-firmada de
+get_presigned_urls) pasa por VerificacionPendiente: `manage.py verificar_subidas`
+calcula el SHA-256 del objeto y lo borra si no coincide con su nombre, para que
+un hash erróneo no deje bajo ese nombre otro contenido (y el storage direccionado
+no salte para siempre las subidas del contenido real).
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+import uuid
+from datetime import timedelta
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from django.urls import reverse
+
+from backend.storages_backends import MediaStorage, clave_media, get_s3_client
+from .models import VerificacionPendiente, media_storage
+
+logger = logging.getLogger(__name__)
+
+CARPETA_SUBIDAS = 'productos'
+NOMBRE_SUBIDA = re.compile(rf'^{CARPETA_SUBIDAS}/([0-9a-f]{{64}})\.[a-z0-9]{{1,5}}\Z')
+TAMANO_PARTE = 8 * 1024 * 1024  # S3 exige al menos 5 MiB en todas las partes salvo la última
+MAX_PARTES = 10000  # límite de S3
+MAX_TAMANO = 5 * 1024 ** 3
+BLOQUE = 64 * 1024
+EXPIRACION_URL = 3600
+
+
+class SubidaError(Exception):
+    """Error atribuible al cliente (partes que faltan, hash incorrecto...)."""
+
+
+def nombre_subida(nombre_archivo, sha256):
+    """productos/<sha256>.<ext> a partir del nombre original y del hash del contenido."""
+    extension = os.path.splitext(nombre_archivo)[1].lower()
+    return f'{CARPETA_SUBIDAS}/{sha256.lower()}{extension}'
+
+
+def numero_partes(tamano):
+    return max(1, math.ceil(tamano / TAMANO_PARTE))
+
+
+def _partes_ordenadas(partes, esperadas=None):
+    numeros = [parte['numero'] for parte in partes]
+    if sorted(numeros) != list(range(1, len(numeros) + 1)):
+        raise SubidaError('Las partes deben numerarse de 1 a N sin huecos ni repeticiones.')
+    if esperadas is not None and len(numeros) != esperadas:
+        raise SubidaError(f'Se esperaban {esperadas} partes y se recibieron {len(numeros)}.')
+    return sorted(partes, key=lambda parte: parte['numero'])
+
+
+# ------------------- Spaces / S3 --------------------------
+def subida_existente(nombre):
+    """
+    Respuesta de iniciar() cuando el archivo ya está en el storage: con nombres por
+    contenido es la misma foto y no hay nada que subir. Volver a subirla pisaría un
+    objeto que pueden estar usando otros productos.
+    """
+    return {'upload_id': None, 'nombre': nombre, 'existente': True, 'tamano_parte': TAMANO_PARTE, 'partes': []}
+
+
+class SubidaSpaces:
+    """
+    Multipart upload de S3. Spaces no comprueba el SHA-256 del contenido, así que
+    al completar solo se valida el tamaño (HeadObject) y el hash lo comprueba
+    después el worker de verificación (ver procesar_verificaciones).
+    """
+    requiere_verificacion = True
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.bucket = storage.bucket_name
+        self.client = get_s3_client()
+
+    @staticmethod
+    def clave(nombre):
+        # La clave donde MediaStorage lee `nombre`, igual que get_presigned_urls
+        return clave_media(nombre)
+
+    def iniciar(self, nombre, tamano, content_type=None, request=None):
+        if self.storage.exists(nombre):
+            return subida_existente(nombre)
+        params = {
+            'Bucket': self.bucket, 'Key': self.clave(nombre), 'ACL': 'public-read',
+            # Pasa al objeto al completar: HeadObject lo compara con el tamaño real
+            'Metadata': {'tamano': str(tamano)},
+        }
+        if content_type:
+            params['ContentType'] = content_type
+        upload_id = self.client.create_multipart_upload(**params)['UploadId']
+        partes = [
+            {
+                'numero': numero,
+                'url': self.client.generate_presigned_url(
+                    ClientMethod='upload_part',
+                    Params={'Bucket': self.bucket, 'Key': self.clave(nombre), 'UploadId': upload_id, 'PartNumber': numero},
+                    ExpiresIn=EXPIRACION_URL,
+                ),
+            }
+            for numero in range(1, numero_partes(tamano) + 1)
+        ]
+        return {'upload_id': upload_id, 'nombre': nombre, 'tamano_parte': TAMANO_PARTE, 'partes': partes}
+
+    def completar(self, nombre, upload_id, partes):
+        partes = _partes_ordenadas(partes)
+        if self.storage.exists(nombre):
+            # Otra subida del mismo contenido terminó antes: no se pisa el objeto compartido
+            self.abortar(nombre, upload_id)
+            return nombre
+        try:
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.clave(nombre),
+                UploadId=upload_id,
+                MultipartUpload={'Parts': [{'PartNumber': p['numero'], 'ETag': p['etag']} for p in partes]},
+            )
+        except ClientError as e:
+            codigo = e.response.get('Error', {}).get('Code')
+            if codigo in ('InvalidPart', 'InvalidPartOrder', 'NoSuchUpload', 'EntityTooSmall'):
+                raise SubidaError(f'No se pudo completar la subida ({codigo}).')
+            raise
+
+        objeto = self.client.head_object(Bucket=self.bucket, Key=self.clave(nombre))
+        if str(objeto['ContentLength']) != objeto.get('Metadata', {}).get('tamano'):
+            self.client.delete_object(Bucket=self.bucket, Key=self.clave(nombre))
+            raise SubidaError('El contenido subido no coincide con el tamaño indicado.')
+        return nombre
+
+    def abortar(self, nombre, upload_id):
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.clave(nombre), UploadId=upload_id)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise
+
+
+# ------------------- Disco local (desarrollo) --------------------------
+class SubidaLocal:
+    """
+    Guarda cada parte en <directorio>/<upload_id>/<n> sin pasar por memoria: el
+    cuerpo de la petición se lee en bloques de BLOQUE bytes.
+    """
+    ID_VALIDO = re.compile(r'[0-9a-f]{32}')
+    # El SHA-256 se comprueba al completar
+    requiere_verificacion = False
+
+    def __init__(self, storage, directorio):
+        self.storage = storage
+        self.directorio = directorio
+
+    def _carpeta(self, upload_id):
+        if not self.ID_VALIDO.fullmatch(upload_id or ''):
+            raise SubidaError('Identificador de subida no válido.')
+        carpeta = os.path.join(self.directorio, upload_id)
+        if not os.path.isdir(carpeta):
+            raise SubidaError('La subida no existe o ya terminó.')
+        return carpeta
+
+    def _metadatos(self, carpeta):
+        with open(os.path.join(carpeta, 'subida.json')) as f:
+            return json.load(f)
+
+    def iniciar(self, nombre, tamano, content_type=None, request=None):
+        if self.storage.exists(nombre):
+            return subida_existente(nombre)
+        upload_id = uuid.uuid4().hex
+        carpeta = os.path.join(self.directorio, upload_id)
+        os.makedirs(carpeta)
+        with open(os.path.join(carpeta, 'subida.json'), 'w') as f:
+            json.dump({'nombre': nombre, 'tamano': tamano}, f)
+        partes = []
+        for numero in range(1, numero_partes(tamano) + 1):
+            url = reverse('subida-parte', args=[upload_id, numero])
+            partes.append({'numero': numero, 'url': request.build_absolute_uri(url) if request else url})
+        return {'upload_id': upload_id, 'nombre': nombre, 'tamano_parte': TAMANO_PARTE, 'partes': partes}
+
+    def guardar_parte(self, upload_id, numero, stream):
+        """Escribe la parte `numero` leyendo `stream` por bloques. Devuelve su ETag (MD5, como S3)."""
+        carpeta = self._carpeta(upload_id)
+        destino = os.path.join(carpeta, str(numero))
+        md5 = hashlib.md5()
+        escritos = 0
+        with tempfile.NamedTemporaryFile(dir=carpeta, delete=False) as f:
+            try:
+                while bloque := stream.read(BLOQUE):
+                    escritos += len(bloque)
+                    if escritos > TAMANO_PARTE:
+                        raise SubidaError(f'Cada parte puede tener como máximo {TAMANO_PARTE} bytes.')
+                    md5.update(bloque)
+                    f.write(bloque)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        # Un reintento de la misma parte sustituye a la anterior
+        os.replace(f.name, destino)
+        etag = md5.hexdigest()
+        with open(f'{destino}.etag', 'w') as f:
+            f.write(etag)
+        return etag
+
+    def completar(self, nombre, upload_id, partes):
+        carpeta = self._carpeta(upload_id)
+        meta = self._metadatos(carpeta)
+        if meta['nombre'] != nombre:
+            raise SubidaError('El nombre no corresponde a esta subida.')
+        partes = _partes_ordenadas(partes, esperadas=numero_partes(meta['tamano']))
+
+        sha = hashlib.sha256()
+        tamano = 0
+        ensamblado = os.path.join(carpeta, 'ensamblado')
+        with open(ensamblado, 'wb') as salida:
+            for parte in partes:
+                ruta = os.path.join(carpeta, str(parte['numero']))
+                try:
+                    with open(f'{ruta}.etag') as f:
+                        etag = f.read()
+                except FileNotFoundError:
+                    raise SubidaError(f"Falta la parte {parte['numero']}.")
+                if etag != parte['etag'].strip('"'):
+                    raise SubidaError(f"La parte {parte['numero']} no coincide con la subida.")
+                with open(ruta, 'rb') as entrada:
+                    while bloque := entrada.read(BLOQUE):
+                        sha.update(bloque)
+                        salida.write(bloque)
+                        tamano += len(bloque)
+
+        if tamano != meta['tamano'] or sha.hexdigest() != NOMBRE_SUBIDA.fullmatch(nombre).group(1):
+            raise SubidaError('El contenido subido no coincide con el tamaño o el SHA-256 indicados.')
+        with open(ensamblado, 'rb') as f:
+            guardado = self.storage.guardar_derivado(nombre, File(f, name=nombre))
+        shutil.rmtree(carpeta, ignore_errors=True)
+        return guardado
+
+    def abortar(self, nombre, upload_id):
+        try:
+            carpeta = self._carpeta(upload_id)
+        except SubidaError:
+            return
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+
+def get_subidas():
+    if settings.USE_SPACES:
+        return SubidaSpaces(MediaStorage())
+    directorio = os.path.join(settings.FILE_UPLOAD_TEMP_DIR or tempfile.gettempdir(), 'velux-subidas')
+    os.makedirs(directorio, exist_ok=True)
+    return SubidaLocal(media_storage, directorio)
+
+
+# ------------------- Verificación del contenido --------------------------
+MAX_INTENTOS_VERIFICACION = 8
+LOTE_VERIFICACION = 20
+
+
+def encolar_verificacion(nombres):
+    filas = [VerificacionPendiente(nombre=nombre) for nombre in nombres if nombre]
+    if filas:
+        VerificacionPendiente.objects.bulk_create(filas)
+
+
+def sha256_archivo(storage, nombre):
+    sha = hashlib.sha256()
+    with storage.open(nombre, 'rb') as archivo:
+        for bloque in archivo.chunks(BLOQUE):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def _verificar(storage, fila, ahora):
+    """True si la fila está resuelta; False si hay que reintentarla más tarde."""
+    if not storage.exists(fila.nombre):
+        # Las subidas con URL pre-firmada pueden llegar hasta que caduca la URL
+        if fila.creado < ahora - timedelta(seconds=EXPIRACION_URL * 2):
+            return True
+        fila.ultimo_error = 'El archivo aún no existe.'
+        return False
+    esperado = NOMBRE_SUBIDA.fullmatch(fila.nombre)
+    if esperado and sha256_archivo(storage, fila.nombre) != esperado.group(1):
+        logger.error(f"El contenido de {fila.nombre} no coincide con su SHA-256; se borra.")
+        storage.delete(fila.nombre)
+    return True
+
+
+def procesar_verificaciones(lote=LOTE_VERIFICACION, storage=None):
+    """
+    Comprueba un lote de VerificacionPendiente. Devuelve cuántas filas se
+    resolvieron y cuántas quedan para más tarde (archivo aún no subido o error).
+    Como procesar_borrados, bloquea las filas con SKIP LOCKED.
+    """
+    storage = storage or media_storage
+    ahora = timezone.now()
+    resumen = {'verificados': 0, 'pendientes': 0}
+
+    with transaction.atomic():
+        filas = list(
+            VerificacionPendiente.objects.select_for_update(skip_locked=True)
+            .filter(disponible_en__lte=ahora, intentos__lt=MAX_INTENTOS_VERIFICACION)
+            .order_by('id')[:lote]
+        )
+        hechas, aplazadas = [], []
+        for fila in filas:
+            try:
+                resuelta = _verificar(storage, fila, ahora)
+            except (BotoCoreError, ClientError, OSError) as e:
+                fila.ultimo_error = str(e)[:1000]
+                resuelta = False
+            (hechas if resuelta else aplazadas).append(fila)
+
+        VerificacionPendiente.objects.filter(pk__in=[fila.pk for fila in hechas]).delete()
+        for fila in aplazadas:
+            fila.intentos += 1
+            fila.disponible_en = ahora + timedelta(minutes=min(2 ** fila.intentos, 60))
+            if fila.intentos >= MAX_INTENTOS_VERIFICACION:
+                logger.error(f"No se pudo verificar {fila.nombre} tras {fila.intentos} intentos: {fila.ultimo_error}")
+        if aplazadas:
+            VerificacionPendiente.objects.bulk_update(aplazadas, ['intentos', 'ultimo_error', 'disponible_en'])
+
+    resumen.update(verificados=len(hechas), pendientes=len(aplazadas))
+    return resumen
@@ -1,3 +1,1246 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.conf import settings
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+import jwt
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+from cryptography.hazmat.primitives.asymmetric import rsa
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from backend import storages_backends
+
+from .borrados import borrar_archivos, procesar_borrados
+from . import autenticacion, google_auth, imagenes, subidas, usuarios, views
+from .cache import get_cache
+from .imagenes import posibles_variantes
+from .mantenimiento import limpiar_carritos_invitados, podar_tokens
+from .models import (
+    BorradoPendiente, Cart, CartItem, Categoria_Productos, ElementoPedido, Favorite, Pedido, Productos, Reviews,
+    VerificacionPendiente, media_storage,
+)
+from .search import get_search_backend
+from .views_cart import CartBatchView
+from .serializers import CustomTokenRefreshSerializer
+
+
+def crear_productos(cantidad, categorias=()):
+    productos = Productos.objects.bulk_create([
+        Productos(
+            nombre=f'Producto {i}',
+            lista_caracteristicas='marca: Chibi',
+            precio=1000 + i,
+            imagen1=f'productos/foto_{i % 3}.jpg',
+        )
+        for i in range(cantidad)
+    ])
+    for producto in productos:
+        producto.categoria.set(categorias)
+    return productos
+
+
+class ProductosListadoTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.categorias = [
+            Categoria_Productos.objects.create(nombre='Skin'),
+            Categoria_Productos.objects.create(nombre='Tea'),
+        ]
+
+    def test_listado_con_numero_constante_de_consultas(self):
+        crear_productos(60, self.categorias)
+        # COUNT + página de productos + prefetch de categorías
+        for page_size in (5, 50):
+            with self.assertNumQueries(3):
+                response = self.client.get('/api/productos/', {'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['results']), page_size)
+
+    def test_listado_mantiene_categorias_anidadas_e_imagenes_absolutas(self):
+        crear_productos(1, self.categorias)
+        response = self.client.get('/api/productos/')
+        producto = response.json()['results'][0]
+        self.assertEqual(
+            sorted(c['nombre'] for c in producto['categoria']),
+            ['Skin', 'Tea'],
+        )
+        self.assertEqual(producto['imagen1'], 'http://testserver/media/productos/foto_0.jpg')
+        self.assertIsNone(producto['imagen2'])
+
+
+class CatalogoCacheTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.categoria = Categoria_Productos.objects.create(nombre='Skin')
+        crear_productos(3, [self.categoria])
+
+    def test_segunda_peticion_no_consulta_la_bd(self):
+        primera = self.client.get('/api/productos/', {'ordering': 'precio', 'utm_source': 'x'})
+        with self.assertNumQueries(0):
+            segunda = self.client.get('/api/productos/', {'utm_source': 'y', 'ordering': 'precio'})
+        self.assertEqual(primera.content, segunda.content)
+        self.assertEqual(primera['ETag'], segunda['ETag'])
+
+    @override_settings(ALLOWED_HOSTS=['a.example.com', 'b.example.com'])
+    def test_cada_host_tiene_su_entrada(self):
+        # Con ordering lo atiende el ViewSet; sin él, la vista async (mismas claves)
+        for parametros in ({'page_size': 1}, {'page_size': 1, 'ordering': 'precio'}):
+            for host in ('a.example.com', 'b.example.com'):
+                for _ in range(2):  # la segunda sale de la caché
+                    response = self.client.get('/api/productos/', parametros, HTTP_HOST=host)
+                    self.assertTrue(response.json()['next'].startswith(f'http://{host}/api/productos/?'))
+        self.assertIn('Authorization', response['Vary'])
+
+    def test_if_none_match_devuelve_304(self):
+        etag = self.client.get('/api/categorias/')['ETag']
+        response = self.client.get('/api/categorias/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_cambios_invalidan_la_respuesta(self):
+        etag = self.client.get('/api/productos/')['ETag']
+        producto = Productos.objects.first()
+        producto.nombre = 'Renombrado'
+        producto.save()
+        response = self.client.get('/api/productos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Renombrado')
+
+        etag = response['ETag']
+        nueva = Categoria_Productos.objects.create(nombre='Tea')
+        producto.categoria.add(nueva)
+        response = self.client.get('/api/productos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Tea')
+
+
+class ListadoAsyncTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        crear_productos(5, [Categoria_Productos.objects.create(nombre='Skin')])
+
+    def test_mismo_contenido_que_el_viewset(self):
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/api/productos/').func))
+        parametros = {'page': 2, 'page_size': 2}
+        viewset = views.ProductosViewSet.as_view({'get': 'list'})(RequestFactory().get('/api/productos/', parametros))
+        get_cache().clear()
+
+        # COUNT + página + categorías con el ORM async; después, desde la caché
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/productos/', parametros)
+        self.assertEqual(response.content, viewset.content)
+        self.assertEqual(response.json()['next'], 'http://testserver/api/productos/?page=3&page_size=2')
+        with self.assertNumQueries(0):
+            cacheada = self.client.get('/api/productos/', parametros, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cacheada.status_code, 304)
+
+    def test_lo_demas_lo_atiende_el_viewset(self):
+        self.assertEqual(self.client.get('/api/productos/', {'page': 9}).status_code, 404)
+        self.assertEqual(self.client.get('/api/productos/', {'page': 'x'}).status_code, 404)
+        self.assertNotIn('count', self.client.get('/api/productos/', {'paginacion': 'cursor'}).json())
+        self.assertEqual(self.client.post('/api/categorias/', {'nombre': 'Tea'}, format='json').status_code, 401)
+
+
+class BusquedaProductosTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        get_search_backend().invalidar()
+        self.client = APIClient()
+        self.en_descripcion = Productos.objects.create(
+            nombre='Serum facial', descripcion='Con crema de cúrcuma', lista_caracteristicas='marca: Chibi', precio=10,
+        )
+        self.en_nombre = Productos.objects.create(
+            nombre='Crema hidratante', descripcion='Para piel seca', lista_caracteristicas='marca: Ahava', precio=20,
+        )
+
+    def buscar(self, texto):
+        response = self.client.get('/api/productos/', {'search': texto})
+        return [p['id'] for p in response.json()['results']]
+
+    def test_nombre_pesa_mas_que_descripcion(self):
+        self.assertEqual(self.buscar('crema'), [self.en_nombre.id, self.en_descripcion.id])
+
+    def test_ignora_tildes_y_busca_por_prefijo(self):
+        self.assertEqual(self.buscar('CURCU'), [self.en_descripcion.id])
+        self.assertEqual(self.buscar('crema ahava'), [self.en_nombre.id])
+        self.assertEqual(self.buscar('inexistente'), [])
+
+    def test_indice_se_actualiza_al_guardar_y_borrar(self):
+        self.buscar('crema')  # construye el índice
+        self.en_descripcion.nombre = 'Tónico de moringa'
+        self.en_descripcion.save()
+        self.assertEqual(self.buscar('tonico'), [self.en_descripcion.id])
+        self.en_descripcion.delete()
+        self.assertEqual(self.buscar('moringa'), [])
+
+
+class PaginacionCursorTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        # Todos comparten fecha_subida: el id debe desempatar sin saltos ni repetidos
+        self.productos = crear_productos(23, [Categoria_Productos.objects.create(nombre='Skin')])
+
+    def recorrer(self, params=None, **headers):
+        ids = []
+        response = self.client.get('/api/productos/', {'page_size': 5, **(params or {})}, **headers).json()
+        while True:
+            ids.extend(p['id'] for p in response['results'])
+            if not response['next']:
+                return ids, response
+            response = self.client.get(response['next']).json()
+
+    def test_recorre_todo_en_orden_por_defecto(self):
+        ids, ultima = self.recorrer({'paginacion': 'cursor'})
+        self.assertEqual(ids, sorted((p.id for p in self.productos), reverse=True))
+        self.assertNotIn('count', ultima)
+
+    def test_respeta_ordering_y_cabecera(self):
+        ids, _ = self.recorrer({'ordering': 'precio'}, HTTP_X_PAGINACION='cursor')
+        self.assertEqual(ids, [p.id for p in sorted(self.productos, key=lambda p: p.precio)])
+
+    def test_sin_count_salvo_que_se_pida(self):
+        # Página + prefetch de categorías, sin COUNT(*)
+        with self.assertNumQueries(2):
+            self.client.get('/api/productos/', {'paginacion': 'cursor'})
+        response = self.client.get('/api/productos/', {'paginacion': 'cursor', 'con_total': 1}).json()
+        self.assertEqual(response['count'], 23)
+
+    def test_modo_pagina_sin_cambios(self):
+        response = self.client.get('/api/productos/', {'page': 2, 'page_size': 5}).json()
+        self.assertEqual(response['count'], 23)
+        self.assertIn('previous', response)
+        self.assertEqual(len(response['results']), 5)
+
+
+class CarritoLecturaTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.productos = crear_productos(100)
+
+    def llenar(self, cart, lineas):
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=p, quantity=2, price_at_addition=p.precio)
+            for p in self.productos[:lineas]
+        ])
+
+    def test_carrito_invitado_en_dos_consultas(self):
+        for lineas in (1, 10, 100):
+            cart = Cart.objects.create(session_key=str(uuid.uuid4()))
+            self.llenar(cart, lineas)
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/cart/', HTTP_X_SESSION_KEY=cart.session_key)
+            data = response.json()
+            self.assertEqual(len(data['items']), lineas)
+            self.assertEqual(data['total_items'], 2 * lineas)
+            self.assertEqual(data['total_price'], sum(2 * p.precio for p in self.productos[:lineas]))
+            self.assertEqual(response['X-Session-Key'], cart.session_key)
+
+    def test_invitado_nuevo_no_crea_carrito_hasta_modificarlo(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/cart/')
+        session_key = response['X-Session-Key']
+        self.assertEqual(response.json()['items'], [])
+        self.assertFalse(Cart.objects.exists())
+
+        # Con la misma clave sigue sin crearse nada (1 consulta: buscar el carrito)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/cart/', HTTP_X_SESSION_KEY=session_key)
+        self.assertEqual(response['X-Session-Key'], session_key)
+
+        response = self.client.post('/api/cart/', {'product_id': self.productos[0].id, 'quantity': 1},
+                                    format='json', HTTP_X_SESSION_KEY=session_key)
+        self.assertEqual(response['X-Session-Key'], session_key)
+        self.assertEqual(Cart.objects.get().session_key, session_key)
+        vacio = self.client.get('/api/cart/', HTTP_X_SESSION_KEY=str(uuid.uuid4())).json()
+        self.assertEqual(set(vacio), set(response.json()))
+
+    def test_carrito_usuario_en_dos_consultas(self):
+        for lineas in (1, 10, 100):
+            user = get_user_model().objects.create_user(username=f'user{lineas}', password='x')
+            self.llenar(Cart.objects.create(user=user), lineas)
+            self.client.force_authenticate(user)
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/cart/')
+            self.assertEqual(response.json()['total_items'], 2 * lineas)
+
+    def test_mutacion_devuelve_carrito_actualizado(self):
+        cart = Cart.objects.create(session_key=str(uuid.uuid4()))
+        producto = self.productos[0]
+        response = self.client.post(
+            '/api/cart/', {'product_id': producto.id, 'quantity': 3}, format='json',
+            HTTP_X_SESSION_KEY=cart.session_key,
+        )
+        self.assertEqual(response.json()['total_items'], 3)
+        response = self.client.put(
+            '/api/cart/', {'product_id': producto.id, 'quantity': 1}, format='json',
+            HTTP_X_SESSION_KEY=cart.session_key,
+        )
+        self.assertEqual(response.json()['total_price'], producto.precio)
+
+
+class CarritoLoteTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.productos = crear_productos(60)
+        self.cart = Cart.objects.create(session_key=str(uuid.uuid4()))
+        CartItem.objects.create(cart=self.cart, product=self.productos[0], quantity=1, price_at_addition=1)
+        CartItem.objects.create(cart=self.cart, product=self.productos[1], quantity=1, price_at_addition=1)
+
+    def lote(self, operaciones):
+        return self.client.post(
+            '/api/cart/batch/', {'operaciones': operaciones}, format='json',
+            HTTP_X_SESSION_KEY=self.cart.session_key,
+        )
+
+    def test_aplica_operaciones_en_orden(self):
+        p = self.productos
+        response = self.lote([
+            {'op': 'add', 'product_id': p[0].id, 'quantity': 2},
+            {'op': 'remove', 'product_id': p[1].id},
+            {'op': 'set', 'product_id': p[2].id, 'quantity': 4},
+            {'op': 'add', 'product_id': p[2].id, 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 200)
+        cantidades = {i['product']['id']: i['quantity'] for i in response.json()['items']}
+        self.assertEqual(cantidades, {p[0].id: 3, p[2].id: 5})
+
+    def test_producto_invalido_no_aplica_nada(self):
+        Productos.objects.filter(pk=self.productos[3].pk).update(stock=False)
+        response = self.lote([
+            {'op': 'add', 'product_id': self.productos[2].id},
+            {'op': 'add', 'product_id': self.productos[3].id},
+            {'op': 'add', 'product_id': 999999},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()['operaciones']), {'1', '2'})
+        self.assertEqual(self.cart.items.count(), 2)
+
+    def test_carrito_borrado_por_la_limpieza_se_vuelve_a_crear(self):
+        get_cart = CartBatchView.get_cart
+
+        def get_cart_y_limpiar(vista, request, crear=True):
+            cart = get_cart(vista, request, crear)
+            # limpiar_carritos pasa justo después de leer el carrito, antes del bloqueo
+            Cart.objects.filter(pk=self.cart.pk).delete()
+            return cart
+
+        with mock.patch.object(CartBatchView, 'get_cart', get_cart_y_limpiar):
+            response = self.lote([{'op': 'add', 'product_id': self.productos[2].id, 'quantity': 2}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_items'], 2)
+        self.assertEqual(response['X-Session-Key'], self.cart.session_key)
+        self.assertEqual(Cart.objects.get(session_key=self.cart.session_key).items.count(), 1)
+
+    def test_consultas_no_crecen_con_el_lote(self):
+        # validación + carrito + savepoint + bloqueo (updated_at) + ítems + update + insert + release + respuesta
+        for n, cantidad in ((10, 2), (50, 3)):
+            ops = [{'op': 'set', 'product_id': p.id, 'quantity': cantidad} for p in self.productos[:n]]
+            with self.assertNumQueries(9):
+                response = self.lote(ops)
+            self.assertEqual(response.json()['total_items'], n * cantidad)
+
+
+class FusionCarritoTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.productos = crear_productos(80)
+
+    def preparar(self, n, nombre):
+        """Carrito de usuario con los n/2 primeros productos y de invitado con n productos."""
+        user = get_user_model().objects.create_user(username=nombre, password='x')
+        user_cart = Cart.objects.create(user=user)
+        guest = Cart.objects.create(session_key=str(uuid.uuid4()))
+        CartItem.objects.bulk_create(
+            [CartItem(cart=user_cart, product=p, quantity=1, price_at_addition=1) for p in self.productos[:n // 2]]
+            + [CartItem(cart=guest, product=p, quantity=2, price_at_addition=1) for p in self.productos[:n]]
+        )
+        self.client.force_authenticate(user)
+        return guest
+
+    def test_fusion_con_consultas_constantes(self):
+        esperadas = None
+        for n in (4, 40):
+            guest = self.preparar(n, f'u{n}')
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get('/api/cart/', HTTP_X_SESSION_KEY=guest.session_key)
+            esperadas = esperadas or len(ctx.captured_queries)
+            self.assertEqual(len(ctx.captured_queries), esperadas)
+
+            cantidades = [i['quantity'] for i in response.json()['items']]
+            self.assertEqual(sorted(cantidades), sorted([3] * (n // 2) + [2] * (n - n // 2)))
+            self.assertFalse(Cart.objects.filter(pk=guest.pk).exists())
+            self.assertNotIn('X-Session-Key', response)
+
+
+class LimpiezaCarritosTests(TestCase):
+    def test_borra_solo_invitados_inactivos_por_lotes(self):
+        productos = crear_productos(2)
+        user = get_user_model().objects.create_user(username='cliente', password='x')
+        viejo = timezone.now() - timedelta(days=40)
+
+        caducados = Cart.objects.bulk_create([Cart(session_key=str(uuid.uuid4())) for _ in range(5)])
+        activo = Cart.objects.create(session_key=str(uuid.uuid4()))
+        de_usuario = Cart.objects.create(user=user)
+        CartItem.objects.bulk_create(
+            [CartItem(cart=c, product=productos[0], quantity=1, price_at_addition=1) for c in caducados]
+        )
+        Cart.objects.filter(pk__in=[c.pk for c in caducados] + [de_usuario.pk]).update(updated_at=viejo)
+
+        resumen = limpiar_carritos_invitados(dias=30, lote=2)
+
+        self.assertEqual((resumen['carritos'], resumen['items'], resumen['lotes']), (5, 5, 3))
+        self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {activo.pk, de_usuario.pk})
+
+    def test_modificar_el_carrito_renueva_su_actividad(self):
+        producto = crear_productos(1)[0]
+        cart = Cart.objects.create(session_key=str(uuid.uuid4()))
+        Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now() - timedelta(days=40))
+
+        APIClient().post('/api/cart/', {'product_id': producto.id, 'quantity': 1},
+                         format='json', HTTP_X_SESSION_KEY=cart.session_key)
+
+        self.assertEqual(limpiar_carritos_invitados(dias=30)['carritos'], 0)
+
+
+class CrearPedidoTests(TestCase):
+    URL = '/api/pedidos/crear-pedido-con-productos/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.productos = crear_productos(60)
+        self.client.force_authenticate(get_user_model().objects.create_user(username='comprador', password='x'))
+
+    def test_consultas_constantes_y_total_en_el_insert(self):
+        # savepoint + productos FOR UPDATE + pedido + elementos + release
+        # + elementos con producto + ids de `productos` (M2M del serializer)
+        for n in (2, 50):
+            lineas = [{'producto_id': p.id, 'cantidad': 2} for p in self.productos[:n]]
+            with self.assertNumQueries(7):
+                response = self.client.post(self.URL, {'productos': lineas}, format='json')
+            self.assertEqual(response.status_code, 201)
+            data = response.json()
+            self.assertEqual(len(data['elementos']), n)
+            self.assertEqual(data['precio_total'], sum(2 * p.precio for p in self.productos[:n]))
+
+    def test_linea_invalida_da_400_sin_crear_nada(self):
+        lineas = [{'producto_id': self.productos[0].id, 'cantidad': 1}, {'producto_id': 999999, 'cantidad': 1}]
+        response = self.client.post(self.URL, {'productos': lineas}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('1', response.json()['productos'])
+
+        response = self.client.post(self.URL, {'productos': [{'producto_id': self.productos[0].id}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Pedido.objects.exists())
+
+
+class CheckoutTests(TestCase):
+    URL = '/api/pedidos/checkout/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.productos = crear_productos(3)
+        self.user = get_user_model().objects.create_user(username='comprador', password='x')
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=self.cart, product=p, quantity=i + 1, price_at_addition=500)
+            for i, p in enumerate(self.productos)
+        ])
+        self.client.force_authenticate(self.user)
+
+    def test_checkout_usa_precio_del_carrito_y_lo_vacia(self):
+        Productos.objects.update(precio=9999)
+        response = self.client.post(self.URL, HTTP_IDEMPOTENCY_KEY='pago-1')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['precio_total'], 500 * (1 + 2 + 3))
+        self.assertEqual({e['precio_unitario'] for e in data['elementos']}, {500})
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_reintento_con_la_misma_clave_no_duplica(self):
+        primero = self.client.post(self.URL, HTTP_IDEMPOTENCY_KEY='pago-1')
+        repetido = self.client.post(self.URL, HTTP_IDEMPOTENCY_KEY='pago-1')
+        self.assertEqual(repetido.status_code, 200)
+        self.assertEqual(repetido.json()['id'], primero.json()['id'])
+        self.assertEqual(Pedido.objects.count(), 1)
+
+        # Con una clave nueva el carrito ya está vacío
+        self.assertEqual(self.client.post(self.URL, HTTP_IDEMPOTENCY_KEY='pago-2').status_code, 400)
+        self.assertEqual(self.client.post(self.URL).status_code, 400)
+
+
+class HistorialPedidosTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.productos = crear_productos(5)
+        self.user = get_user_model().objects.create_user(username='comprador', password='x')
+        otro = get_user_model().objects.create_user(username='otro', password='x')
+        for i in range(20):
+            pedido = Pedido.objects.create(comprador=otro if i % 4 == 0 else self.user)
+            ElementoPedido.objects.bulk_create([
+                ElementoPedido(pedido=pedido, producto=p, cantidad=1, precio_unitario=p.precio)
+                for p in self.productos[:i % 5 + 1]
+            ])
+        self.client.force_authenticate(self.user)
+
+    def test_listado_compacto_con_consultas_constantes(self):
+        # COUNT + página (con el número de elementos en subconsulta)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/pedidos/')
+        data = response.json()
+        self.assertEqual(data['count'], 15)
+        primero = data['results'][0]
+        self.assertEqual(set(primero), {'id', 'fecha', 'vendido', 'precio_total', 'num_elementos'})
+        pedido = Pedido.objects.get(pk=primero['id'])
+        self.assertEqual(primero['num_elementos'], pedido.elementos.count())
+        ids = [p['id'] for p in data['results']]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+        # Un pedido sin elementos (alta directa del admin) cuenta 0, no null
+        vacio = Pedido.objects.create(comprador=self.user)
+        primero = self.client.get('/api/pedidos/').json()['results'][0]
+        self.assertEqual((primero['id'], primero['num_elementos']), (vacio.id, 0))
+
+    def test_detalle_sin_consultas_por_elemento(self):
+        pedido = Pedido.objects.filter(comprador=self.user).order_by('-id').first()
+        # pedido con comprador + productos + elementos con producto
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/pedidos/{pedido.id}/')
+        self.assertEqual(len(response.json()['elementos']), pedido.elementos.count())
+
+
+class ValoracionesTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.producto, self.otro = crear_productos(2)
+        self.user = get_user_model().objects.create_user(username='autor', password='x')
+
+    def valoracion(self, producto):
+        producto.refresh_from_db()
+        return producto.rating_count, producto.rating_avg
+
+    def review(self, puntaje, producto=None, **kwargs):
+        return Reviews.objects.create(
+            producto=producto or self.producto, usuario=self.user,
+            comentario=str(uuid.uuid4()), puntaje=puntaje, **kwargs
+        )
+
+    def test_se_actualiza_al_crear_editar_ocultar_y_borrar(self):
+        primera = self.review(5)
+        segunda = self.review(2)
+        self.review(1, disponible=False)
+        self.assertEqual(self.valoracion(self.producto), (2, 3.5))
+
+        segunda.puntaje = 4
+        segunda.save()
+        self.assertEqual(self.valoracion(self.producto), (2, 4.5))
+
+        primera.disponible = False
+        primera.save()
+        self.assertEqual(self.valoracion(self.producto), (1, 4.0))
+
+        segunda.producto = self.otro
+        segunda.save()
+        self.assertEqual(self.valoracion(self.producto), (0, 0.0))
+        self.assertEqual(self.valoracion(self.otro), (1, 4.0))
+
+        segunda.delete()
+        self.assertEqual(self.valoracion(self.otro), (0, 0.0))
+
+    def test_guardar_el_producto_no_pisa_la_valoracion(self):
+        en_memoria = Productos.objects.get(pk=self.producto.pk)
+        self.review(5)  # llega mientras el admin edita el producto
+        en_memoria.nombre = 'Renombrado'
+        en_memoria.save()
+        self.assertEqual(self.valoracion(self.producto), (1, 5.0))
+        self.assertEqual(self.producto.nombre, 'Renombrado')
+
+    def test_recalcular_y_ordenar_por_valoracion(self):
+        self.review(3)
+        self.review(5, producto=self.otro)
+        Productos.objects.update(rating_count=0, rating_suma=0, rating_avg=0)
+
+        call_command('recalcular_valoraciones', stdout=io.StringIO())
+
+        self.assertEqual(self.valoracion(self.producto), (1, 3.0))
+        data = APIClient().get('/api/productos/', {'ordering': '-rating_avg'}).json()
+        self.assertEqual([p['id'] for p in data['results']], [self.otro.id, self.producto.id])
+        self.assertEqual(data['results'][0]['rating_avg'], 5.0)
+        self.assertNotIn('rating_suma', data['results'][0])
+
+
+class ReviewsListadoTests(TestCase):
+    def setUp(self):
+        self.producto, otro = crear_productos(2)
+        autores = [
+            get_user_model().objects.create_user(username=f'autor{i}', password='x', first_name=f'Nombre{i}')
+            for i in range(5)
+        ]
+        Reviews.objects.bulk_create([
+            Reviews(producto=self.producto if i % 5 else otro, usuario=autores[i % 5], comentario=f'review {i}')
+            for i in range(60)
+        ])
+
+    def test_cursor_por_producto_sin_consultas_por_autor(self):
+        url, vistos = '/api/reviews/', []
+        params = {'producto': self.producto.id, 'paginacion': 'cursor'}
+        while url:
+            # validación del filtro producto (django-filter) + página con autores
+            with self.assertNumQueries(2):
+                data = APIClient().get(url, params).json()
+            vistos += [r['id'] for r in data['results']]
+            url, params = data['next'], None
+
+        esperados = list(Reviews.objects.filter(producto=self.producto).order_by('-fecha', '-id').values_list('id', flat=True))
+        self.assertEqual(vistos, esperados)
+        autor = APIClient().get('/api/reviews/', {'producto': self.producto.id}).json()['results'][0]['usuario']
+        self.assertEqual(set(autor), {'id', 'nombre', 'profile_picture'})
+        self.assertTrue(autor['nombre'].startswith('Nombre'))
+
+
+class FavoritosTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.productos = crear_productos(6)
+        self.user = get_user_model().objects.create_user(username='fan', password='x')
+        self.client.force_authenticate(self.user)
+
+    def test_lote_y_marca_en_el_listado(self):
+        Favorite.objects.create(user=self.user, product=self.productos[0])
+        ids = [p.id for p in self.productos]
+        # savepoint + DELETE + productos existentes + INSERT ... ON CONFLICT + release
+        with self.assertNumQueries(5):
+            response = self.client.post('/api/favoritos/lote/', {
+                'agregar': ids[1:4] + [999999], 'quitar': [ids[0]],
+            }, format='json')
+        self.assertEqual(response.json()['favoritos'], ids[1:4])
+        self.assertEqual(set(Favorite.objects.values_list('product_id', flat=True)), set(ids[1:4]))
+
+        # COUNT + página (con EXISTS) + categorías
+        with self.assertNumQueries(3):
+            data = self.client.get('/api/productos/').json()
+        marcados = {p['id'] for p in data['results'] if p['is_favorite']}
+        self.assertEqual(marcados, set(ids[1:4]))
+
+        anonimo = APIClient().get('/api/productos/').json()
+        self.assertFalse(any(p['is_favorite'] for p in anonimo['results']))
+
+
+@override_settings(IMAGENES_VARIANTES_WORKERS=0)
+class VariantesImagenTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        ajuste = override_settings(MEDIA_ROOT=media)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+    def jpeg(self, nombre, ancho, alto):
+        buffer = io.BytesIO()
+        Image.new('RGB', (ancho, alto), (200, 120, 40)).save(buffer, 'JPEG')
+        return SimpleUploadedFile(nombre, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_genera_variantes_y_las_expone_como_srcset(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            producto = Productos.objects.create(
+                nombre='Té', lista_caracteristicas='x', precio=1000, imagen1=self.jpeg('te.jpg', 1000, 500),
+            )
+        producto.refresh_from_db()
+        entrada = producto.imagenes_variantes['imagen1']
+        self.assertEqual(entrada['origen'], producto.imagen1.name)
+        self.assertEqual(set(entrada['webp']), {'320', '640'})  # nunca se amplía a 1280
+        storage = producto.imagen1.storage
+        with storage.open(entrada['webp']['320']) as archivo:
+            self.assertEqual(Image.open(archivo).size, (320, 160))
+
+        variantes = APIClient().get(f'/api/productos/{producto.id}/').json()['variantes']
+        self.assertRegex(variantes['imagen1']['jpg'], r'^http://testserver/media/\S+_w320\.jpg 320w, \S+_w640\.jpg 640w$')
+
+        # Al reemplazar la imagen se borran las variantes antiguas y se generan las nuevas
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.imagen1 = self.jpeg('otra.jpg', 400, 400)
+            producto.save()
+        self.assertTrue(storage.exists(entrada['webp']['320']))  # el borrado va a la cola
+        self.assertEqual(procesar_borrados()['borrados'], 1 + len(posibles_variantes(entrada['origen'])))
+        self.assertFalse(storage.exists(entrada['origen']))
+        self.assertFalse(storage.exists(entrada['webp']['320']))
+        producto.refresh_from_db()
+        self.assertEqual(set(producto.imagenes_variantes['imagen1']['jpg']), {'320'})
+
+    def test_volver_a_subir_una_foto_encolada_cancela_su_borrado(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            a = Productos.objects.create(nombre='A', lista_caracteristicas='x', precio=1, imagen1=self.jpeg('a.jpg', 700, 700))
+        a.refresh_from_db()
+        storage = a.imagen1.storage
+        original, variante = a.imagen1.name, a.imagenes_variantes['imagen1']['webp']['640']
+        a.delete()  # encola la foto y sus variantes
+
+        # La misma foto se guarda para un producto nuevo (ya existe: no se sube) y el
+        # worker pasa antes de que el producto llegue a la base de datos
+        self.assertEqual(storage.save('productos/copia.jpg', self.jpeg('copia.jpg', 700, 700)), original)
+        procesar_borrados()
+        Productos.objects.create(nombre='B', lista_caracteristicas='x', precio=1, imagen1=original)
+        self.assertTrue(storage.exists(original))
+        self.assertTrue(storage.exists(variante))
+        self.assertFalse(BorradoPendiente.objects.exists())
+
+    def test_misma_foto_se_guarda_una_vez_y_se_borra_con_el_ultimo_producto(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            a = Productos.objects.create(nombre='A', lista_caracteristicas='x', precio=1, imagen1=self.jpeg('a.jpg', 700, 700))
+            b = Productos.objects.create(nombre='B', lista_caracteristicas='x', precio=1, imagen1=self.jpeg('b_copia.jpg', 700, 700))
+        a.refresh_from_db()
+        b.refresh_from_db()
+        self.assertEqual(a.imagen1.name, b.imagen1.name)
+        self.assertRegex(a.imagen1.name, r'^productos/[0-9a-f]{64}\.jpg$')
+        storage = a.imagen1.storage
+        variante = a.imagenes_variantes['imagen1']['webp']['640']
+        self.assertEqual(b.imagenes_variantes['imagen1']['webp']['640'], variante)
+
+        original = a.imagen1.name
+        a.delete()
+        self.assertEqual(procesar_borrados()['borrados'], 0)
+        self.assertTrue(storage.exists(original))
+        self.assertTrue(storage.exists(variante))
+        b.delete()
+        procesar_borrados()
+        self.assertFalse(BorradoPendiente.objects.exists())
+        self.assertFalse(storage.exists(original))
+        self.assertFalse(storage.exists(variante))
+
+    def test_deduplicar_imagenes_antiguas(self):
+        storage = Productos._meta.get_field('imagen1').storage
+        contenido = self.jpeg('x.jpg', 50, 50).read()
+        for nombre in ('productos/te.jpg', 'productos/te_7TC7I1l.jpg'):
+            os.makedirs(os.path.dirname(storage.path(nombre)), exist_ok=True)
+            with open(storage.path(nombre), 'wb') as f:
+                f.write(contenido)
+        Productos.objects.bulk_create([
+            Productos(nombre='A', precio=1, imagen1='productos/te.jpg'),
+            Productos(nombre='B', precio=1, imagen1='productos/te_7TC7I1l.jpg'),
+            # Los productos antiguos pueden guardar URLs o apuntar a archivos que ya no están
+            Productos(nombre='C', precio=1, imagen1='https://example.com/te.jpg', imagen2='productos/no-existe.jpg'),
+        ])
+
+        salida, errores = io.StringIO(), io.StringIO()
+        call_command('deduplicar_imagenes', stdout=salida, stderr=errores)
+        self.assertIn('2 archivos antiguos encolados para borrar; 2 omitidos', salida.getvalue())
+        self.assertIn('https://example.com/te.jpg', errores.getvalue())
+
+        nombres = set(Productos.objects.exclude(nombre='C').values_list('imagen1', flat=True))
+        self.assertEqual(len(nombres), 1)
+        self.assertTrue(storage.exists(nombres.pop()))
+        c = Productos.objects.get(nombre='C')
+        self.assertEqual((c.imagen1.name, c.imagen2.name), ('https://example.com/te.jpg', 'productos/no-existe.jpg'))
+        # Los archivos antiguos los borra el worker de la cola
+        self.assertTrue(storage.exists('productos/te.jpg'))
+        procesar_borrados(storage=storage)
+        self.assertFalse(storage.exists('productos/te.jpg'))
+        self.assertFalse(storage.exists('productos/te_7TC7I1l.jpg'))
+
+
+# El comando procesa en hilos, que no ven los datos de la transacción de un TestCase
+class GenerarVariantesTests(TransactionTestCase):
+    setUp = VariantesImagenTests.setUp
+    jpeg = VariantesImagenTests.jpeg
+
+    def test_generar_variantes_sigue_tras_un_producto_con_error(self):
+        storage = Productos._meta.get_field('imagen1').storage
+        buenas = [storage.save(f'productos/{nombre}', self.jpeg(nombre, 700, 700)) for nombre in ('a.jpg', 'b.png')]
+        Productos.objects.bulk_create([
+            Productos(nombre='A', precio=1, imagen1=buenas[0]),
+            Productos(nombre='B', precio=1, imagen1='productos/no-existe.jpg'),
+            Productos(nombre='C', precio=1, imagen1=buenas[1]),
+        ])
+        generar = imagenes.generar_variantes
+
+        def generar_o_fallar(storage, nombre):
+            # Con Spaces un archivo que falta es un ClientError, no un OSError
+            if nombre == 'productos/no-existe.jpg':
+                raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+            return generar(storage, nombre)
+
+        salida, errores = io.StringIO(), io.StringIO()
+        with mock.patch.object(imagenes, 'generar_variantes', generar_o_fallar), self.assertLogs(level='ERROR'):
+            call_command('generar_variantes', workers=2, stdout=salida, stderr=errores)
+        self.assertIn('2 imágenes procesadas en 3 productos', salida.getvalue())
+        self.assertIn('1 productos con errores', errores.getvalue())
+        self.assertEqual(
+            set(Productos.objects.exclude(imagenes_variantes={}).values_list('nombre', flat=True)), {'A', 'C'},
+        )
+
+
+class ColaBorradoTests(TestCase):
+    def test_no_borra_archivos_que_vuelven_a_usarse(self):
+        producto = Productos.objects.create(nombre='A', precio=1, imagen1='productos/a.jpg')
+        with self.assertNumQueries(2):  # UPDATE + INSERT en la cola; pre_save no relee el producto
+            producto.imagen1 = 'productos/b.jpg'
+            producto.save()
+        self.assertEqual(set(BorradoPendiente.objects.values_list('origen', flat=True)), {'productos/a.jpg'})
+
+        # Otro producto vuelve a usar la foto antes de que pase el worker
+        Productos.objects.create(nombre='B', precio=1, imagen1='productos/a.jpg')
+        resumen = procesar_borrados()
+        self.assertEqual(resumen['borrados'], 0)
+        self.assertEqual(resumen['descartados'], 1 + len(posibles_variantes('productos/a.jpg')))
+        self.assertFalse(BorradoPendiente.objects.exists())
+
+    def test_s3_borra_por_lotes_y_reintenta_los_errores(self):
+        storage = S3Boto3Storage(
+            bucket_name='velux-test', access_key='x', secret_key='x', region_name='us-east-1', location='media',
+        )
+        client = storage.connection.meta.client
+        nombres = [f'productos/{i}.jpg' for i in range(1500)]
+        BorradoPendiente.objects.bulk_create([BorradoPendiente(nombre=n) for n in nombres])
+
+        with Stubber(client) as stubber:
+            # Por orden de llegada a la cola; dentro del lote, ordenadas
+            lotes = sorted(nombres[:1000]), sorted(nombres[1000:])
+            stubber.add_response('delete_objects', {}, {
+                'Bucket': 'velux-test',
+                'Delete': {'Objects': [{'Key': f'media/{n}'} for n in lotes[0]], 'Quiet': True},
+            })
+            self.assertEqual(procesar_borrados(storage=storage)['borrados'], 1000)
+
+            stubber.add_response('delete_objects', {
+                'Errors': [{'Key': 'media/productos/1499.jpg', 'Code': 'SlowDown', 'Message': 'Reduce your request rate.'}],
+            }, {
+                'Bucket': 'velux-test',
+                'Delete': {'Objects': [{'Key': f'media/{n}'} for n in lotes[1]], 'Quiet': True},
+            })
+            resumen = procesar_borrados(storage=storage)
+            stubber.assert_no_pending_responses()
+
+        self.assertEqual((resumen['borrados'], resumen['fallidos']), (499, 1))
+        fallido = BorradoPendiente.objects.get()
+        self.assertEqual((fallido.nombre, fallido.intentos), ('productos/1499.jpg', 1))
+        self.assertIn('SlowDown', fallido.ultimo_error)
+        self.assertGreater(fallido.disponible_en, timezone.now())
+        # No vuelve a intentarse hasta que pase la espera
+        self.assertEqual(procesar_borrados(storage=storage)['fallidos'], 0)
+        self.assertEqual(borrar_archivos(storage, []), {})
+
+
+@mock.patch.dict(os.environ, {'DO_SPACES_KEY': 'x', 'DO_SPACES_SECRET': 'x', 'DO_SPACES_REGION': 'nyc3'})
+@mock.patch.object(views, 'DO_SPACES_NAME', 'velux-test')
+@mock.patch.object(storages_backends, '_cliente_s3', None)
+@override_settings(AWS_STORAGE_BUCKET_NAME='velux-test')
+class SubidasSpacesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='admin', password='x', is_staff=True))
+
+    def test_cliente_compartido_entre_hilos_y_storage(self):
+        with ThreadPoolExecutor(4) as executor:
+            clientes = set(map(id, executor.map(lambda _: storages_backends.get_s3_client(), range(8))))
+        self.assertEqual(clientes, {id(storages_backends.get_s3_client())})
+        self.assertIs(storages_backends.MediaStorage().connection.meta.client, storages_backends.get_s3_client())
+
+    def test_urls_por_lote_con_clave_por_contenido(self):
+        sha = 'AB' * 32
+        with Stubber(storages_backends.get_s3_client()) as stubber:
+            stubber.add_client_error('head_object', http_status_code=404)
+            # Ya subido: otra URL de PUT pisaría el objeto que comparten otros productos
+            stubber.add_response('head_object', {}, {'Bucket': 'velux-test', 'Key': f'productos/{"cd" * 32}.png'})
+            response = self.client.post('/api/get-presigned-urls/', {'archivos': [
+                {'nombre': 'Foto.JPG', 'sha256': sha, 'content_type': 'image/jpeg'},
+                {'nombre': 'otra.png', 'sha256': 'cd' * 32},
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        subidas = response.json()['subidas']
+        self.assertEqual([s['nombre'] for s in subidas], [f'productos/{sha.lower()}.jpg', f'productos/{"cd" * 32}.png'])
+        self.assertEqual(subidas[1], {'archivo': 'otra.png', 'nombre': subidas[1]['nombre'], 'existente': True})
+        # El contenido se comprobará contra el hash cuando llegue
+        self.assertEqual(list(VerificacionPendiente.objects.values_list('nombre', flat=True)), [subidas[0]['nombre']])
+        # La URL firmada apunta al objeto que el storage lee con ese nombre
+        firmada = urlsplit(subidas[0]['presigned_url'])
+        storage = storages_backends.MediaStorage()
+        self.assertEqual(urlsplit(storage.url(subidas[0]['nombre']))[:3], firmada[:3])
+        clave = firmada.path.lstrip('/').removeprefix('velux-test/')
+        with Stubber(storages_backends.get_s3_client()) as stubber:
+            stubber.add_response('head_object', {}, {'Bucket': 'velux-test', 'Key': clave})
+            self.assertTrue(storage.exists(subidas[0]['nombre']))
+
+        invalida = self.client.post('/api/get-presigned-urls/', {'archivos': [{'nombre': 'x.jpg', 'sha256': 'nope'}]}, format='json')
+        self.assertEqual(invalida.status_code, 400)
+        self.client.force_authenticate(get_user_model().objects.create_user(username='cliente', password='x'))
+        self.assertEqual(self.client.post('/api/get-presigned-urls/', {}, format='json').status_code, 403)
+        anonimo = APIClient().post('/api/get-presigned-urls/', {}, format='json')
+        self.assertEqual(anonimo.status_code, 401)
+        self.assertEqual(anonimo['WWW-Authenticate'], 'Bearer realm="api"')
+
+
+@mock.patch.object(subidas, 'TAMANO_PARTE', 4)
+class SubidaMultipartTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='admin', password='x', is_staff=True))
+        self.contenido = b'0123456789'
+        self.sha = hashlib.sha256(self.contenido).hexdigest()
+        for ajuste in ('MEDIA_ROOT', 'FILE_UPLOAD_TEMP_DIR'):
+            carpeta = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, carpeta, ignore_errors=True)
+            override = override_settings(**{ajuste: carpeta})
+            override.enable()
+            self.addCleanup(override.disable)
+
+    def iniciar(self):
+        response = self.client.post('/api/subidas/', {
+            'nombre': 'video.MP4', 'sha256': self.sha, 'tamano': len(self.contenido),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_local_escribe_las_partes_a_disco_y_las_ensambla(self):
+        subida = self.iniciar()
+        self.assertEqual(subida['nombre'], f'productos/{self.sha}.mp4')
+        self.assertEqual(len(subida['partes']), 3)
+
+        partes = []
+        for parte in subida['partes']:
+            inicio = (parte['numero'] - 1) * 4
+            response = self.client.put(
+                parte['url'], self.contenido[inicio:inicio + 4], content_type='application/octet-stream',
+            )
+            self.assertEqual(response.status_code, 200)
+            partes.append({'numero': parte['numero'], 'etag': response['ETag']})
+
+        datos = {'nombre': subida['nombre'], 'upload_id': subida['upload_id']}
+        incompleta = self.client.post('/api/subidas/completar/', {**datos, 'partes': partes[:2]}, format='json')
+        self.assertEqual(incompleta.status_code, 400)
+
+        response = self.client.post('/api/subidas/completar/', {**datos, 'partes': partes}, format='json')
+        self.assertEqual(response.json(), {'nombre': subida['nombre']})
+        with media_storage.open(subida['nombre']) as archivo:
+            self.assertEqual(archivo.read(), self.contenido)
+        # La carpeta temporal de la subida se borra al completar
+        self.assertEqual(self.client.post('/api/subidas/completar/', {**datos, 'partes': partes}, format='json').status_code, 400)
+
+    def test_local_rechaza_contenido_con_otro_hash(self):
+        subida = self.iniciar()
+        partes = []
+        for parte in subida['partes']:
+            response = self.client.put(parte['url'], b'xxxx', content_type='application/octet-stream')
+            partes.append({'numero': parte['numero'], 'etag': response['ETag']})
+        response = self.client.post('/api/subidas/completar/', {
+            'nombre': subida['nombre'], 'upload_id': subida['upload_id'], 'partes': partes,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(media_storage.exists(subida['nombre']))
+
+        self.assertEqual(self.client.post('/api/subidas/abortar/', {
+            'nombre': subida['nombre'], 'upload_id': subida['upload_id'],
+        }, format='json').status_code, 204)
+
+    @mock.patch.dict(os.environ, {'DO_SPACES_KEY': 'x', 'DO_SPACES_SECRET': 'x', 'DO_SPACES_REGION': 'nyc3'})
+    @mock.patch.object(storages_backends, '_cliente_s3', None)
+    @override_settings(USE_SPACES=True, AWS_STORAGE_BUCKET_NAME='velux-test')
+    def test_spaces_urls_por_parte_y_completar(self):
+        clave = f'productos/{self.sha}.mp4'
+        with Stubber(storages_backends.get_s3_client()) as stubber:
+            stubber.add_client_error('head_object', http_status_code=404)
+            stubber.add_response(
+                'create_multipart_upload', {'UploadId': 'abc'},
+                {'Bucket': 'velux-test', 'Key': clave, 'ACL': 'public-read', 'Metadata': {'tamano': '10'}},
+            )
+            subida = self.iniciar()
+            self.assertEqual(subida['upload_id'], 'abc')
+            self.assertIn('partNumber=3', subida['partes'][2]['url'])
+            self.assertIn('uploadId=abc', subida['partes'][2]['url'])
+
+            partes = [{'numero': n, 'etag': f'"e{n}"'} for n in (2, 1, 3)]
+            stubber.add_client_error('head_object', http_status_code=404)
+            stubber.add_response('complete_multipart_upload', {}, {
+                'Bucket': 'velux-test', 'Key': clave, 'UploadId': 'abc',
+                'MultipartUpload': {'Parts': [{'PartNumber': n, 'ETag': f'"e{n}"'} for n in (1, 2, 3)]},
+            })
+            stubber.add_response(
+                'head_object', {'ContentLength': 10, 'Metadata': {'tamano': '10'}}, {'Bucket': 'velux-test', 'Key': clave},
+            )
+            response = self.client.post('/api/subidas/completar/', {
+                'nombre': subida['nombre'], 'upload_id': 'abc', 'partes': partes,
+            }, format='json')
+            # El objeto completado es el que el storage lee con el nombre devuelto
+            stubber.add_response('head_object', {}, {'Bucket': 'velux-test', 'Key': clave})
+            self.assertTrue(storages_backends.MediaStorage().exists(response.json()['nombre']))
+            stubber.assert_no_pending_responses()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(VerificacionPendiente.objects.values_list('nombre', flat=True)), [clave])
+        # Con Spaces las partes no pasan por Django
+        self.assertEqual(self.client.put(f'/api/subidas/{uuid.uuid4().hex}/partes/1/', b'x', content_type='application/octet-stream').status_code, 404)
+
+    @mock.patch.dict(os.environ, {'DO_SPACES_KEY': 'x', 'DO_SPACES_SECRET': 'x', 'DO_SPACES_REGION': 'nyc3'})
+    @mock.patch.object(storages_backends, '_cliente_s3', None)
+    @override_settings(USE_SPACES=True, AWS_STORAGE_BUCKET_NAME='velux-test')
+    def test_spaces_no_pisa_archivos_ni_acepta_otro_tamano(self):
+        clave = f'productos/{self.sha}.mp4'
+        datos = {'nombre': clave, 'upload_id': 'abc', 'partes': [{'numero': 1, 'etag': '"e1"'}]}
+        with Stubber(storages_backends.get_s3_client()) as stubber:
+            # El archivo ya existe: no hay nada que subir
+            stubber.add_response('head_object', {}, {'Bucket': 'velux-test', 'Key': clave})
+            response = self.client.post('/api/subidas/', {
+                'nombre': 'video.MP4', 'sha256': self.sha, 'tamano': len(self.contenido),
+            }, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((response.json()['existente'], response.json()['partes']), (True, []))
+
+            # Otra subida del mismo contenido terminó antes: se aborta en vez de pisarla
+            stubber.add_response('head_object', {}, {'Bucket': 'velux-test', 'Key': clave})
+            stubber.add_response('abort_multipart_upload', {}, {'Bucket': 'velux-test', 'Key': clave, 'UploadId': 'abc'})
+            self.assertEqual(self.client.post('/api/subidas/completar/', datos, format='json').json(), {'nombre': clave})
+
+            # El tamaño real no es el declarado al iniciar: el objeto se borra
+            stubber.add_client_error('head_object', http_status_code=404)
+            stubber.add_response('complete_multipart_upload', {})
+            stubber.add_response('head_object', {'ContentLength': 9, 'Metadata': {'tamano': '10'}})
+            stubber.add_response('delete_object', {}, {'Bucket': 'velux-test', 'Key': clave})
+            self.assertEqual(self.client.post('/api/subidas/completar/', datos, format='json').status_code, 400)
+            stubber.assert_no_pending_responses()
+
+    def test_verificacion_borra_el_contenido_que_no_coincide_con_el_hash(self):
+        correcto = f'productos/{self.sha}.mp4'
+        falso = f'productos/{"0" * 64}.jpg'
+        for nombre in (correcto, falso):
+            os.makedirs(os.path.dirname(media_storage.path(nombre)), exist_ok=True)
+            with open(media_storage.path(nombre), 'wb') as f:
+                f.write(self.contenido)
+        subidas.encolar_verificacion([correcto, falso, f'productos/{"1" * 64}.png'])
+
+        self.assertEqual(subidas.procesar_verificaciones(), {'verificados': 2, 'pendientes': 1})
+        self.assertTrue(media_storage.exists(correcto))
+        self.assertFalse(media_storage.exists(falso))
+        # El PUT pre-firmado aún puede llegar: se vuelve a mirar más tarde
+        pendiente = VerificacionPendiente.objects.get()
+        self.assertEqual(pendiente.intentos, 1)
+        self.assertGreater(pendiente.disponible_en, timezone.now())
+
+
+class GoogleAuthTests(TestCase):
+    def setUp(self):
+        self.privadas = {kid: rsa.generate_private_key(public_exponent=65537, key_size=2048) for kid in ('k1', 'k2')}
+        self.publicadas = ['k1']
+        self.descargas = 0
+        self.ahora = 1000.0
+        self.verificador = google_auth.VerificadorGoogle('cliente-test', fuente=self.jwks, reloj=lambda: self.ahora)
+        parche = mock.patch.object(google_auth, '_verificador', self.verificador)
+        parche.start()
+        self.addCleanup(parche.stop)
+
+    def jwks(self):
+        # JWKS local en lugar de https://www.googleapis.com/oauth2/v3/certs
+        self.descargas += 1
+        claves = []
+        for kid in self.publicadas:
+            jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self.privadas[kid].public_key()))
+            claves.append({**jwk, 'kid': kid, 'alg': 'RS256', 'use': 'sig'})
+        return {'keys': claves}, 3600
+
+    def token(self, kid='k1', **claims):
+        ahora = int(time.time())
+        claims = {
+            'iss': 'https://accounts.google.com', 'aud': 'cliente-test', 'sub': '123', 'iat': ahora,
+            'exp': ahora + 3600, 'email': 'ana@example.com', 'email_verified': True, 'given_name': 'Ana', **claims,
+        }
+        return jwt.encode(claims, self.privadas[kid], algorithm='RS256', headers={'kid': kid})
+
+    def test_login_verifica_en_local_con_el_jwks_cacheado(self):
+        for _ in range(3):
+            response = APIClient().post('/api/auth/google/', {'id_token': self.token()}, format='json')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['first_name'], 'Ana')
+        self.assertEqual(self.descargas, 1)
+
+        # Caduca el max-age: se vuelve a descargar una vez
+        self.ahora += 3600
+        self.verificador.verificar(self.token())
+        self.assertEqual(self.descargas, 2)
+
+    def test_rechaza_tokens_invalidos_y_refresca_ante_claves_rotadas(self):
+        for token in (self.token(aud='otro-cliente'), self.token(iss='https://evil.example.com'),
+                      self.token(exp=int(time.time()) - 3600)):
+            with self.assertRaises(ValueError):
+                self.verificador.verificar(token)
+        response = APIClient().post('/api/auth/google/', {'id_token': self.token(aud='otro')}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # Google rota las claves: un kid desconocido provoca una descarga, pero no más de una por minuto
+        self.publicadas = ['k1', 'k2']
+        with self.assertRaises(ValueError):
+            self.verificador.verificar(self.token(kid='k2'))
+        self.ahora += google_auth.ESPERA_MINIMA_REFRESCO
+        self.assertEqual(self.verificador.verificar(self.token(kid='k2'))['sub'], '123')
+        self.assertEqual(self.descargas, 2)
+
+
+class UsernameTests(TestCase):
+    def test_siguiente_sufijo_en_una_consulta(self):
+        self.assertEqual(usuarios.siguiente_username('maria'), 'maria')
+        for nombre in ('maria', 'maria_1', 'maria_9', 'maria_10', 'maria_x', 'maria_07', 'mariana', 'Maria_50'):
+            get_user_model().objects.create_user(username=nombre, password='x')
+        with self.assertNumQueries(1):
+            self.assertEqual(usuarios.siguiente_username('maria'), 'maria_11')
+        self.assertEqual(usuarios.siguiente_username('mariana'), 'mariana_1')
+        self.assertEqual(usuarios.siguiente_username('m.ria'), 'm.ria')
+
+        response = APIClient().post('/api/register/', {
+            'email': 'maria@example.com', 'password': 'secreta123', 'password_confirm': 'secreta123',
+        }, format='json')
+        self.assertEqual(response.json()['user']['username'], 'maria_11')
+
+    def test_reintenta_si_un_alta_simultanea_se_adelanta(self):
+        get_user_model().objects.create_user(username='ana', password='x')
+        # La primera elección ya está ocupada, como si otro proceso la hubiera insertado antes
+        with mock.patch.object(usuarios, 'siguiente_username', side_effect=['ana', 'ana_1']):
+            user = usuarios.crear_usuario('ana', email='ana@example.com', password='x')
+        self.assertEqual(user.username, 'ana_1')
+
+
+class AutenticacionSinConsultaTests(TestCase):
+    def setUp(self):
+        autenticacion.invalidar_revocados()
+        self.user = get_user_model().objects.create_user(
+            username='lectora', email='lee@example.com', password='secreta123', first_name='Lea', is_staff=True,
+        )
+        tokens = APIClient().post('/api/token/', {'identifier': 'lectora', 'password': 'secreta123'}, format='json').json()
+        self.refresh = tokens['refresh']
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+
+    def test_usuario_desde_claims_sin_select(self):
+        self.client.get('/api/favoritos/')  # carga la lista de revocados
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get('/api/favoritos/').status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if 'veluxapp_customuser' in q['sql']])
+
+        token = autenticacion.JWTSinConsultaAuthentication().get_validated_token(
+            self.client._credentials['HTTP_AUTHORIZATION'].split()[1]
+        )
+        with self.assertNumQueries(0):
+            user = autenticacion.usuario_desde_token(token)
+            self.assertEqual((user.pk, user.username, user.first_name, user.is_staff), (self.user.pk, 'lectora', 'Lea', True))
+        # Un campo que el token no lleva se carga de la base de datos al leerlo
+        with self.assertNumQueries(1):
+            self.assertEqual(user.date_joined, self.user.date_joined)
+
+    def test_escrituras_cargan_el_usuario(self):
+        # El token dice is_staff, pero el usuario ya no lo es: las escrituras lo ven al momento
+        get_user_model().objects.filter(pk=self.user.pk).update(is_staff=False)
+        response = self.client.post('/api/productos/', {'nombre': 'X', 'precio': 1}, format='json')
+        self.assertEqual(response.status_code, 403)
+        get_user_model().objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.post('/api/pedidos/', {}, format='json').status_code, 401)
+        # Las lecturas siguen saliendo de los claims hasta que caduque el token
+        self.assertEqual(self.client.get('/api/pedidos/').status_code, 200)
+
+    def test_logout_revoca_los_access_tokens_con_retraso_acotado(self):
+        otro = APIClient()
+        otro.credentials(**self.client._credentials)
+        self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+
+        ahora = time.monotonic()
+        with mock.patch.object(autenticacion.time, 'monotonic', return_value=ahora):
+            # Logout desde otro proceso sin caché compartida: aquí no llega el aviso
+            token = OutstandingToken.objects.get(jti=RefreshToken(self.refresh)['jti'])
+            BlacklistedToken.objects.bulk_create([BlacklistedToken(token=token)])
+            self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+        with mock.patch.object(autenticacion.time, 'monotonic', return_value=ahora + settings.JWT_REVOCADOS_TTL):
+            self.assertEqual(self.client.get('/api/cart/').status_code, 401)
+        self.assertEqual(otro.get('/api/favoritos/').status_code, 401)
+
+    def test_logout_con_aviso_revoca_al_momento(self):
+        self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+        respuesta = self.client.post('/api/logout/', {'refresh_token': self.refresh}, format='json')
+        self.assertEqual(respuesta.status_code, 205)
+        self.assertEqual(self.client.get('/api/cart/').status_code, 401)
+
+    @mock.patch.object(autenticacion, 'cache_compartida', return_value=True)
+    def test_refresco_sin_consultar_la_lista_negra(self, _):
+        anonimo = APIClient()
+        anonimo.post('/api/token/refresh/', {'refresh': self.refresh}, format='json')  # carga el filtro
+        tokens = APIClient().post('/api/token/', {'identifier': 'lectora', 'password': 'secreta123'}, format='json').json()
+        with CaptureQueriesContext(connection) as ctx:
+            respuesta = anonimo.post('/api/token/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if 'token_blacklist' in q['sql']])
+
+        RefreshToken(tokens['refresh']).blacklist()
+        respuesta = anonimo.post('/api/token/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(respuesta.status_code, 401)
+
+    def test_refresco_sin_cache_compartida_consulta_la_lista_negra(self):
+        autenticacion.filtro_revocados()
+        self.assertTrue(CustomTokenRefreshSerializer(data={'refresh': self.refresh}).is_valid())
+        # Logout desde otro proceso: sin caché compartida el aviso no llega aquí
+        token = OutstandingToken.objects.get(jti=RefreshToken(self.refresh)['jti'])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=token)])
+        self.assertNotIn(token.jti, autenticacion.filtro_revocados())
+        with self.assertRaises(TokenError):
+            CustomTokenRefreshSerializer(data={'refresh': self.refresh}).is_valid()
+
+    def test_filtro_bloom_sin_falsos_negativos(self):
+        jtis = [uuid.uuid4().hex for _ in range(2000)]
+        filtro = autenticacion.FiltroBloom(jtis, tasa_fp=0.01)
+        self.assertTrue(all(jti in filtro for jti in jtis))
+        falsos = sum(uuid.uuid4().hex in filtro for _ in range(2000))
+        self.assertLess(falsos, 100)
+        self.assertLess(len(filtro.bits), 2000 * 2)
+
+
+class PodaTokensTests(TestCase):
+    def test_borra_solo_los_caducados_y_sus_revocaciones(self):
+        user = get_user_model().objects.create_user(username='poda', password='secreta123')
+        ahora = timezone.now()
+        margen = api_settings.ACCESS_TOKEN_LIFETIME
+        viejos = [
+            OutstandingToken.objects.create(
+                user=user, jti=uuid.uuid4().hex, token='x', expires_at=ahora - margen - timedelta(minutes=1),
+            )
+            for _ in range(5)
+        ]
+        # Caducado, pero aún puede tener access tokens vivos
+        reciente = OutstandingToken.objects.create(
+            user=user, jti=uuid.uuid4().hex, token='x', expires_at=ahora - margen + timedelta(minutes=1),
+        )
+        BlacklistedToken.objects.create(token=viejos[0])
+        BlacklistedToken.objects.create(token=reciente)
+
+        self.assertEqual(podar_tokens(dry_run=True)['outstanding'], 5)
+        self.assertEqual(OutstandingToken.objects.count(), 6)
+
+        resumen = podar_tokens(lote=2)
+        self.assertEqual((resumen['outstanding'], resumen['blacklisted'], resumen['lotes']), (5, 1, 3))
+        self.assertEqual(list(OutstandingToken.objects.all()), [reciente])
+        self.assertEqual(BlacklistedToken.objects.get().token, reciente)
+
+        salida = io.StringIO()
+        call_command('podar_tokens', stdout=salida)
+        self.assertIn('Borrados 0 tokens', salida.getvalue())
@@ -16,9 +16,11 @@ from .views import ( # Asegúrate de que todas tus vistas actuales estén import
     PedidoViewSet,
     ElementoPedidoViewSet,
     FavoriteViewSet,
-    create_product, get_presigned_url
+    create_product, get_presigned_url, get_presigned_urls,
+    iniciar_subida_multipart, completar_subida_multipart, abortar_subida_multipart, subir_parte_local,
 )
-from .views_cart import CartView
+from .views_cart import CartView, CartBatchView
+from .asincrono import listado_async
 
 router = DefaultRouter()
 router.register(r'categorias', CategoriaProductosViewSet)
@@ -33,13 +35,36 @@ router.register(r'pedidos', PedidoViewSet)
 router.register(r'elementos-pedido', ElementoPedidoViewSet)
 router.register(r'favoritos', FavoriteViewSet, basename='favoritos')
 
+# Listados públicos del catálogo: los GET anónimos se sirven con vistas async (ver
+# asincrono.py) y el resto de peticiones a la misma ruta sigue yendo al ViewSet.
+# Van antes del router para que sus rutas de listado no las tapen.
+listados_async = [
+    path(f'{prefijo}/', listado_async(viewset))
+    for prefijo, viewset in (
+        ('categorias', CategoriaProductosViewSet),
+        ('productos', ProductosViewSet),
+        ('packs', PackViewSet),
+        ('colaboradores', ColaboradoresViewSet),
+        ('informacion', InformacionViewSet),
+        ('equipo', EquipoViewSet),
+    )
+]
+
 urlpatterns = [
+    *listados_async,
     path('', include(router.urls)), # Todas tus rutas de API RESTful (sin prefijo 'api/' aquí)
     # path('auth/google/', GoogleAuthView.as_view(), name='google_auth'), # <--- ¡ELIMINA ESTA LÍNEA!
     # --- RUTAS DEL CARRITO ---
     path('cart/', CartView.as_view(), name='cart_detail'), # Rutas de carrito (sin prefijo 'api/' aquí)
+    path('cart/batch/', CartBatchView.as_view(), name='cart_batch'), # Varias operaciones en una transacción
     # --- RUTAS DE ARCHIVOS ---
     path('create-product/', create_product, name='create_product'), # Ruta para crear un producto
     path('get-presigned-url/', get_presigned_url, name='get-presigned-url'),
+    path('get-presigned-urls/', get_presigned_urls, name='get-presigned-urls'),
+    # Subidas multipart directas al storage (archivos grandes del panel)
+    path('subidas/', iniciar_subida_multipart, name='subida-iniciar'),
+    path('subidas/completar/', completar_subida_multipart, name='subida-completar'),
+    path('subidas/abortar/', abortar_subida_multipart, name='subida-abortar'),
+    path('subidas/<str:upload_id>/partes/<int:numero>/', subir_parte_local, name='subida-parte'),
     # Puedes agregar más rutas aquí según sea necesario
 ]
\ No newline at end of file
@@ -0,0 +1,61 @@
+# veluxapp/usuarios.py
+"""
+Asignación de nombres de usuario para el registro y el alta con Google.
+
+El nombre base (lo indicado por el usuario o la parte local del email) se usa tal
+cual si está libre; si no, se añade el sufijo _N siguiente al mayor existente. Se
+calcula en una sola consulta, y si dos altas simultáneas eligen el mismo nombre,
+la restricción UNIQUE decide y la que pierde lo vuelve a intentar.
+"""
+import logging
+import re
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.functions import Length
+
+logger = logging.getLogger(__name__)
+
+MAX_INTENTOS = 5
+
+
+def siguiente_username(base):
+    """
+    `base` si está libre o `base_N` con N = mayor sufijo existente + 1. Entre
+    base_9 y base_10 el más largo es el mayor, así que basta con ordenar por
+    longitud y después alfabéticamente y leer una fila.
+    """
+    User = get_user_model()
+    longitud = User._meta.get_field('username').max_length
+    base = base[:longitud]
+    ultimo = (
+        User.objects
+        .filter(Q(username=base) | Q(username__regex=rf'^{re.escape(base)}_[1-9][0-9]*$'))
+        .order_by(Length('username').desc(), '-username')
+        .values_list('username', flat=True)
+        .first()
+    )
+    if ultimo is None:
+        return base
+    sufijo = 1 if ultimo == base else int(ultimo.rsplit('_', 1)[1]) + 1
+    return f'{base[:longitud - len(str(sufijo)) - 1]}_{sufijo}'
+
+
+def crear_usuario(base, **campos):
+    """
+    Crea el usuario con el primer nombre libre a partir de `base`. No se comprueba
+    antes si existe: se inserta y, si otro alta se adelantó con el mismo nombre,
+    se calcula el siguiente y se reintenta.
+    """
+    User = get_user_model()
+    for intento in range(1, MAX_INTENTOS + 1):
+        username = siguiente_username(base)
+        try:
+            with transaction.atomic():
+                return User.objects.create_user(username=username, **campos)
+        except IntegrityError:
+            # Puede ser otra restricción (p. ej. google_id): entonces no se reintenta
+            if intento == MAX_INTENTOS or not User.objects.filter(username=username).exists():
+                raise
+            logger.info(f"Nombre de usuario {username} ocupado por un alta simultánea, reintentando")
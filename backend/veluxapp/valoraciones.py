@@ -0,0 +1,53 @@
+# veluxapp/valoraciones.py
+"""
+Valoración media y número de reviews de cada producto, guardadas en Productos
+(rating_avg, rating_count y rating_suma) para no tener que agregarlas en cada
+listado. Solo cuentan las reviews visibles (disponible=True).
+
+Las señales de Reviews aplican los cambios de forma incremental con un UPDATE
+atómico; `manage.py recalcular_valoraciones` las reconstruye desde cero.
+"""
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+from .cache import invalidar_modelo
+from .models import Productos, Reviews
+
+
+def aplicar_valoracion(producto_id, puntaje, signo):
+    """
+    Suma (signo=1) o resta (signo=-1) una review de `puntaje` a los agregados del
+    producto. En el UPDATE, F() se refiere a los valores anteriores, así que la
+    media se calcula con la suma y el recuento ya actualizados.
+    """
+    suma = F('rating_suma') + signo * puntaje
+    cuenta = F('rating_count') + signo
+    actualizados = Productos.objects.filter(pk=producto_id).update(
+        rating_suma=suma,
+        rating_count=cuenta,
+        rating_avg=Case(
+            When(rating_count=-signo, then=Value(0.0)),  # el recuento pasa a 0
+            default=Cast(suma, FloatField()) / cuenta,
+            output_field=FloatField(),
+        ),
+    )
+    if actualizados:
+        # update() no emite señales
+        invalidar_modelo(Productos)
+
+
+def recalcular_valoraciones():
+    """
+    Recalcula los agregados de todos los productos en un solo UPDATE con
+    subconsultas agregadas. Devuelve el número de productos actualizados.
+    """
+    visibles = Reviews.objects.filter(producto=OuterRef('pk'), disponible=True).order_by().values('producto')
+    suma = Subquery(visibles.annotate(total=Sum('puntaje')).values('total'), output_field=IntegerField())
+    cuenta = Subquery(visibles.annotate(total=Count('*')).values('total'), output_field=IntegerField())
+    actualizados = Productos.objects.update(
+        rating_suma=Coalesce(suma, 0),
+        rating_count=Coalesce(cuenta, 0),
+        rating_avg=Coalesce(Cast(suma, FloatField()) / Cast(cuenta, FloatField()), Value(0.0)),
+    )
+    invalidar_modelo(Productos)
+    return actualizados
@@ -1,15 +1,27 @@
 # veluxapp/views.py
+import io
+import logging
 import os
-import boto3
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAdminUser # <-- Importa esto
+from asgiref.sync import sync_to_async
 from django.db import transaction
+from django.http import HttpResponse
+from django.db.models import Count, Exists, IntegerField, OuterRef, Prefetch, Subquery, prefetch_related_objects
+from django.db.models.functions import Coalesce
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
 from .permissions import IsAdminUserOrReadOnly
-from .pagination import StandardResultsSetPagination
+from .pagination import StandardResultsSetPagination, CatalogoPagination
+from .cache import CatalogoCacheMixin
+from .search import ProductoSearchFilter
+from .pedidos import crear_pedido, crear_pedido_desde_carrito
+from .autenticacion import AUTENTICACION_SIN_CONSULTA
+from .asincrono import ejecutar_io, respuesta_json, vista_async
+from .subidas import SubidaError, SubidaLocal, encolar_verificacion, get_subidas, nombre_subida
+from backend.storages_backends import MediaStorage, clave_media, get_s3_client
 
 
 
@@ -38,21 +50,48 @@ from .serializers import (
     CorreosSerializer,
     EquipoSerializer,
     PedidoSerializer,
+    PedidoListSerializer,
+    FavoritosLoteSerializer,
     ElementoPedidoSerializer,
+    CrearPedidoSerializer,
+    SubidasLoteSerializer,
+    IniciarSubidaSerializer,
+    CompletarSubidaSerializer,
+    AbortarSubidaSerializer,
 )
 
+logger = logging.getLogger(__name__)
+
 # Asegúrate de que estas variables estén cargadas en el entorno
-DO_SPACES_KEY = os.environ.get('DO_SPACES_KEY')
-DO_SPACES_SECRET = os.environ.get('DO_SPACES_SECRET')
+# (las credenciales y la región las usa el cliente compartido, ver backend/storages_backends.py)
 DO_SPACES_NAME = os.environ.get('DO_SPACES_NAME')
-DO_SPACES_REGION = os.environ.get('DO_SPACES_REGION')
+
+
+def url_subida(clave, content_type=None):
+    """
+    URL pre-firmada para un PUT directo a Spaces. Firmar no hace ninguna petición:
+    con el cliente compartido cuesta microsegundos.
+    """
+    params = {
+        'Bucket': DO_SPACES_NAME,
+        'Key': clave,
+        'ACL': 'public-read' # Puedes cambiar esto si quieres que los archivos no sean públicos
+    }
+    if content_type:
+        # El cliente deberá enviar la misma cabecera Content-Type en el PUT
+        params['ContentType'] = content_type
+    # La URL expirará en 3600 segundos (1 hora)
+    return get_s3_client().generate_presigned_url(ClientMethod='put_object', Params=params, ExpiresIn=3600)
+
+
 # Puedes definir permisos globales o por vista.
 # is_authenticated_or_read_only permite GET a todos, y POST/PUT/DELETE solo a autenticados.
 # IsAdminUser permite solo a administradores.
 # IsAuthenticated solo a usuarios logueados.
-@api_view(['POST'])
-@permission_classes([IsAdminUser])
-def get_presigned_url(request):
+# Las vistas de archivos son async (ver asincrono.py): las llamadas a Spaces se
+# hacen en el pool de E/S externa y no ocupan el worker mientras esperan.
+@vista_async(['POST'], permisos=[IsAdminUser])
+async def get_presigned_url(request):
     """
     Endpoint para generar una URL pre-firmada para la subida directa a DigitalOcean Spaces.
     Recibe el nombre del archivo desde el frontend.
@@ -60,38 +99,130 @@ def get_presigned_url(request):
     """
     file_name = request.data.get('file_name')
     if not file_name:
-        return Response({'error': 'No se proporcionó el nombre del archivo'}, status=400)
-
-    # Configuración del cliente de S3
-    session = boto3.session.Session()
-    client = session.client(
-        's3',
-        region_name=DO_SPACES_REGION,
-        endpoint_url=f'https://{DO_SPACES_REGION}.digitaloceanspaces.com',
-        aws_access_key_id=DO_SPACES_KEY,
-        aws_secret_access_key=DO_SPACES_SECRET
-    )
+        return respuesta_json({'error': 'No se proporcionó el nombre del archivo'}, status=400)
 
     try:
         # Genera la URL pre-firmada para una operación PUT (subir)
-        # La URL expirará en 3600 segundos (1 hora)
-        presigned_url = client.generate_presigned_url(
-            ClientMethod='put_object',
-            Params={
-                'Bucket': DO_SPACES_NAME,
-                'Key': f'media/{file_name}', # Define la ruta donde se guardará en tu Space
-                'ACL': 'public-read' # Puedes cambiar esto si quieres que los archivos no sean públicos
-            },
-            ExpiresIn=3600
-        )
-        return Response({'presigned_url': presigned_url})
+        presigned_url = await ejecutar_io(url_subida, f'media/{file_name}') # Define la ruta donde se guardará en tu Space
+        return respuesta_json({'presigned_url': presigned_url})
     except Exception as e:
         # Log el error completo para debugging interno
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"Error generando URL pre-firmada: {str(e)}")
         # Devuelve un mensaje genérico al cliente
-        return Response({'error': 'Error al generar la URL de subida. Por favor, intenta de nuevo.'}, status=500)
+        return respuesta_json({'error': 'Error al generar la URL de subida. Por favor, intenta de nuevo.'}, status=500)
+
+
+@vista_async(['POST'], permisos=[IsAdminUser])
+async def get_presigned_urls(request):
+    """
+    Versión por lotes de get_presigned_url: una URL de subida por archivo en una sola
+    petición. La clave sale del SHA-256 del contenido (productos/<sha256>.<ext>), así
+    que dos archivos distintos nunca se pisan y la misma foto siempre va al mismo objeto.
+    `nombre` es el valor que hay que guardar en imagen1/2/3. Si el archivo ya está
+    subido se devuelve `existente` en vez de URL. El contenido se comprueba después
+    contra el hash (verificar_subidas).
+    REQUIERE: Usuario administrador autenticado.
+    """
+    serializer = SubidasLoteSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+
+    def firmar():
+        storage = MediaStorage()
+        subidas = []
+        for archivo in serializer.validated_data['archivos']:
+            nombre = nombre_subida(archivo['nombre'], archivo['sha256'])
+            subida = {'archivo': archivo['nombre'], 'nombre': nombre}
+            if storage.exists(nombre):
+                # Un PUT pisaría el objeto que ya comparten otros productos
+                subida['existente'] = True
+            else:
+                subida['presigned_url'] = url_subida(clave_media(nombre), archivo.get('content_type'))
+            subidas.append(subida)
+        return subidas
+
+    try:
+        subidas = await ejecutar_io(firmar)
+    except Exception as e:
+        logger.error(f"Error generando URLs pre-firmadas: {str(e)}")
+        return respuesta_json({'error': 'Error al generar las URLs de subida. Por favor, intenta de nuevo.'}, status=500)
+    await sync_to_async(encolar_verificacion)([s['nombre'] for s in subidas if 'presigned_url' in s])
+    return respuesta_json({'subidas': subidas})
+
+
+@vista_async(['POST'], permisos=[IsAdminUser])
+async def iniciar_subida_multipart(request):
+    """
+    Inicia una subida multipart para archivos grandes: devuelve upload_id, el nombre
+    final (productos/<sha256>.<ext>), el tamaño de parte y una URL por parte. El
+    archivo va directo al storage; Django no recibe sus bytes (ver subidas.py).
+    Cada respuesta a un PUT de parte trae una cabecera ETag que hay que enviar
+    al completar. Si el archivo ya existe responde 200 con `existente` y sin partes.
+    REQUIERE: Usuario administrador autenticado.
+    """
+    serializer = IniciarSubidaSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    datos = serializer.validated_data
+    subida = await ejecutar_io(
+        lambda: get_subidas().iniciar(
+            nombre_subida(datos['nombre'], datos['sha256']),
+            datos['tamano'],
+            content_type=datos.get('content_type'),
+            request=request,
+        )
+    )
+    return respuesta_json(subida, status=status.HTTP_200_OK if subida.get('existente') else status.HTTP_201_CREATED)
+
+
+@vista_async(['POST'], permisos=[IsAdminUser])
+async def completar_subida_multipart(request):
+    """
+    Completa una subida multipart con la lista de partes {numero, etag}.
+    REQUIERE: Usuario administrador autenticado.
+    """
+    serializer = CompletarSubidaSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    datos = serializer.validated_data
+    subidas = get_subidas()
+    try:
+        nombre = await ejecutar_io(subidas.completar, datos['nombre'], datos['upload_id'], datos['partes'])
+    except SubidaError as e:
+        return respuesta_json({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if subidas.requiere_verificacion:
+        await sync_to_async(encolar_verificacion)([nombre])
+    return respuesta_json({'nombre': nombre})
+
+
+@vista_async(['POST'], permisos=[IsAdminUser])
+async def abortar_subida_multipart(request):
+    """
+    Cancela una subida multipart y libera las partes ya subidas.
+    REQUIERE: Usuario administrador autenticado.
+    """
+    serializer = AbortarSubidaSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    datos = serializer.validated_data
+    await ejecutar_io(lambda: get_subidas().abortar(datos['nombre'], datos['upload_id']))
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(['PUT'])
+@permission_classes([IsAdminUser])
+def subir_parte_local(request, upload_id, numero):
+    """
+    Destino de las URLs de parte en desarrollo (FileSystemStorage): escribe el cuerpo
+    a disco por bloques, sin cargarlo en memoria. Con Spaces las partes van directas
+    a S3 y esta ruta no existe.
+    """
+    subidas = get_subidas()
+    if not isinstance(subidas, SubidaLocal):
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    try:
+        etag = subidas.guardar_parte(upload_id, numero, request.stream or io.BytesIO())
+    except SubidaError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    response = Response(status=status.HTTP_200_OK)
+    response['ETag'] = f'"{etag}"'
+    return response
 
 
 
@@ -143,42 +274,67 @@ def create_product(request):
         return Response({'error': 'Error al crear el producto. Por favor, verifica los datos e intenta de nuevo.'}, status=500)
     
     
-class CategoriaProductosViewSet(viewsets.ModelViewSet):
+class CategoriaProductosViewSet(CatalogoCacheMixin, viewsets.ModelViewSet):
     queryset = Categoria_Productos.objects.all()
     serializer_class = CategoriaProductosSerializer
+    cache_models = (Categoria_Productos,)
     # Solo los superadministradores pueden crear, actualizar o borrar productos
     permission_classes = [IsAdminUserOrReadOnly]
 
 
-class ProductosViewSet(viewsets.ModelViewSet):
-    queryset = Productos.objects.all()
+class ProductosViewSet(CatalogoCacheMixin, viewsets.ModelViewSet):
+    # Las categorías se cargan en una sola consulta para toda la página
+    queryset = Productos.objects.prefetch_related('categoria')
     serializer_class = ProductosSerializer
+    cache_models = (Productos, Categoria_Productos)
+    authentication_classes = AUTENTICACION_SIN_CONSULTA
         # Solo los superadministradores pueden crear, actualizar o borrar categorías
     permission_classes = [IsAdminUserOrReadOnly]
-    pagination_class = StandardResultsSetPagination
+    # Página por número por defecto; modo cursor opcional para scroll infinito
+    pagination_class = CatalogoPagination
  # --- Configuraciones de Filtrado para Productos ---
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    # La búsqueda va después del orden para poder ordenar por relevancia (ver search.py)
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, ProductoSearchFilter]
     # Permite filtrar por id, nombre, precio, stock, oferta, disponible, categorías y productos coreanos
     filterset_fields = ['id', 'nombre', 'precio', 'stock', 'oferta', 'disponible', 'categoria', 'linea', 'es_producto_coreano']
     search_fields = ['nombre', 'descripcion', 'lista_caracteristicas'] # Búsqueda por nombre y descripción.
-    ordering_fields = ['nombre', 'precio', 'stock', 'fecha_subida'] # Permite ordenar por estos campos
+    ordering_fields = ['nombre', 'precio', 'stock', 'fecha_subida', 'rating_avg', 'rating_count'] # Permite ordenar por estos campos
     ordering = ['-fecha_subida']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.user.is_authenticated:
+            # Una subconsulta EXISTS por fila (índice único user+product) en la misma consulta.
+            # Las respuestas de usuarios autenticados no se cachean (ver cache.py).
+            queryset = queryset.annotate(is_favorite=Exists(
+                Favorite.objects.filter(user=self.request.user, product=OuterRef('pk'))
+            ))
+        return queryset
+
+    def get_cache_vary(self, request):
+        # El modo de paginación también puede elegirse por cabecera
+        return [request.headers.get(CatalogoPagination.mode_header, '')]
     
-class PackViewSet(viewsets.ModelViewSet):
+class PackViewSet(CatalogoCacheMixin, viewsets.ModelViewSet):
     queryset = Pack.objects.all()
     serializer_class = PackSerializer
+    cache_models = (Pack,)
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
 
 class ReviewsViewSet(viewsets.ModelViewSet):
-    queryset = Reviews.objects.all()
+    queryset = Reviews.objects.select_related('usuario')
     serializer_class = ReviewsSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly] # Permite GET a todos, POST/PUT/DELETE a autenticados
+    # Modo cursor (?paginacion=cursor) para el scroll de reviews en la ficha de producto,
+    # apoyado en el índice (producto, fecha, id)
+    pagination_class = CatalogoPagination
 
 # --- Configuraciones de Filtrado para Reviews ---
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['usuario', 'puntaje', 'producto', 'disponible'] # Filtra por usuario, puntaje, producto, etc.
-    ordering_fields = ['fecha_creacion', 'puntaje'] # Ordena por fecha de creación o puntaje
+    ordering_fields = ['fecha', 'puntaje'] # Ordena por fecha de publicación o puntaje
+    ordering = ['-fecha', '-id']
 
 
     def perform_create(self, serializer):
@@ -188,19 +344,21 @@ class ReviewsViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         # Solo mostrar reviews disponibles a usuarios no autenticados
         if self.request.user.is_authenticated:
-            return Reviews.objects.all()
-        return Reviews.objects.filter(disponible=True)
+            return self.queryset.all()
+        return self.queryset.filter(disponible=True)
 
 
-class ColaboradoresViewSet(viewsets.ModelViewSet):
+class ColaboradoresViewSet(CatalogoCacheMixin, viewsets.ModelViewSet):
     queryset = Colaboradores.objects.all()
     serializer_class = ColaboradoresSerializer
+    cache_models = (Colaboradores,)
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
 
-class InformacionViewSet(viewsets.ModelViewSet):
+class InformacionViewSet(CatalogoCacheMixin, viewsets.ModelViewSet):
     queryset = Informacion.objects.all()
     serializer_class = InformacionSerializer
+    cache_models = (Informacion,)
     # Usualmente, la información de contacto solo necesita ser leída o actualizada por admins
     permission_classes = [permissions.IsAuthenticatedOrReadOnly] 
 
@@ -223,9 +381,10 @@ class CorreosViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class EquipoViewSet(viewsets.ModelViewSet):
+class EquipoViewSet(CatalogoCacheMixin, viewsets.ModelViewSet):
     queryset = Equipo.objects.all()
     serializer_class = EquipoSerializer
+    cache_models = (Equipo,)
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
 
@@ -233,12 +392,36 @@ class PedidoViewSet(viewsets.ModelViewSet):
     queryset = Pedido.objects.all()
     serializer_class = PedidoSerializer
     permission_classes = [permissions.IsAuthenticated] # Solo usuarios autenticados pueden ver/crear pedidos
+    authentication_classes = AUTENTICACION_SIN_CONSULTA
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['fecha', 'precio_total']
+    ordering = ['-fecha', '-id']
 
     def get_queryset(self):
         # Los usuarios solo pueden ver sus propios pedidos, a menos que sean administradores
-        if self.request.user.is_staff:
-            return Pedido.objects.all()
-        return Pedido.objects.filter(comprador=self.request.user)
+        queryset = Pedido.objects.all()
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(comprador=self.request.user)
+
+        if self.action == 'list':
+            # Subconsulta correlacionada: solo se evalúa para las filas de la página,
+            # a diferencia de un Count() con GROUP BY sobre toda la tabla.
+            num_elementos = (
+                ElementoPedido.objects.filter(pedido=OuterRef('pk'))
+                .order_by().values('pedido').annotate(total=Count('*')).values('total')
+            )
+            # Sin elementos la subconsulta no devuelve fila (NULL): un pedido vacío tiene 0
+            return queryset.annotate(num_elementos=Coalesce(Subquery(num_elementos, output_field=IntegerField()), 0))
+
+        return queryset.select_related('comprador').prefetch_related(
+            'productos',
+            Prefetch('elementos', queryset=ElementoPedido.objects.select_related('producto')),
+        )
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return PedidoListSerializer
+        return super().get_serializer_class()
 
     def perform_create(self, serializer):
         # Asigna automáticamente el usuario logueado como comprador
@@ -261,41 +444,34 @@ class PedidoViewSet(viewsets.ModelViewSet):
             return Response({"error": "No se proporcionaron productos para el pedido."}, 
                             status=status.HTTP_400_BAD_REQUEST)
 
-        with transaction.atomic():
-            # 1. Crear el pedido principal
-            pedido = Pedido.objects.create(comprador=request.user)
-            total_price = 0
-            
-            # 2. Iterar sobre los productos y crear ElementoPedido
-            for item_data in productos_data:
-                product_id = item_data.get('producto_id')
-                quantity = item_data.get('cantidad')
-
-                if not product_id or not quantity:
-                    raise serializers.ValidationError("Cada producto debe tener 'producto_id' y 'cantidad'.")
-
-                try:
-                    producto = Productos.objects.get(id=product_id)
-                except Productos.DoesNotExist:
-                    raise serializers.ValidationError(f"Producto con ID {product_id} no encontrado.")
-
-                # Determinar el precio unitario (precio normal o de oferta)
-                precio_unitario = producto.precio_rebaja if producto.oferta else producto.precio
-                
-                ElementoPedido.objects.create(
-                    pedido=pedido,
-                    producto=producto,
-                    cantidad=quantity,
-                    precio_unitario=precio_unitario
-                )
-                total_price += precio_unitario * quantity
-            
-            # 3. Actualizar el precio total del pedido
-            pedido.precio_total = total_price
-            pedido.save()
-            
-            serializer = self.get_serializer(pedido)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        entrada = CrearPedidoSerializer(data=request.data)
+        entrada.is_valid(raise_exception=True)
+        pedido = crear_pedido(request.user, entrada.validated_data['productos'])
+        return self.respuesta_pedido(pedido, status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='checkout')
+    def checkout(self, request):
+        """
+        Convierte el carrito del usuario en un pedido y lo vacía.
+        Requiere la cabecera Idempotency-Key (p. ej. un UUID generado por el
+        frontend al pulsar "Pagar"): si la petición se reintenta con la misma
+        clave se devuelve el pedido ya creado (200) en lugar de crear otro (201).
+        """
+        clave = request.headers.get('Idempotency-Key', '').strip()
+        if not clave or len(clave) > 64:
+            return Response({"detail": "Se requiere la cabecera 'Idempotency-Key' (máximo 64 caracteres)."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        pedido, creado = crear_pedido_desde_carrito(request.user, clave)
+        return self.respuesta_pedido(pedido, status.HTTP_201_CREATED if creado else status.HTTP_200_OK)
+
+    def respuesta_pedido(self, pedido, codigo):
+        # Una consulta para los elementos con su producto, en vez de una por línea al serializar
+        prefetch_related_objects(
+            [pedido], Prefetch('elementos', queryset=ElementoPedido.objects.select_related('producto')),
+        )
+        serializer = self.get_serializer(pedido)
+        return Response(serializer.data, status=codigo)
 
     @action(detail=True, methods=['get'], url_path='elementos')
     def get_order_elements(self, request, pk=None):
@@ -307,7 +483,7 @@ class PedidoViewSet(viewsets.ModelViewSet):
         except Pedido.DoesNotExist:
             return Response({"detail": "Pedido no encontrado."}, status=status.HTTP_404_NOT_FOUND)
         
-        elements = pedido.elementos.all()
+        elements = pedido.elementos.all() # Precargados con su producto en get_queryset
         serializer = ElementoPedidoSerializer(elements, many=True)
         return Response(serializer.data)
 
@@ -321,6 +497,7 @@ class ElementoPedidoViewSet(viewsets.ModelViewSet):
 class FavoriteViewSet(viewsets.ModelViewSet):
     serializer_class = FavoriteSerializer
     permission_classes = [permissions.IsAuthenticated]
+    authentication_classes = AUTENTICACION_SIN_CONSULTA
 
     def get_queryset(self):
         return Favorite.objects.filter(user=self.request.user)
@@ -332,4 +509,30 @@ class FavoriteViewSet(viewsets.ModelViewSet):
         if not created:
             fav.delete()
             return Response({'detail': 'removed'}, status=status.HTTP_200_OK)
-        return Response({'detail': 'added'}, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        return Response({'detail': 'added'}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='lote')
+    def lote(self, request):
+        """
+        Añade y quita varios favoritos a la vez:
+        {"agregar": [1, 2, 3], "quitar": [7]}
+        Los ids de productos inexistentes se ignoran. Devuelve los ids de `agregar`
+        aceptados (los productos que existen, ya fueran favoritos o no) y los de
+        `quitar`; no es la lista completa de favoritos del usuario.
+        """
+        serializer = FavoritosLoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        agregar = set(serializer.validated_data['agregar'])
+        quitar = set(serializer.validated_data['quitar'])
+
+        with transaction.atomic():
+            if quitar:
+                Favorite.objects.filter(user=request.user, product_id__in=quitar).delete()
+            if agregar:
+                agregar = set(Productos.objects.filter(id__in=agregar).values_list('id', flat=True))
+                Favorite.objects.bulk_create(
+                    [Favorite(user=request.user, product_id=product_id) for product_id in agregar],
+                    ignore_conflicts=True,  # los que ya eran favoritos
+                )
+
+        return Response({'favoritos': sorted(agregar), 'quitados': sorted(quitar)}, status=status.HTTP_200_OK)
\ No newline at end of file
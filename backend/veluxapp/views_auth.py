@@ -1,6 +1,8 @@
 # veluxapp/views_auth.py
 
+import logging
 import os
+from asgiref.sync import sync_to_async
 # ¡IMPORTANTE CAMBIO AQUÍ! Importa config de 'decouple', NO de 'dj_database_url'
 from decouple import config
 from django.conf import settings
@@ -9,12 +11,15 @@ from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
 from rest_framework_simplejwt.tokens import RefreshToken
-from .serializers import UserSerializer, GoogleAuthSerializer, RegisterSerializer
+from .serializers import UserSerializer, GoogleAuthSerializer, RegisterSerializer, CustomTokenObtainPairSerializer
+from .asincrono import ejecutar_io, respuesta_json, vista_async
+from .autenticacion import RefreshTokenFiltrado
+from .google_auth import get_verificador
+from .usuarios import crear_usuario
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 
 # --- Vistas de Autenticación Existentes ---
@@ -27,7 +32,7 @@ class RegisterView(generics.CreateAPIView):
         s = self.get_serializer(data=request.data)
         s.is_valid(raise_exception=True)
         user = s.save()
-        refresh = RefreshToken.for_user(user)
+        refresh = CustomTokenObtainPairSerializer.get_token(user)
         return Response({
             "user": UserSerializer(user).data,
             "refresh": str(refresh),
@@ -53,115 +58,82 @@ class LogoutView(APIView):
     def post(self, request):
         try:
             refresh_token = request.data["refresh_token"]
-            token = RefreshToken(refresh_token)
+            # Comprueba la lista negra con el filtro de Bloom (ver autenticacion.py)
+            token = RefreshTokenFiltrado(refresh_token)
             token.blacklist()
             return Response(status=status.HTTP_205_RESET_CONTENT)
         except Exception as e:
             return Response(status=status.HTTP_400_BAD_REQUEST, data={"detail": str(e)})
 
 
-# --- ÚNICA Y CORRECTA DEFINICIÓN DE GoogleAuthView ---
-class GoogleAuthView(APIView):
-    permission_classes = [AllowAny]
-
-    def post(self, request):
-        serializer = GoogleAuthSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        id_token_from_frontend = serializer.validated_data.get('id_token')
+# --- ÚNICA Y CORRECTA DEFINICIÓN DE google_auth ---
+# Vista async (ver asincrono.py): mientras se descarga el JWKS de Google o se
+# consulta la base de datos, el worker atiende otras peticiones.
+@vista_async(['POST'], autenticacion=(), permisos=[AllowAny])
+async def google_auth(request):
+    serializer = GoogleAuthSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    id_token_from_frontend = serializer.validated_data.get('id_token')
+
+    try:
+        # Firma, audiencia y emisor se comprueban en local con el JWKS cacheado (ver google_auth.py);
+        # si hay que descargarlo, la descarga va al pool de E/S externa
+        id_info = await ejecutar_io(get_verificador().verificar, id_token_from_frontend)
+        if not id_info.get('email_verified'):
+            raise ValueError('Email no verificado por Google.')
+
+        email = id_info.get('email')
+        google_user_id = id_info.get('sub')
+        first_name = id_info.get('given_name', '')
+        last_name = id_info.get('family_name', '')
+        profile_picture = id_info.get('picture', '')
 
         try:
-            # Aquí se usa config() de decouple, que es el que lee de .env
-            google_client_id = config('GOOGLE_CLIENT_ID')
-            
-            # Puedes quitar esta validación explícita si confías en decouple,
-            # ya que config() lanza un error si la variable no existe y no tiene default.
-            # Sin embargo, para más robustez en la vista, está bien mantenerla.
-            if not google_client_id:
-                raise ValueError("GOOGLE_CLIENT_ID no configurado en las variables de entorno.")
-
-            id_info = id_token.verify_oauth2_token(
-                id_token_from_frontend,
-                google_requests.Request(),
-                google_client_id
-            )
-
-            if id_info['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
-                raise ValueError('Token incorrecto (issuer).')
-            if not id_info.get('email_verified'):
-                raise ValueError('Email no verificado por Google.')
-
-            email = id_info.get('email')
-            google_user_id = id_info.get('sub')
-            first_name = id_info.get('given_name', '')
-            last_name = id_info.get('family_name', '')
-            profile_picture = id_info.get('picture', '')
-            
-            user = None
+            user = await User.objects.aget(email=email)
+
+            # Solo se completan los datos que falten; sin cambios no hay UPDATE
+            cambios = []
+            for campo, valor in (('first_name', first_name), ('last_name', last_name),
+                                 ('profile_picture', profile_picture), ('google_id', google_user_id)):
+                if not getattr(user, campo) and valor:
+                    setattr(user, campo, valor)
+                    cambios.append(campo)
+            if cambios:
+                await user.asave(update_fields=cambios)
+
+        except User.DoesNotExist:
+            base_username = email.split('@')[0]
 
             try:
-                user = User.objects.get(email=email)
-
-                if not user.first_name and first_name: user.first_name = first_name
-                if not user.last_name and last_name: user.last_name = last_name
-                if not user.profile_picture and profile_picture:
-                    user.profile_picture = profile_picture
-                if not user.google_id and google_user_id:
-                    user.google_id = google_user_id
-
-                user.save()
-
-            except User.DoesNotExist:
-                base_username = email.split('@')[0]
-                username = base_username
-                username_suffix = 1
-                while User.objects.filter(username=username).exists():
-                    username = f"{base_username}_{username_suffix}"
-                    username_suffix += 1
-
-                try:
-                    user = User.objects.create_user(
-                        username=username,
-                        email=email,
-                        first_name=first_name,
-                        last_name=last_name,
-                        google_id=google_user_id,
-                        profile_picture=profile_picture,
-                        password='!' # Contraseña dummy para usuarios de Google
-                    )
-                    user.is_active = True
-                    user.save()
-
-                except Exception as e:
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.error(f"Falló la creación del usuario: {e}")
-                    raise
-
-            if user is None:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.critical("La variable 'user' es None. Revisar la lógica de creación/recuperación del usuario.")
-                return Response(
-                    {"error": "No se pudo recuperar o crear el usuario."},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                # Primer nombre libre a partir del email; reintenta si otro alta se adelanta
+                # (usa transacciones, que no tienen versión async)
+                user = await sync_to_async(crear_usuario)(
+                    base_username,
+                    email=email,
+                    first_name=first_name,
+                    last_name=last_name,
+                    google_id=google_user_id,
+                    profile_picture=profile_picture,
+                    password='!' # Contraseña dummy para usuarios de Google
                 )
 
-            refresh = RefreshToken.for_user(user)
-            user_data = UserSerializer(user).data
+            except Exception as e:
+                logger.error(f"Falló la creación del usuario: {e}")
+                raise
 
-            return Response({
-                "user": user_data,
-                "refresh": str(refresh),
-                "access": str(refresh.access_token),
-            }, status=status.HTTP_200_OK)
+        # Registra el refresh token en token_blacklist (INSERT)
+        refresh = await sync_to_async(CustomTokenObtainPairSerializer.get_token)(user)
+        user_data = UserSerializer(user).data
 
-        except ValueError as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error de verificación de Google: {e}")
-            return Response({"error": "Error de autenticación de Google. Por favor, intenta de nuevo."}, status=status.HTTP_400_BAD_REQUEST)
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error inesperado en GoogleAuthView: {e}")
-            return Response({"error": "Error en el servidor. Por favor, intenta de nuevo más tarde."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        return respuesta_json({
+            "user": user_data,
+            "refresh": str(refresh),
+            "access": str(refresh.access_token),
+        }, status=status.HTTP_200_OK)
+
+    except ValueError as e:
+        logger.error(f"Error de verificación de Google: {e}")
+        return respuesta_json({"error": "Error de autenticación de Google. Por favor, intenta de nuevo."}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Error inesperado en google_auth: {e}")
+        return respuesta_json({"error": "Error en el servidor. Por favor, intenta de nuevo más tarde."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -3,30 +3,150 @@ from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from .autenticacion import JWTSinConsultaAuthentication
 
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from django.db.models import F
+from django.db.models import F, OuterRef, Prefetch, Subquery, prefetch_related_objects
 
 from .models import Cart, CartItem, Productos
-from .serializers import CartSerializer, AddToCartSerializer, UpdateCartItemSerializer
+from .serializers import CartSerializer, AddToCartSerializer, UpdateCartItemSerializer, CartBatchSerializer
 
 import uuid # Para generar UUIDs para session_key
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def precargar_items(cart):
+    """
+    Carga los ítems del carrito junto con sus productos en una sola consulta.
+    Con esto CartSerializer (items, total_items, total_price) no lanza más consultas.
+    Descarta una precarga anterior, así que sirve también tras modificar el carrito.
+    """
+    getattr(cart, '_prefetched_objects_cache', {}).pop('items', None)
+    prefetch_related_objects(
+        [cart],
+        Prefetch('items', queryset=CartItem.objects.select_related('product').order_by('id')),
+    )
+    return cart
+
+
+def fusionar_carrito_invitado(user_cart, session_key):
+    """
+    Fusiona el carrito de invitado `session_key` en `user_cart` con un número
+    constante de consultas, sea cual sea el tamaño del carrito:
+    1. Un UPDATE suma las cantidades de los productos que ya están en ambos carritos.
+    2. Un UPDATE mueve el resto de ítems del invitado al carrito del usuario.
+    3. Se borra el carrito de invitado (y con él los ítems ya sumados).
+    El carrito de invitado se bloquea con select_for_update: si llegan a la vez
+    varias peticiones con la misma clave, solo la primera lo encuentra.
+
+    No se usa ON CONFLICT DO UPDATE porque el ORM solo permite asignar el valor
+    nuevo (EXCLUDED), no sumarlo al existente; el UPDATE correlacionado hace lo
+    mismo en una sola sentencia y funciona igual en SQLite y PostgreSQL.
+    """
+    with transaction.atomic():
+        guest_cart = (
+            Cart.objects.select_for_update()
+            .filter(session_key=session_key, user__isnull=True)
+            .exclude(pk=user_cart.pk)
+            .only('id')
+            .first()
+        )
+        if guest_cart is None:
+            # No hay carrito de invitado con esa session_key, no hay nada que fusionar.
+            return False
+
+        ahora = timezone.now()
+        guest_items = CartItem.objects.filter(cart=guest_cart)
+        cantidad_invitado = guest_items.filter(product_id=OuterRef('product_id')).values('quantity')[:1]
+
+        # 1. Productos en ambos carritos: sumar cantidades
+        CartItem.objects.filter(
+            cart=user_cart, product_id__in=guest_items.values('product_id'),
+        ).update(quantity=F('quantity') + Subquery(cantidad_invitado), updated_at=ahora)
+
+        # 2. Productos solo en el carrito de invitado: moverlos
+        guest_items.exclude(
+            product_id__in=CartItem.objects.filter(cart=user_cart).values('product_id'),
+        ).update(cart=user_cart, updated_at=ahora)
+
+        # 3. Eliminar el carrito de invitado después de fusionar sus ítems
+        Cart.objects.filter(pk=guest_cart.pk).delete()
+
+    logger.info("Carrito de invitado fusionado y eliminado.")
+    return True
+
+
+def marcar_actividad(cart):
+    """
+    Actualiza `updated_at` del carrito. Los cambios en los ítems no tocan el
+    carrito, y `limpiar_carritos` usa este campo para saber si sigue en uso.
+    Dentro de una transacción, el UPDATE además bloquea la fila del carrito.
+    Devuelve False si el carrito ya no existe (lo borró `limpiar_carritos`).
+    """
+    cart.updated_at = timezone.now()
+    return Cart.objects.filter(pk=cart.pk).update(updated_at=cart.updated_at) > 0
+
+
+def respuesta_carrito(request, cart, session_key=None):
+    """
+    Serializa el carrito (2 consultas como máximo contando la del propio carrito)
+    y añade la cabecera X-Session-Key para invitados.
+    """
+    precargar_items(cart)
+    serializer = CartSerializer(cart, context={'request': request})
+    response = Response(serializer.data, status=status.HTTP_200_OK)
+    if session_key:
+        response['X-Session-Key'] = session_key
+    return response
+
+def respuesta_carrito_vacio(session_key):
+    """
+    Respuesta de un carrito de invitado que todavía no existe en la base de datos.
+    Tiene la misma forma que CartSerializer para que el frontend no note la diferencia.
+    """
+    data = {
+        'id': None,
+        'user': None,
+        'session_key': session_key,
+        'items': [],
+        'total_items': 0,
+        'total_price': 0,
+        'created_at': None,
+        'updated_at': None,
+    }
+    response = Response(data, status=status.HTTP_200_OK)
+    response['X-Session-Key'] = session_key
+    return response
+
+
+def session_key_valida(session_key):
+    # Solo se adoptan claves con el formato que genera el propio backend (UUID canónico)
+    try:
+        return str(uuid.UUID(session_key)) == session_key
+    except (TypeError, ValueError, AttributeError):
+        return False
+
 
 class CartView(APIView):
     """
     Vista principal para gestionar el carrito de compras.
     Permite obtener, añadir, actualizar y eliminar ítems del carrito.
     """
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [JWTSinConsultaAuthentication]
     permission_classes = [AllowAny]
 
-    def get_cart(self, request):
+    def get_cart(self, request, crear=True):
         """
         Intenta obtener el carrito basado en el usuario autenticado o en la session_key.
         Maneja la fusión de carritos de invitado a carritos de usuario al autenticarse.
-        Crea un nuevo carrito si no existe.
+        Crea un nuevo carrito si no existe. Con crear=False, para invitados sin carrito
+        devuelve None sin escribir nada (la session_key a usar queda en
+        current_session_key_to_send y el carrito se creará con ella en la primera
+        modificación).
         """
         cart = None
         # Nueva variable para almacenar la session_key que debe ser devuelta en la cabecera
@@ -36,41 +156,12 @@ class CartView(APIView):
 
         # --- Lógica para usuarios autenticados ---
         if request.user.is_authenticated:
-            user_cart, user_cart_created = Cart.objects.get_or_create(user=request.user)
+            user_cart, user_cart_created = Cart.objects.select_related('user').get_or_create(user=request.user)
             cart = user_cart
 
             # Si el usuario estaba navegando como invitado y ahora se autenticó
             if session_key_from_header:
-                try:
-                    guest_cart = Cart.objects.get(session_key=session_key_from_header, user__isnull=True)
-                    
-                    # Si existe un carrito de invitado y no es el mismo que el de usuario (si ya existía)
-                    if guest_cart != user_cart:
-                        with transaction.atomic():
-                            # Fusionar ítems del carrito de invitado al carrito del usuario
-                            for guest_item in guest_cart.items.all():
-                                existing_item = CartItem.objects.filter(
-                                    cart=user_cart, product=guest_item.product
-                                ).first()
-
-                                if existing_item:
-                                    # Si el producto ya está en el carrito del usuario, actualiza la cantidad
-                                    existing_item.quantity = F('quantity') + guest_item.quantity
-                                    existing_item.save()
-                                else:
-                                    # Si no está, mueve el ítem del carrito de invitado al del usuario
-                                    guest_item.cart = user_cart
-                                    guest_item.save()
-
-                            # Eliminar el carrito de invitado después de fusionar sus ítems
-                            guest_cart.delete()
-                            import logging
-                            logger = logging.getLogger(__name__)
-                            logger.info(f"Carrito de invitado fusionado y eliminado.")
-
-                except Cart.DoesNotExist:
-                    # No hay carrito de invitado con esa session_key, no hay nada que fusionar.
-                    pass
+                fusionar_carrito_invitado(user_cart, session_key_from_header)
             
             # Asegurarse de que el carrito del usuario autenticado no tenga una session_key.
             if cart and cart.session_key:
@@ -86,7 +177,7 @@ class CartView(APIView):
             # 1. Intentar obtener el carrito por la session_key de la cabecera
             if session_key_from_header:
                 try:
-                    cart = Cart.objects.get(session_key=session_key_from_header, user__isnull=True)
+                    cart = Cart.objects.select_related('user').get(session_key=session_key_from_header, user__isnull=True)
                     # CORRECCIÓN: Si encontramos un carrito existente, su session_key es la que debemos devolver.
                     self.current_session_key_to_send = cart.session_key 
                     return cart
@@ -95,30 +186,37 @@ class CartView(APIView):
                     # `cart` permanece None y se creará uno nuevo.
                     pass
             
-            # 2. Si no hay session_key válida o no se encontró un carrito existente, crear uno nuevo
-            if not cart: # Solo si no se encontró un carrito hasta ahora
+            # 2. Si no se encontró un carrito, se reutiliza la session_key recibida (la que
+            # se entregó en un GET anterior sin crear el carrito) o se genera una nueva.
+            if session_key_valida(session_key_from_header):
+                new_session_key = session_key_from_header
+            else:
+                new_session_key = str(uuid.uuid4())
+            self.current_session_key_to_send = new_session_key
+            if not crear:
+                return None
+
+            try:
+                # get_or_create por si llegan a la vez dos peticiones con la misma clave nueva
+                cart, _ = Cart.objects.get_or_create(session_key=new_session_key, user__isnull=True)
+            except IntegrityError:
+                # La clave pertenece a un carrito que ya no es de invitado
                 new_session_key = str(uuid.uuid4())
                 cart = Cart.objects.create(session_key=new_session_key, user=None)
-                # CORRECCIÓN: Al crear un nuevo carrito, esta es la session_key a devolver.
                 self.current_session_key_to_send = new_session_key
-
             return cart
 
     def get(self, request, *args, **kwargs):
         """
-        Obtiene el carrito actual del usuario o crea uno nuevo si no existe.
+        Obtiene el carrito actual del usuario. Un invitado sin carrito recibe uno
+        vacío (con su X-Session-Key) sin que se cree nada en la base de datos.
         """
-        cart = self.get_cart(request)
-        serializer = CartSerializer(cart, context={'request': request})
-        response_data = serializer.data
-        
-        response = Response(response_data, status=status.HTTP_200_OK)
-
+        cart = self.get_cart(request, crear=False)
+        if cart is None:
+            return respuesta_carrito_vacio(self.current_session_key_to_send)
         # CORRECCIÓN: Siempre devuelve la session_key si es un carrito de invitado
         # (current_session_key_to_send solo tiene valor si es invitado)
-        if self.current_session_key_to_send:
-            response['X-Session-Key'] = self.current_session_key_to_send
-        return response
+        return respuesta_carrito(request, cart, self.current_session_key_to_send)
 
     def post(self, request, *args, **kwargs):
         """
@@ -152,15 +250,10 @@ class CartView(APIView):
             if not created:
                 cart_item.quantity += quantity
                 cart_item.save()
+            marcar_actividad(cart)
 
-            cart.refresh_from_db()
-            response_serializer = CartSerializer(cart, context={'request': request})
-            
-            response = Response(response_serializer.data, status=status.HTTP_200_OK)
-            # CORRECCIÓN: Siempre devuelve la session_key si es un carrito de invitado
-            if self.current_session_key_to_send:
-                response['X-Session-Key'] = self.current_session_key_to_send
-            return response
+        # CORRECCIÓN: Siempre devuelve la session_key si es un carrito de invitado
+        return respuesta_carrito(request, cart, self.current_session_key_to_send)
 
 
     def put(self, request, *args, **kwargs):
@@ -191,15 +284,10 @@ class CartView(APIView):
                 
                 cart_item.quantity = new_quantity
                 cart_item.save()
+            marcar_actividad(cart)
 
-            cart.refresh_from_db()
-            response_serializer = CartSerializer(cart, context={'request': request})
-            
-            response = Response(response_serializer.data, status=status.HTTP_200_OK)
-            # CORRECCIÓN: Siempre devuelve la session_key si es un carrito de invitado
-            if self.current_session_key_to_send:
-                response['X-Session-Key'] = self.current_session_key_to_send
-            return response
+        # CORRECCIÓN: Siempre devuelve la session_key si es un carrito de invitado
+        return respuesta_carrito(request, cart, self.current_session_key_to_send)
 
 
     def delete(self, request, *args, **kwargs):
@@ -211,7 +299,9 @@ class CartView(APIView):
         if not product_id:
             return Response({"detail": "Se requiere 'product_id' para eliminar un ítem del carrito."}, status=status.HTTP_400_BAD_REQUEST)
         
-        cart = self.get_cart(request) # Obtiene el carrito
+        cart = self.get_cart(request, crear=False) # Obtiene el carrito
+        if cart is None:
+            return Response({"detail": "El producto no está en el carrito."}, status=status.HTTP_404_NOT_FOUND)
 
         with transaction.atomic():
             try:
@@ -219,19 +309,85 @@ class CartView(APIView):
                 cart_item.delete()
             except CartItem.DoesNotExist:
                 return Response({"detail": "El producto no está en el carrito."}, status=status.HTTP_404_NOT_FOUND)
+            marcar_actividad(cart)
+
+        # CORRECCIÓN: Siempre devuelve la session_key si es un carrito de invitado
+        return respuesta_carrito(request, cart, self.current_session_key_to_send)
+
+class CartBatchView(CartView):
+    """
+    Aplica una lista de operaciones (add / set / remove) al carrito en una sola
+    transacción, por ejemplo para restaurar un carrito guardado o añadir un pack.
+    Espera un JSON como:
+    {
+        "operaciones": [
+            {"op": "add", "product_id": 1, "quantity": 2},
+            {"op": "set", "product_id": 5, "quantity": 1},
+            {"op": "remove", "product_id": 7}
+        ]
+    }
+    """
+    http_method_names = ['post', 'options']
+
+    def post(self, request, *args, **kwargs):
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operaciones = serializer.validated_data['operaciones']
+        productos = serializer.validated_data['productos']
+
+        cart = self.get_cart(request)
+
+        with transaction.atomic():
+            # Bloquea el carrito (el UPDATE de updated_at toma el bloqueo de fila)
+            # para que dos lotes concurrentes no se pisen
+            if not marcar_actividad(cart):
+                # limpiar_carritos lo borró entre get_cart y el bloqueo: se crea de nuevo,
+                # vacío, con la misma session_key (o para el mismo usuario)
+                cart = self.get_cart(request)
+                marcar_actividad(cart)
+            existentes = {item.product_id: item for item in CartItem.objects.filter(cart=cart)}
+
+            # Se calculan las cantidades finales en memoria, en el orden recibido
+            cantidades = {product_id: item.quantity for product_id, item in existentes.items()}
+            for op in operaciones:
+                product_id = op['product_id']
+                if op['op'] == 'add':
+                    cantidades[product_id] = cantidades.get(product_id, 0) + op['quantity']
+                elif op['op'] == 'set':
+                    cantidades[product_id] = op['quantity']
+                else:
+                    cantidades[product_id] = 0
+
+            ahora = timezone.now()
+            nuevos, modificados, eliminados = [], [], []
+            for product_id, cantidad in cantidades.items():
+                item = existentes.get(product_id)
+                if item is None:
+                    if cantidad > 0:
+                        product = productos[product_id]
+                        nuevos.append(CartItem(
+                            cart=cart, product=product, quantity=cantidad, price_at_addition=product.precio,
+                        ))
+                elif cantidad <= 0:
+                    eliminados.append(item.pk)
+                elif cantidad != item.quantity:
+                    item.quantity = cantidad
+                    item.updated_at = ahora  # bulk_update no aplica auto_now
+                    modificados.append(item)
+
+            if eliminados:
+                CartItem.objects.filter(pk__in=eliminados).delete()
+            if modificados:
+                CartItem.objects.bulk_update(modificados, ['quantity', 'updated_at'])
+            if nuevos:
+                CartItem.objects.bulk_create(nuevos)
+
+        return respuesta_carrito(request, cart, self.current_session_key_to_send)
 
-            cart.refresh_from_db()
-            response_serializer = CartSerializer(cart, context={'request': request})
-            
-            response = Response(response_serializer.data, status=status.HTTP_200_OK)
-            # CORRECCIÓN: Siempre devuelve la session_key si es un carrito de invitado
-            if self.current_session_key_to_send:
-                response['X-Session-Key'] = self.current_session_key_to_send
-            return response
 
 # Si tienes una vista para limpiar todo el carrito, también necesita la cabecera
 class ClearCartView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [JWTSinConsultaAuthentication]
     permission_classes = [AllowAny]
 
     def delete(self, request, *args, **kwargs):
@@ -270,11 +426,5 @@ class ClearCartView(APIView):
             else:
                 cart.save() # Asegurarse de guardar si hubo cambios (ej. si se eliminó la session_key en el carrito de usuario)
 
-            cart.refresh_from_db()
-            response_serializer = CartSerializer(cart, context={'request': request})
-            response = Response(response_serializer.data, status=status.HTTP_200_OK)
-
-            # Envía la session_key actual (o la nueva si se generó) para invitados
-            if current_session_key_to_send:
-                response['X-Session-Key'] = current_session_key_to_send
-            return response
\ No newline at end of file
+        # Envía la session_key actual (o la nueva si se generó) para invitados
+        return respuesta_carrito(request, cart, current_session_key_to_send)
\ No newline at end of file